@@ -0,0 +1,44 @@
+// composables/useServerClock.js
+import { ref, onMounted, onBeforeUnmount } from 'vue'
+
+// Server clock as estimated by the client, shared between components.
+// The API stamps each response with `server_time` (unix seconds); arrival
+// countdowns are computed locally from the absolute timestamps of the bus
+// objects, so they stay accurate between polls.
+const offsetMs = ref(0)
+const now = ref(Date.now())
+let ticker = null
+let users = 0
+
+function tick() {
+  now.value = Date.now() + offsetMs.value
+}
+
+export function useServerClock() {
+  const sync = (serverTime) => {
+    if (typeof serverTime !== 'number') return
+    offsetMs.value = serverTime * 1000 - Date.now()
+    tick()
+  }
+
+  // Whole minutes until a unix timestamp (seconds), never negative
+  const minutesUntil = (unixSeconds) => {
+    return Math.max(0, Math.floor((unixSeconds * 1000 - now.value) / 60000))
+  }
+
+  onMounted(() => {
+    if (users++ === 0) {
+      tick()
+      ticker = setInterval(tick, 1000)
+    }
+  })
+
+  onBeforeUnmount(() => {
+    if (--users === 0 && ticker) {
+      clearInterval(ticker)
+      ticker = null
+    }
+  })
+
+  return { now, sync, minutesUntil }
+}
@@ -5,11 +5,13 @@ import subprocess
 import threading
 import time
 import logging
+import secrets
 from datetime import datetime
 from pathlib import Path
 
 from flask import (
     Flask,
+    Response,
     jsonify,
     request,
     redirect,
@@ -29,6 +31,13 @@ except ImportError:
     from backend.managers import update_manager
     from backend.managers import background_manager
 
+try:
+    from loaders.gtfs_source import ZipSource, DirectorySource, GTFS_ZIP
+    from loaders import gtfs_diff
+except ImportError:
+    from backend.loaders.gtfs_source import ZipSource, DirectorySource, GTFS_ZIP
+    from backend.loaders import gtfs_diff
+
 print(f"[DEBUG] Running admin.py from {Path(__file__).resolve()}")
 
 if getattr(sys, "_MEIPASS", None):
@@ -59,6 +68,10 @@ SPA_DIST = ADMIN_DIST_DIR
 # Ensure static images dir exists
 background_manager.STATIC_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
 
+# Main app (started by admin_start) and the token its admin-only endpoints expect
+MAIN_APP_PORT = int(os.environ.get("MAIN_APP_PORT", 5000))
+MAIN_APP_TOKEN = os.environ.get("ADMIN_TOKEN") or secrets.token_urlsafe(32)
+
 main_app_logs = []
 app_process = None
 
@@ -364,6 +377,45 @@ def auto_update_settings():
     flash("Paramètres de mise à jour automatique enregistrés", "success")
     return redirect(url_for("serve_spa", path=""))
 
+def _diff_gtfs(target, new_zip):
+    """Changeset from the GTFS currently in `target` to the uploaded zip, or None."""
+    old_source = DirectorySource(target)
+    if old_source.missing(["routes.txt", "trips.txt", "stop_times.txt"]):
+        return None        # first upload: nothing to compare with
+    try:
+        started = time.monotonic()
+        changeset = gtfs_diff.diff_sources(old_source, ZipSource(new_zip))
+        logger.info("GTFS diff computed in %.1fs: %s",
+                    time.monotonic() - started, gtfs_diff.describe(changeset))
+        return changeset
+    except Exception as e:
+        logger.warning("GTFS diff failed, the main app will reload every table: %s", e)
+        return None
+
+def _describe_changes(counts):
+    labels = {"trips": "voyages", "stops": "arrêts", "routes": "lignes"}
+    parts = []
+    for table, label in labels.items():
+        c = counts.get(table)
+        if c and (c["added"] or c["removed"] or c["changed"]):
+            parts.append(f"{label} : +{c['added']} / -{c['removed']} / ~{c['changed']}")
+    return "Changements GTFS — " + ("; ".join(parts) if parts else "aucun voyage, arrêt ou ligne modifié")
+
+def _reload_main_app_gtfs():
+    """Have the running main app pick up the new files without a restart."""
+    if not (app.config["APP_RUNNING"] and app_process):
+        return
+    import requests
+    try:
+        resp = requests.post(
+            f"http://127.0.0.1:{MAIN_APP_PORT}/api/admin/gtfs/reload",
+            headers={"X-Admin-Token": MAIN_APP_TOKEN},
+            timeout=120,
+        )
+        logger.info("Main app GTFS reload: %s %s", resp.status_code, resp.text[:500])
+    except Exception as e:
+        logger.warning("Main app GTFS reload failed (restart it to load the new files): %s", e)
+
 @app.route("/admin/update_gtfs", methods=["POST"])
 def admin_update_gtfs():
     transport = request.form.get("transport", "").lower()
@@ -380,37 +432,39 @@ def admin_update_gtfs():
     GTFS_ROOT = PROJECT_ROOT / "backend" / "GTFS"
     stm_dir = GTFS_ROOT / "stm"
 
-    if transport == "stm":
-        target = stm_dir
+    if transport != "stm":
+        flash(f"Réseau inconnu : {transport}", "warning")
+        return redirect(url_for("serve_spa", path=""))
+    target = stm_dir
 
-    timestamp = int(time.time())
-    tmp_zip = GTFS_ROOT / f"{transport}_uploaded_{timestamp}.zip"
-    staging = GTFS_ROOT / f".tmp_extract_{transport}_{timestamp}"
+    # The archive is kept as is and read table by table by the loaders
+    # (backend/loaders/gtfs_source.py); nothing is extracted.
+    tmp_zip = target / f"{GTFS_ZIP}.part"
 
     try:
+        target.mkdir(parents=True, exist_ok=True)
         z.save(tmp_zip)
 
-        with zipfile.ZipFile(tmp_zip, "r") as archive:
-            archive.extractall(staging)
-
-        entries = list(staging.iterdir())
-        if len(entries) == 1 and entries[0].is_dir():
-            extracted_root = entries[0]
-        else:
-            extracted_root = staging
-
-        if target.exists():
-            import shutil
-            shutil.rmtree(target)
-        import shutil
-        shutil.move(str(extracted_root), str(target))
+        missing = ZipSource(tmp_zip).missing(["routes.txt", "trips.txt", "stop_times.txt"])
+        if missing:
+            raise ValueError(f"tables manquantes dans l'archive : {', '.join(missing)}")
+        changeset = _diff_gtfs(target, tmp_zip)
+        os.replace(tmp_zip, target / GTFS_ZIP)
 
-        if staging.exists():
+        # Extracted copies of the archive's tables would shadow it
+        for table in ZipSource(target / GTFS_ZIP).tables():
             try:
-                shutil.rmtree(staging)
-            except:
+                (target / table).unlink()
+            except FileNotFoundError:
                 pass
 
+        if changeset is not None:
+            gtfs_diff.save_changeset(target, changeset)
+            flash(_describe_changes(gtfs_diff.describe(changeset)), "info")
+        else:
+            (target / gtfs_diff.CHANGESET_FILE).unlink(missing_ok=True)
+        _reload_main_app_gtfs()
+
         # Record update time
         info = update_manager.load_gtfs_update_info()
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -427,12 +481,6 @@ def admin_update_gtfs():
                 tmp_zip.unlink()
             except:
                 pass
-        if staging.exists():
-            try:
-                import shutil
-                shutil.rmtree(staging)
-            except:
-                pass
 
     return redirect(url_for("serve_spa", path=""))
 
@@ -455,9 +503,15 @@ def admin_start():
             
             logger.info(f"Starting main app with command: {' '.join(cmd)}")
             
+            child_env = {
+                **os.environ,
+                "PORT": str(MAIN_APP_PORT),
+                "ADMIN_TOKEN": MAIN_APP_TOKEN,
+            }
             app_process = subprocess.Popen(
                 cmd,
                 cwd=str(PROJECT_ROOT), 
+                env=child_env,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
                 universal_newlines=True,
@@ -490,6 +544,41 @@ def admin_stop():
 def admin_status():
     return jsonify({"running": app.config["APP_RUNNING"]})
 
+@app.route("/admin/profile", methods=["POST"])
+def admin_profile():
+    """Run the sampling profiler inside the main app and relay the result."""
+    if not (app.config["APP_RUNNING"] and app_process):
+        return jsonify({"status": "not_running"}), 409
+
+    import requests
+    seconds = request.args.get("seconds", request.form.get("seconds", "10"))
+    params = {
+        "seconds": seconds,
+        "top": request.args.get("top", "25"),
+        "format": request.args.get("format", "json"),
+    }
+    try:
+        timeout = float(seconds) + 15
+    except ValueError:
+        return jsonify({"status": "error", "error": "invalid seconds"}), 400
+
+    try:
+        resp = requests.post(
+            f"http://127.0.0.1:{MAIN_APP_PORT}/api/admin/profile",
+            params=params,
+            headers={"X-Admin-Token": MAIN_APP_TOKEN},
+            timeout=timeout,
+        )
+    except Exception as e:
+        logger.error("Profiling request failed: %s", e)
+        return jsonify({"status": "error", "error": str(e)}), 502
+
+    headers = {}
+    if "Content-Disposition" in resp.headers:
+        headers["Content-Disposition"] = resp.headers["Content-Disposition"]
+    return Response(resp.content, status=resp.status_code,
+                    mimetype=resp.headers.get("Content-Type", "application/json"), headers=headers)
+
 @app.route("/admin/logs_data")
 def logs_data():
     return "\n".join(main_app_logs)
@@ -3,6 +3,8 @@ STM Alerts Processing Module
 Filters alerts to only show relevant ones for your specific stops
 """
 
+from .models import Alert
+
 # Your specific stops - only show alerts for these
 OUR_STOP_IDS = {"52743", "52744", "62248", "62355"}
 OUR_ROUTES = {"36", "61"}
@@ -38,7 +40,7 @@ def process_stm_alerts():
                 print(f"\nProcessing alert {i+1}...")
                 
                 # Get informed entities
-                informed_entities = alert.get("informed_entities", [])
+                informed_entities = alert.informed_entities
                 print(f"  Informed entities: {informed_entities}")
                 
                 # Check if network-wide alert
@@ -47,37 +49,24 @@ def process_stm_alerts():
                 affected_stops = set()
                 
                 for entity in informed_entities:
-                    if entity.get("agency_id") == "STM":
+                    if entity.agency_id == "STM":
                         is_network_alert = True
                         print("  -> This is a NETWORK-WIDE alert")
                     
-                    route = entity.get("route_short_name")
+                    route = entity.route_short_name
                     if route:
                         affected_routes.add(route)
                         print(f"  -> Affects route: {route}")
                     
                     # Check for stop_code
-                    stop_code = entity.get("stop_code")
+                    stop_code = entity.stop_code
                     if stop_code:
                         affected_stops.add(stop_code)
                         print(f"  -> Affects stop: {stop_code}")
                 
                 # Get French header and description
-                header_texts = alert.get("header_texts", [])
-                description_texts = alert.get("description_texts", [])
-                
-                french_header = ""
-                french_description = ""
-                
-                for header in header_texts:
-                    if header.get("language") == "fr":
-                        french_header = header.get("text", "")
-                        break
-                
-                for desc in description_texts:
-                    if desc.get("language") == "fr":
-                        french_description = desc.get("text", "")
-                        break
+                french_header = alert.header("fr")
+                french_description = alert.description("fr")
                 
                 # Remove HTML tags
                 french_description = re.sub(r'<[^>]+>', '', french_description)
@@ -88,14 +77,14 @@ def process_stm_alerts():
                 # Decide what to do with this alert
                 if is_network_alert:
                     # NETWORK-WIDE ALERT - Always include
-                    alert_obj = {
-                        "header": french_header or "Alerte STM",
-                        "description": french_description or "Aucune description disponible",
-                        "routes": [],
-                        "is_network_wide": True,
-                        "alert_type": "general_network",
-                        "severity": "info"
-                    }
+                    alert_obj = Alert(
+                        header=french_header or "Alerte STM",
+                        description=french_description or "Aucune description disponible",
+                        routes=[],
+                        is_network_wide=True,
+                        alert_type="general_network",
+                        severity="info"
+                    )
                     all_alerts.append(alert_obj)
                     print("  [OK] Added as NETWORK alert")
                     
@@ -111,15 +100,15 @@ def process_stm_alerts():
                             
                             if our_stops:
                                 # STOP-SPECIFIC ALERT for our stops!
-                                alert_obj = {
-                                    "header": french_header or "Alerte d'arrêt",
-                                    "description": french_description or "Aucune description disponible",
-                                    "routes": list(our_routes),
-                                    "stops": list(our_stops),
-                                    "is_network_wide": False,
-                                    "alert_type": "stop_specific",
-                                    "severity": "warning"
-                                }
+                                alert_obj = Alert(
+                                    header=french_header or "Alerte d'arrêt",
+                                    description=french_description or "Aucune description disponible",
+                                    routes=list(our_routes),
+                                    stops=list(our_stops),
+                                    is_network_wide=False,
+                                    alert_type="stop_specific",
+                                    severity="warning"
+                                )
                                 all_alerts.append(alert_obj)
                                 print(f"  [OK] Added as STOP alert for stops {', '.join(our_stops)} on route {', '.join(our_routes)}")
                             else:
@@ -136,14 +125,14 @@ def process_stm_alerts():
                             
                             if mentioned_our_stops:
                                 # The description mentions one of our stops
-                                alert_obj = {
-                                    "header": french_header or "Alerte de ligne",
-                                    "description": french_description or "Aucune description disponible",
-                                    "routes": list(our_routes),
-                                    "is_network_wide": False,
-                                    "alert_type": "route_specific",
-                                    "severity": "warning"
-                                }
+                                alert_obj = Alert(
+                                    header=french_header or "Alerte de ligne",
+                                    description=french_description or "Aucune description disponible",
+                                    routes=list(our_routes),
+                                    is_network_wide=False,
+                                    alert_type="route_specific",
+                                    severity="warning"
+                                )
                                 all_alerts.append(alert_obj)
                                 print(f"  [OK] Added as ROUTE alert (mentions our stops in text) for {', '.join(our_routes)}")
                             else:
@@ -0,0 +1,281 @@
+"""
+Delay and headway analytics over successive trip-update snapshots.
+
+    analytics.observe_trip_updates(feed_timestamp, entities)
+    analytics.summary(route="61")
+
+Every new trip-updates feed (deduplicated by header timestamp) adds:
+
+* one delay sample per (route, stop) prediction, to a per-stop series, and
+  one per trip (at its next stop) to a per-route series, so a single feed
+  does not fill the route's window. The delay is the feed's arrival.delay,
+  or the predicted arrival minus the GTFS scheduled time when the feed has
+  no delay field;
+* one arrival event per trip at each watched stop (BUS_ROUTE_COMBOS), taken
+  from the last prediction made before the stop dropped out of the trip's
+  updates. The gap to the previous arrival is a headway sample. A headway
+  shorter than BUNCHING_RATIO of the recent mean counts as bunching.
+
+Series are fixed-size ring buffers with running sums, so an update is O(1),
+and the number of series and tracked predictions is capped, so memory is
+bounded whatever the uptime. Percentiles are computed on read.
+"""
+import math
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from backend.config import BUS_ROUTES, BUS_ROUTE_COMBOS, ANALYTICS_WINDOW
+
+MAX_SERIES = 4096          # (route, stop) delay series kept, least recently updated evicted
+MAX_PENDING = 4096         # upcoming (trip, stop) arrivals tracked at watched stops
+BUNCHING_RATIO = 0.25      # headway below this share of the mean headway = bunching
+MIN_BUNCHING_HEADWAY = 60  # seconds; always bunching below this
+PENDING_GRACE = 30 * 60    # seconds; a prediction older than this is dropped, not counted
+
+
+class RingBuffer:
+    """Last `capacity` float samples with O(1) append, mean and variance."""
+    __slots__ = ("capacity", "values", "next", "count", "total", "total_sq")
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.values = array("d", bytes(8 * capacity))
+        self.next = 0
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def append(self, value):
+        if self.count == self.capacity:
+            old = self.values[self.next]
+            self.total -= old
+            self.total_sq -= old * old
+        else:
+            self.count += 1
+        self.values[self.next] = value
+        self.total += value
+        self.total_sq += value * value
+        self.next = (self.next + 1) % self.capacity
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def stdev(self):
+        if self.count < 2:
+            return None
+        mean = self.total / self.count
+        return math.sqrt(max(0.0, self.total_sq / self.count - mean * mean))
+
+    def samples(self):
+        if self.count < self.capacity:
+            return list(self.values[:self.count])
+        return list(self.values[self.next:]) + list(self.values[:self.next])
+
+    def percentiles(self, *pcts):
+        ordered = sorted(self.samples())
+        if not ordered:
+            return [None for _ in pcts]
+        return [ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))] for p in pcts]
+
+
+def _describe(ring, scale=1.0):
+    if not ring.count:
+        return {"samples": 0}
+    p50, p90 = ring.percentiles(50, 90)
+    stdev = ring.stdev()
+    return {
+        "samples": ring.count,
+        "mean": round(ring.mean() / scale, 2),
+        "stdev": round(stdev / scale, 2) if stdev is not None else None,
+        "p50": round(p50 / scale, 2),
+        "p90": round(p90 / scale, 2),
+    }
+
+
+class DelayAnalytics:
+    def __init__(self, window=ANALYTICS_WINDOW, watched=BUS_ROUTE_COMBOS, routes=BUS_ROUTES):
+        self.window = window
+        self.routes = set(routes)
+        self.watched_stops = {(route, stop) for route, stop, _ in watched}
+        self._lock = threading.Lock()
+        self._schedule = {}
+        self._service_days = {}            # start_date -> local midnight (datetime)
+        self._last_feed_ts = 0
+        self._route_delays = {}            # route -> RingBuffer (seconds)
+        self._stop_delays = OrderedDict()  # (route, stop) -> RingBuffer (seconds)
+        self._headways = {}                # (route, stop) -> RingBuffer (seconds)
+        self._bunching = {}                # (route, stop) -> RingBuffer of 0/1
+        self._last_arrival = {}            # (route, stop) -> unix time of the last arrival
+        self._pending = OrderedDict()      # (trip, route, stop) -> last predicted arrival
+        self.feeds_observed = 0
+
+    def set_schedule(self, stop_times):
+        """
+        {(trip_id, stop_id): "HH:MM:SS"} used when the feed has no delay field,
+        or a callable returning it (lazily loaded GTFS that may be replaced;
+        None while it is not loaded skips the scheduled-time fallback).
+        """
+        self._schedule = stop_times or {}
+
+    def _schedule_table(self):
+        if callable(self._schedule):
+            return self._schedule() or {}
+        return self._schedule
+
+    # ─── Ingestion ─────────────────────────────────────────────
+    def _scheduled_unix(self, schedule, trip, stop_id):
+        sched = schedule.get((trip.trip_id, stop_id))
+        if not sched or not trip.start_date:
+            return None
+        try:
+            h, m, s = map(int, sched.split(":"))
+            service_day = self._service_days.get(trip.start_date)
+            if service_day is None:
+                if len(self._service_days) > 16:
+                    self._service_days.clear()
+                service_day = self._service_days[trip.start_date] = datetime.strptime(trip.start_date, "%Y%m%d")
+        except ValueError:
+            return None
+        return (service_day + timedelta(hours=h, minutes=m, seconds=s)).timestamp()
+
+    def _delay(self, schedule, trip, stop_time):
+        event = stop_time.arrival if stop_time.HasField("arrival") else (
+            stop_time.departure if stop_time.HasField("departure") else None)
+        if event is None:
+            return None, None
+        if event.HasField("delay"):
+            return float(event.delay), event.time or None
+        if not event.time:
+            return None, None
+        scheduled = self._scheduled_unix(schedule, trip, stop_time.stop_id)
+        if scheduled is None:
+            return None, event.time
+        return float(event.time - scheduled), event.time
+
+    def _series(self, key):
+        ring = self._stop_delays.get(key)
+        if ring is None:
+            ring = self._stop_delays[key] = RingBuffer(self.window)
+            if len(self._stop_delays) > MAX_SERIES:
+                self._stop_delays.popitem(last=False)
+        else:
+            self._stop_delays.move_to_end(key)
+        return ring
+
+    def _record_arrival(self, route, stop_id, arrived_at):
+        key = (route, stop_id)
+        previous = self._last_arrival.get(key)
+        if previous is not None and arrived_at <= previous:
+            return
+        self._last_arrival[key] = arrived_at
+        if previous is None:
+            return
+        headway = arrived_at - previous
+        headways = self._headways.setdefault(key, RingBuffer(self.window))
+        mean = headways.mean() if headways.count >= 5 else None
+        bunched = headway < MIN_BUNCHING_HEADWAY or (mean is not None and headway < BUNCHING_RATIO * mean)
+        headways.append(headway)
+        self._bunching.setdefault(key, RingBuffer(self.window)).append(1.0 if bunched else 0.0)
+
+    def observe_trip_updates(self, feed_ts, entities):
+        """Add one trip-updates snapshot; snapshots already seen are ignored."""
+        # Resolved outside the lock: a lazy table must not hold up summary()
+        schedule = self._schedule_table()
+        with self._lock:
+            if not feed_ts or feed_ts <= self._last_feed_ts:
+                return False
+            self._last_feed_ts = feed_ts
+            self.feeds_observed += 1
+            seen = set()
+
+            for entity in entities:
+                if not entity.HasField("trip_update"):
+                    continue
+                trip = entity.trip_update.trip
+                route = trip.route_id
+                if route not in self.routes:
+                    continue
+                route_ring = self._route_delays.get(route)
+                if route_ring is None:
+                    route_ring = self._route_delays[route] = RingBuffer(self.window)
+
+                trip_delay = None
+                for stop_time in entity.trip_update.stop_time_update:
+                    if stop_time.schedule_relationship == 1:  # SKIPPED
+                        continue
+                    delay, predicted = self._delay(schedule, trip, stop_time)
+                    if delay is not None:
+                        if trip_delay is None:
+                            trip_delay = delay
+                        self._series((route, stop_time.stop_id)).append(delay)
+                    if predicted and (route, stop_time.stop_id) in self.watched_stops:
+                        key = (trip.trip_id, route, stop_time.stop_id)
+                        seen.add(key)
+                        self._pending[key] = predicted
+                        self._pending.move_to_end(key)
+                if trip_delay is not None:
+                    route_ring.append(trip_delay)
+
+            # A watched stop that left a trip's updates has been served at
+            # its last predicted time.
+            for key in [k for k in self._pending if k not in seen]:
+                predicted = self._pending.pop(key)
+                if feed_ts - PENDING_GRACE <= predicted <= feed_ts + 120:
+                    self._record_arrival(key[1], key[2], predicted)
+            while len(self._pending) > MAX_PENDING:
+                self._pending.popitem(last=False)
+            return True
+
+    # ─── Reporting ─────────────────────────────────────────────
+    def summary(self, route=None):
+        with self._lock:
+            routes = sorted(self._route_delays) if route is None else [route]
+            result = {"feeds_observed": self.feeds_observed, "last_feed_ts": self._last_feed_ts,
+                      "window": self.window, "routes": {}}
+            for r in routes:
+                ring = self._route_delays.get(r)
+                if ring is None:
+                    continue
+                stops = {
+                    stop: _describe(series, 60.0)
+                    for (rr, stop), series in self._stop_delays.items() if rr == r
+                }
+                headways = {}
+                for (rr, stop), series in self._headways.items():
+                    if rr != r:
+                        continue
+                    stats = _describe(series, 60.0)
+                    mean = series.mean()
+                    stats["cv"] = round(series.stdev() / mean, 2) if mean and series.stdev() is not None else None
+                    bunching = self._bunching.get((rr, stop))
+                    stats["bunching_rate"] = round(bunching.mean(), 3) if bunching and bunching.count else 0.0
+                    headways[stop] = stats
+                delay = _describe(ring, 60.0)
+                result["routes"][r] = {
+                    "delay_minutes": delay,
+                    "average_delay_minutes": delay.get("mean"),
+                    "stops": stops,
+                    "headways_minutes": headways,
+                }
+            return result
+
+
+_engine = DelayAnalytics()
+
+
+def get_engine():
+    return _engine
+
+
+def observe_trip_updates(feed_ts, entities):
+    return _engine.observe_trip_updates(feed_ts, entities)
+
+
+def set_schedule(stop_times):
+    _engine.set_schedule(stop_times)
+
+
+def summary(route=None):
+    return _engine.summary(route)
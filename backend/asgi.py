@@ -0,0 +1,370 @@
+"""
+Asynchronous (ASGI) serving mode.
+
+    uvicorn backend.asgi:app --host 0.0.0.0 --port 8000
+    python -m backend.asgi
+
+Serves the same routes as backend/main.py. One asyncio task per upstream
+(STM trip updates, vehicle positions, alerts, weather) fetches with httpx
+and stores the result in the caches the Flask app already uses, so request
+handlers never wait on the network: sections are built from warm caches on
+a worker thread. Routes without an async handler (/, /metrics, admin) run
+through the Flask app.
+
+/api/stream pushes the requested sections as Server-Sent Events; every
+connected kiosk is one idle coroutine and clients asking for the same
+fields share one build per interval.
+"""
+import io
+import os
+import sys
+import json
+import asyncio
+import logging
+from urllib.parse import parse_qs
+
+try:
+    import httpx
+except ImportError:  # falls back to the blocking loaders on worker threads
+    httpx = None
+
+from backend import main, metrics, models
+from backend.config import (
+    STM_API_KEY,
+    STM_REALTIME_ENDPOINT,
+    STM_VEHICLE_POSITIONS_ENDPOINT,
+    STM_ALERTS_ENDPOINT,
+    ASGI_STREAM_INTERVAL,
+    UPSTREAM_TIMEOUT,
+)
+from backend.loaders import stm, replay
+from backend.managers import weather_manager
+
+logger = logging.getLogger('BdeB-GTFS')
+
+REFRESH_FRACTION = 0.8    # refresh each cache this far into its TTL
+BACKOFF_MAX = 30 * 60
+
+SECTION_ROUTES = {
+    "/api/buses": ["buses"],
+    "/api/metro": ["metro"],
+    "/api/alerts": ["alerts"],
+    "/api/weather": ["weather"],
+}
+CORS_HEADERS = [(b"access-control-allow-origin", b"*")]
+
+_state = {"tasks": [], "client": None, "streams": 0}
+_broadcasts = {}  # tuple(section names) -> _Broadcast
+
+
+# ─── Upstream refreshers ──────────────────────────────────────
+async def _refresh_feed(client, feed_name, endpoint, upstream):
+    headers = {"accept": "application/x-protobuf", "apiKey": STM_API_KEY}
+    with metrics.span(f"{upstream}_fetch"):
+        response = await client.get(endpoint, headers=headers)
+    if response.status_code != 200:
+        raise stm.UpstreamError(f"{upstream}: HTTP {response.status_code}")
+    entities = await asyncio.to_thread(stm._parse_feed, feed_name, upstream, response.content)
+    stm._feed_cache.put(feed_name, entities)
+
+
+async def _refresh_alerts(client):
+    headers = {"accept": "application/json", "apiKey": STM_API_KEY}
+    with metrics.span("stm_alerts_fetch"):
+        response = await client.get(STM_ALERTS_ENDPOINT, headers=headers)
+    if response.status_code != 200:
+        raise stm.UpstreamError(f"stm_alerts: HTTP {response.status_code}")
+    stm._alerts_cache.put("alerts", stm._parse_stm_alerts(response.content))
+
+
+async def _refresh_weather(client):
+    with metrics.span("weather_fetch"):
+        response = await client.get(weather_manager.weather_url())
+    response.raise_for_status()
+    weather_manager._weather_cache.put("current", weather_manager.parse_current(response.json()))
+
+
+def _upstreams(client):
+    """(name, refresh period in seconds, coroutine factory) for each upstream."""
+    return [
+        ("stm_trip_updates", stm._feed_cache.ttl,
+         lambda: _refresh_feed(client, "trip_updates", STM_REALTIME_ENDPOINT, "stm_trip_updates")),
+        ("stm_vehicle_positions", stm._feed_cache.ttl,
+         lambda: _refresh_feed(client, "vehicle_positions", STM_VEHICLE_POSITIONS_ENDPOINT, "stm_vehicle_positions")),
+        ("stm_alerts", stm._alerts_cache.ttl, lambda: _refresh_alerts(client)),
+        ("weather", weather_manager._weather_cache.ttl, lambda: _refresh_weather(client)),
+    ]
+
+
+async def _keep_fresh(name, ttl, refresh):
+    period = max(1.0, ttl * REFRESH_FRACTION)
+    failures = 0
+    while True:
+        try:
+            await refresh()
+            failures = 0
+            delay = period
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # the caches keep serving their last good value meanwhile
+            metrics.inc("upstream_errors_total", upstream=name)
+            failures += 1
+            delay = min(BACKOFF_MAX, period * 2 ** failures)
+            logger.warning(f"[ASGI] {name} refresh failed ({e}), retrying in {delay:.0f}s")
+        await asyncio.sleep(delay)
+
+
+async def _startup():
+    if replay.is_enabled():
+        logger.info("[ASGI] Replay mode: feeds are read on demand, no background refresh")
+        return
+    if main.SNAPSHOT_ROLE == "worker":
+        logger.info("[ASGI] Snapshot worker: sections come from the fetcher process")
+        return
+    if httpx is None:
+        logger.warning("[ASGI] httpx is not installed, upstream fetches will block worker threads")
+        return
+    client = httpx.AsyncClient(timeout=UPSTREAM_TIMEOUT)
+    _state["client"] = client
+    upstreams = _upstreams(client)
+    # Warm every cache before accepting traffic
+    await asyncio.gather(*(refresh() for _, _, refresh in upstreams), return_exceptions=True)
+    _state["tasks"] = [
+        asyncio.create_task(_keep_fresh(name, ttl, refresh), name=f"refresh-{name}")
+        for name, ttl, refresh in upstreams
+    ]
+
+
+async def _shutdown():
+    for task in _state["tasks"]:
+        task.cancel()
+    await asyncio.gather(*_state["tasks"], return_exceptions=True)
+    _state["tasks"] = []
+    if _state["client"] is not None:
+        await _state["client"].aclose()
+        _state["client"] = None
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await _startup()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await _shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+# ─── Section routes ───────────────────────────────────────────
+def _build(names, with_debug, stamped=True):
+    """Runs on a worker thread; returns (JSON body, Server-Timing spans)."""
+    metrics.begin_request()
+    payload = main.section_payload(names, with_debug, stamped)
+    with metrics.span("json_serialization"):
+        body = models.encode(models.ApiData(**payload))
+    return body, metrics.end_request()
+
+
+async def _send_json(send, status, body, extra_headers=()):
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    await send({"type": "http.response.start", "status": status,
+                "headers": headers + CORS_HEADERS + list(extra_headers)})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _sections_endpoint(scope, send, path):
+    names = SECTION_ROUTES.get(path)
+    if names is None:
+        query = parse_qs(scope["query_string"].decode("latin-1"))
+        try:
+            names = main.parse_fields(query.get("fields", [""])[0])
+        except ValueError as e:
+            body = json.dumps({"error": str(e), "fields": main.PUBLIC_SECTIONS}).encode("utf-8")
+            await _send_json(send, 400, body)
+            return
+    try:
+        body, spans = await asyncio.to_thread(_build, names, path == "/api/data")
+    except Exception as e:
+        metrics.inc("api_errors_total", endpoint=path)
+        logger.error(f"Error in {path}: {e}")
+        await _send_json(send, 500, json.dumps({"error": str(e)}).encode("utf-8"))
+        return
+    extra = []
+    if spans:
+        extra.append((b"server-timing", metrics.server_timing_header(spans).encode("latin-1")))
+    await _send_json(send, 200, body, extra)
+
+
+# ─── Server-Sent Events ───────────────────────────────────────
+class _Broadcast:
+    """Serialized sections shared by every stream client asking for the same fields."""
+
+    def __init__(self, names):
+        self.names = names
+        self.lock = asyncio.Lock()
+        self.body = None
+        self.built_at = 0.0
+
+    async def latest(self, max_age):
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            if self.body is None or now - self.built_at >= max_age:
+                # Unstamped, so an unchanged payload is recognised; server_time
+                # is spliced in when an event is sent
+                self.body, _ = await asyncio.to_thread(_build, self.names, False, False)
+                self.built_at = now
+            return self.body
+
+
+async def _stream_endpoint(scope, receive, send):
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    try:
+        names = main.parse_fields(query.get("fields", [""])[0])
+    except ValueError as e:
+        await _send_json(send, 400, json.dumps({"error": str(e)}).encode("utf-8"))
+        return
+    broadcast = _broadcasts.setdefault(tuple(names), _Broadcast(names))
+
+    await send({"type": "http.response.start", "status": 200, "headers": [
+        (b"content-type", b"text/event-stream"),
+        (b"cache-control", b"no-cache"),
+        (b"x-accel-buffering", b"no"),
+    ] + CORS_HEADERS})
+
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    _state["streams"] += 1
+    metrics.inc("stream_connections_total")
+    last_sent = None
+    try:
+        while not disconnected.is_set():
+            try:
+                body = await broadcast.latest(ASGI_STREAM_INTERVAL)
+                if body != last_sent:
+                    stamp = b',"server_time":' + json.dumps(replay.current_time()).encode("utf-8")
+                    chunk = b"event: data\ndata: " + body[:-1] + stamp + b"}\n\n"
+                    last_sent = body
+                else:
+                    chunk = b": keep-alive\n\n"
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            except OSError:
+                break
+            except Exception as e:
+                logger.error(f"Error in /api/stream: {e}")
+            try:
+                await asyncio.wait_for(disconnected.wait(), ASGI_STREAM_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        _state["streams"] -= 1
+        watcher.cancel()
+
+
+# ─── WSGI fallback (Flask routes) ─────────────────────────────
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+def _wsgi_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        "CONTENT_LENGTH": str(len(body)),
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _run_wsgi(environ):
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = headers
+
+    result = main.app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return started["status"], started["headers"], body
+
+
+async def _flask_endpoint(scope, receive, send):
+    body = await _read_body(receive)
+    status, headers, content = await asyncio.to_thread(_run_wsgi, _wsgi_environ(scope, body))
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]})
+    await send({"type": "http.response.body", "body": content})
+
+
+# ─── ASGI application ─────────────────────────────────────────
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    path = scope["path"]
+    if scope["method"] == "GET":
+        if path == "/api/data" or path in SECTION_ROUTES:
+            await _sections_endpoint(scope, send, path)
+            return
+        if path == "/api/stream":
+            await _stream_endpoint(scope, receive, send)
+            return
+    await _flask_endpoint(scope, receive, send)
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("uvicorn is required for the ASGI mode: pip install uvicorn")
+    port = int(os.environ.get('PORT', 8000))
+    print(f"Starting ETS Flux (ASGI) on http://0.0.0.0:{port}")
+    uvicorn.run(app, host='0.0.0.0', port=port, log_level="warning")
@@ -0,0 +1,195 @@
+"""
+Single-flight TTL cache for upstream fetches.
+
+    _alerts_cache = CoalescingCache("stm_alerts", ttl=30)
+    alerts = _alerts_cache.get("alerts", load_alerts)
+
+When an entry is missing or expired, the first caller runs the loader while
+every concurrent caller for the same key waits on that one in-flight fetch
+instead of firing its own request. If the loader raises, callers get the
+last good value when there is one (stale_on_error), otherwise the error.
+A waiter gives up on a fetch still running after wait_timeout seconds the
+same way (CacheBackoff when there is no last good value), so one hung
+upstream connection only holds the caller that opened it.
+An optional exponential backoff stops retrying a failing upstream on every
+request.
+
+Hits, misses, coalesced waits and errors are counted in `stats` and in the
+etsflux_cache_requests_total metric.
+"""
+import threading
+
+from backend import metrics
+from backend.loaders import replay
+
+
+WAIT_TIMEOUT = 30    # seconds a caller waits on another caller's fetch
+
+
+class CacheBackoff(Exception):
+    """Raised when a key is backing off after failures, or its fetch hangs, and has no stale value."""
+
+
+class _Entry:
+    __slots__ = ("value", "stored_at")
+
+    def __init__(self, value, stored_at):
+        self.value = value
+        self.stored_at = stored_at
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class CoalescingCache:
+    def __init__(self, name, ttl, stale_on_error=True, backoff_base=None, backoff_max=None,
+                 wait_timeout=WAIT_TIMEOUT):
+        self.name = name
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.stale_on_error = stale_on_error
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max or backoff_base
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._in_flight = {}
+        self._failures = {}      # key -> consecutive failures
+        self._next_attempt = {}  # key -> earliest retry time while backing off
+        self.stats = {"hit": 0, "miss": 0, "coalesced": 0, "error": 0, "stale": 0}
+
+    @staticmethod
+    def _now():
+        return replay.current_time()
+
+    def _count(self, result):
+        self.stats[result] += 1
+        metrics.inc("cache_requests_total", cache=self.name, result=result)
+
+    def _is_fresh(self, entry, now, ttl):
+        return entry is not None and ttl > 0 and now - entry.stored_at < ttl
+
+    # ─── Blocking access ───────────────────────────────────────
+    def get(self, key, loader, ttl=None):
+        """Return the cached value, or load it once for all concurrent callers."""
+        ttl = self.ttl if ttl is None else ttl
+        now = self._now()
+        with self._lock:
+            entry = self._entries.get(key)
+            if self._is_fresh(entry, now, ttl):
+                self._count("hit")
+                return entry.value
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                self._count("coalesced")
+                leader = False
+            else:
+                if now < self._next_attempt.get(key, 0):
+                    return self._stale_or_raise(entry, CacheBackoff(f"{self.name}: backing off"))
+                flight = _Flight()
+                self._in_flight[key] = flight
+                self._count("miss")
+                leader = True
+
+        if leader:
+            self._run(key, loader, flight)
+        elif not flight.done.wait(self.wait_timeout):
+            with self._lock:
+                return self._stale_or_raise(entry, CacheBackoff(f"{self.name}: fetch in flight for too long"))
+
+        if flight.error is not None:
+            with self._lock:
+                return self._stale_or_raise(entry, flight.error)
+        return flight.value
+
+    # ─── Stale-while-revalidate access ─────────────────────────
+    def get_stale_while_revalidate(self, key, loader, cold_wait=None):
+        """
+        Return the cached value immediately, even when expired, refreshing it
+        on a background thread (at most one at a time). Only a cold key waits,
+        up to cold_wait seconds; returns None if nothing could be loaded.
+        """
+        now = self._now()
+        with self._lock:
+            entry = self._entries.get(key)
+            if self._is_fresh(entry, now, self.ttl):
+                self._count("hit")
+                return entry.value
+            flight = self._in_flight.get(key)
+            if flight is None and now >= self._next_attempt.get(key, 0):
+                flight = _Flight()
+                self._in_flight[key] = flight
+                self._count("miss")
+                threading.Thread(target=self._run, args=(key, loader, flight),
+                                 name=f"{self.name}-refresh", daemon=True).start()
+            elif entry is not None:
+                self._count("stale")
+
+        if entry is not None:
+            return entry.value
+        if flight is not None:
+            flight.done.wait(cold_wait)
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry.value if entry is not None else None
+
+    # ─── Internals ─────────────────────────────────────────────
+    def _run(self, key, loader, flight):
+        try:
+            flight.value = loader()
+            with self._lock:
+                self._entries[key] = _Entry(flight.value, self._now())
+                self._failures.pop(key, None)
+                self._next_attempt.pop(key, None)
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._count("error")
+                if self.backoff_base:
+                    failures = self._failures.get(key, 0) + 1
+                    self._failures[key] = failures
+                    delay = min(self.backoff_max, self.backoff_base * 2 ** (failures - 1))
+                    self._next_attempt[key] = self._now() + delay
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            flight.done.set()
+
+    def _stale_or_raise(self, entry, error):
+        if self.stale_on_error and entry is not None:
+            self._count("stale")
+            return entry.value
+        raise error
+
+    # ─── Maintenance ───────────────────────────────────────────
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = _Entry(value, self._now())
+
+    def peek(self, key):
+        """(value, age_seconds) without loading, or (None, None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None, None
+        return entry.value, self._now() - entry.stored_at
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._next_attempt.clear()
+                self._failures.clear()
+            else:
+                self._entries.pop(key, None)
+                self._next_attempt.pop(key, None)
+                self._failures.pop(key, None)
+
+    def backoff_remaining(self, key):
+        with self._lock:
+            return max(0.0, self._next_attempt.get(key, 0) - self._now())
@@ -6,20 +6,85 @@ load_dotenv()
 
 # STM API Credentials
 STM_API_KEY = os.getenv("STM_API_KEY")
-STM_REALTIME_ENDPOINT = "https://api.stm.info/pub/od/gtfs-rt/ic/v2/tripUpdates"
-STM_VEHICLE_POSITIONS_ENDPOINT = "https://api.stm.info/pub/od/gtfs-rt/ic/v2/vehiclePositions"
-STM_ALERTS_ENDPOINT = "https://api.stm.info/pub/od/i3/v2/messages/etatservice"
+# Endpoints can be overridden to point at a local stand-in (backend/scripts/mock_upstream.py)
+STM_REALTIME_ENDPOINT = os.getenv("STM_REALTIME_ENDPOINT", "https://api.stm.info/pub/od/gtfs-rt/ic/v2/tripUpdates")
+STM_VEHICLE_POSITIONS_ENDPOINT = os.getenv("STM_VEHICLE_POSITIONS_ENDPOINT", "https://api.stm.info/pub/od/gtfs-rt/ic/v2/vehiclePositions")
+STM_ALERTS_ENDPOINT = os.getenv("STM_ALERTS_ENDPOINT", "https://api.stm.info/pub/od/i3/v2/messages/etatservice")
+# Seconds an STM request may wait on the connection / between bytes of the response
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+# Seconds a fetched trip updates / vehicle positions feed is shared between requests
+STM_FEED_CACHE_TTL = int(os.getenv("STM_FEED_CACHE_TTL", "15"))
+# GTFS-RT decoding: "fast" decodes only the entities of BUS_ROUTES (wire-level
+# pre-filter, backend/parsers/gtfs_rt_fast.py), "full" parses the whole feed
+GTFS_RT_DECODER = os.getenv("GTFS_RT_DECODER", "fast").lower()
+# Seconds each /api section (buses, metro, alerts, weather) is reused once built
+API_SECTION_CACHE_TTL = int(os.getenv("API_SECTION_CACHE_TTL", "10"))
+# Seconds between pushes to /api/stream clients of the ASGI server (backend/asgi.py)
+ASGI_STREAM_INTERVAL = float(os.getenv("ASGI_STREAM_INTERVAL", "15"))
 
 
 # Weather API key
 WEATHER_API_KEY = os.getenv("WEATHER_API_KEY")
+WEATHER_API_ENDPOINT = os.getenv("WEATHER_API_ENDPOINT", "http://api.weatherapi.com/v1/current.json")
 
 # Global delay configuration
 GLOBAL_DELAY_MINUTES = int(os.getenv("GLOBAL_DELAY_MINUTES", "0"))
 
-if not STM_API_KEY:
+# Realtime feed archive (disabled unless a directory is configured)
+FEED_ARCHIVE_DIR = os.getenv("FEED_ARCHIVE_DIR")
+FEED_ARCHIVE_CODEC = os.getenv("FEED_ARCHIVE_CODEC", "zstd")  # "zstd" or "gzip"
+FEED_ARCHIVE_MAX_AGE_DAYS = int(os.getenv("FEED_ARCHIVE_MAX_AGE_DAYS", "30"))
+FEED_ARCHIVE_MAX_BYTES = int(os.getenv("FEED_ARCHIVE_MAX_MB", "2048")) * 1024 * 1024
+
+# Stage timing / counters exposed on /metrics and the Server-Timing header
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+
+# Shared secret for admin-only endpoints of the main app (profiler). The admin
+# server generates one and passes it to the process it starts.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Samples kept per delay / headway series by the analytics engine (backend/analytics.py)
+ANALYTICS_WINDOW = int(os.getenv("ANALYTICS_WINDOW", "512"))
+
+# Arrival prediction smoothing (backend/prediction_tracker.py): weight of the
+# newest prediction, and seconds a trip missing from the feed stays on the board
+PREDICTION_SMOOTHING = float(os.getenv("PREDICTION_SMOOTHING", "0.5"))
+PREDICTION_HOLDOVER = int(os.getenv("PREDICTION_HOLDOVER", "120"))
+
+# Static GTFS files (routes, trips, stop_times, calendar, calendar_dates).
+# On start they are synced from the GTFS_BUCKET Supabase bucket, or from
+# GTFS_STORAGE_DIR when set (a local directory standing in for the bucket);
+# only files whose etag changed are downloaded (backend/loaders/gtfs_sync.py).
+GTFS_STM_DIR = os.getenv("GTFS_STM_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "GTFS", "stm")
+GTFS_BUCKET = os.getenv("GTFS_BUCKET", "gtfs-files")
+GTFS_STORAGE_DIR = os.getenv("GTFS_STORAGE_DIR", "")
+GTFS_SYNC_WORKERS = int(os.getenv("GTFS_SYNC_WORKERS", "4"))
+# Tables are loaded on first use (backend/loaders/gtfs_dataset.py); these start
+# loading in the background at startup so the first bus request finds them ready.
+GTFS_PRELOAD = [t.strip() for t in os.getenv("GTFS_PRELOAD", "routes,trips,stop_times,trip_stops,blocks,stops,shapes").split(",") if t.strip()]
+# After an upload, a loaded table whose changed keys (trips, stops...) are at
+# most this share of the table is patched in place instead of reloaded.
+GTFS_DIFF_MAX_SHARE = float(os.getenv("GTFS_DIFF_MAX_SHARE", "0.25"))
+
+# Multi-process mode (backend/scripts/serve_workers.py): a "fetcher" process
+# publishes the API sections to SNAPSHOT_DIR every SNAPSHOT_INTERVAL seconds
+# and "worker" processes serve them without loading GTFS or calling STM.
+SNAPSHOT_ROLE = os.getenv("SNAPSHOT_ROLE", "").lower()
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "GTFS", "snapshot")
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "10"))
+
+# Feed source: "live" hits the STM/WeatherAPI endpoints, "replay" serves
+# recorded feeds from REPLAY_DIR (fixtures or a feed archive) on a simulated clock.
+FEED_SOURCE = os.getenv("FEED_SOURCE", "live").lower()
+REPLAY_DIR = os.getenv("REPLAY_DIR")
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", "1"))  # 0 = advance one feed per fetch
+REPLAY_START = os.getenv("REPLAY_START")  # unix timestamp, defaults to first recorded feed
+
+if not STM_API_KEY and FEED_SOURCE != "replay":
     raise ValueError("STM_API_KEY not found in environment variables")
-if not WEATHER_API_KEY:
+if not WEATHER_API_KEY and FEED_SOURCE != "replay":
     raise ValueError("WEATHER_API_KEY not found in environment variables")
 
 # ============================================================================
@@ -0,0 +1,197 @@
+"""
+Next departures at any stop of the network.
+
+    board = departures.for_stop(gtfs, "51234", limit=10, horizon=90 * 60)
+    stops = departures.for_point(gtfs, 45.4946, -73.5622, radius=400)
+
+The display boards only follow the watched stops (BUS_ROUTE_COMBOS) and the
+fetchers only decode the watched routes' trip updates. For an arbitrary
+stop, the latest trip-updates feed is decoded whole once per generation
+(header timestamp) into a LiveIndex: each live trip's TripUpdate, and
+stop_id -> {trip_id: StopTimeUpdate} for every stop the feed mentions.
+Requests between two feeds reuse it.
+
+A stop's board merges it with the static timetable (the dataset's
+stop_departures index) over today's and yesterday's service days (trips of
+yesterday's service run past midnight as 24:xx:xx). For each trip, the
+prediction comes from, in order:
+
+* its own StopTimeUpdate at the stop (SKIPPED: cancelled, NO_DATA: none);
+* the delay reported upstream in the trip (TripStops.propagated_arrival);
+* the vehicle's live earlier trip of the block (BlockIndex.chained_arrival);
+
+and a trip with none of them is listed with its scheduled time. Live trips
+the timetable window misses (running very late) are added from the index.
+
+for_point() does the same for every stop within a radius of a point, found
+through the dataset's stop_grid.
+"""
+import threading
+from datetime import datetime, timedelta
+
+from backend import metrics
+from backend import models
+from backend.loaders import replay
+from backend.loaders import stm
+from backend.loaders.trip_stops import service_day, SKIPPED, NO_DATA
+from backend.parsers import gtfs_rt_fast
+
+LATE_WINDOW = 30 * 60    # seconds; scheduled calls this far back may still be ahead (delays)
+TRIP_CANCELED = 3        # TripDescriptor.ScheduleRelationship.CANCELED
+
+
+class LiveIndex:
+    def __init__(self, generation=None, entities=()):
+        self.generation = generation
+        self.updates = {}          # trip_id -> TripUpdate
+        self.by_stop = {}          # stop_id -> {trip_id: StopTimeUpdate}
+        for entity in entities:
+            if not entity.HasField("trip_update"):
+                continue
+            update = entity.trip_update
+            trip_id = update.trip.trip_id
+            self.updates[trip_id] = update
+            for stop_time in update.stop_time_update:
+                if stop_time.stop_id:
+                    self.by_stop.setdefault(stop_time.stop_id, {})[trip_id] = stop_time
+
+
+_live = LiveIndex()
+_live_lock = threading.Lock()
+
+
+def live_index():
+    """LiveIndex of the last parsed trip-updates feed, rebuilt when a new one arrives."""
+    global _live
+    generation = stm.feed_timestamp("trip_updates")
+    if generation == _live.generation:
+        return _live
+    with _live_lock:
+        if generation != _live.generation:
+            content = stm.feed_content("trip_updates")
+            entities = ()
+            if content:
+                with metrics.span("departures_index"):
+                    _, entities = gtfs_rt_fast.parse_feed(content)
+            _live = LiveIndex(generation, entities)
+        return _live
+
+
+# ─── Service calendar ─────────────────────────────────────────
+_runs_cache = {}           # (service_id, date) -> bool
+_runs_calendar = None      # calendar index the cache was filled from
+
+
+def _runs_on(gtfs, service_id, date):
+    global _runs_calendar
+    calendar = gtfs.calendar
+    if calendar is not _runs_calendar:      # new GTFS version
+        _runs_cache.clear()
+        _runs_calendar = calendar
+    key = (service_id, date)
+    runs = _runs_cache.get(key)
+    if runs is None:
+        runs = _runs_cache[key] = stm.service_runs_on(service_id, date)
+    return runs
+
+
+# ─── Boards ───────────────────────────────────────────────────
+def _event_time(stop_time, scheduled):
+    """Predicted unix time of an explicit StopTimeUpdate, or None."""
+    for name in ("arrival", "departure"):
+        if stop_time.HasField(name):
+            event = getattr(stop_time, name)
+            if event.time:
+                return event.time
+            if event.HasField("delay") and scheduled is not None:
+                return scheduled + event.delay
+    return None
+
+
+def _scheduled_calls(gtfs, stop_id, now, horizon):
+    """{trip_id: scheduled unix time} of the calls at stop_id in [now - LATE_WINDOW, now + horizon)."""
+    trips = gtfs.trips
+    today = datetime.fromtimestamp(now).date()
+    calls = {}
+    for days_back in (0, 1):
+        date = today - timedelta(days=days_back)
+        day = datetime(date.year, date.month, date.day).timestamp()
+        lo, hi = now - day - LATE_WINDOW, now - day + horizon
+        for seconds, trip_id in gtfs.stop_departures.between(stop_id, max(0, int(lo)), int(hi) + 1):
+            service_id = trips.get(trip_id, {}).get("service_id")
+            if service_id and _runs_on(gtfs, service_id, date):
+                calls.setdefault(trip_id, day + seconds)
+    return calls
+
+
+def for_stop(gtfs, stop_id, limit=10, horizon=90 * 60, now=None):
+    """[models.Departure] at stop_id in the next `horizon` seconds, soonest first."""
+    now = replay.current_time() if now is None else now
+    live = live_index()
+    trip_stops, blocks, trips = gtfs.trip_stops, gtfs.blocks, gtfs.trips
+
+    calls = _scheduled_calls(gtfs, stop_id, now, horizon)
+    live_at_stop = live.by_stop.get(stop_id, {})
+    for trip_id in live_at_stop:
+        if trip_id not in calls:
+            scheduled = trip_stops.arrival(trip_id, stop_id)
+            day = service_day(live.updates[trip_id].trip.start_date, now)
+            calls[trip_id] = day + scheduled if scheduled >= 0 else None
+
+    departures = []
+    for trip_id, scheduled in calls.items():
+        update = live.updates.get(trip_id)
+        stop_time = live_at_stop.get(trip_id)
+        predicted, propagated, chained, status = None, False, False, "scheduled"
+        if update is not None and update.trip.schedule_relationship == TRIP_CANCELED:
+            status = "cancelled"
+        elif stop_time is not None:
+            if stop_time.schedule_relationship == SKIPPED:
+                status = "cancelled"
+            elif stop_time.schedule_relationship != NO_DATA:
+                predicted = _event_time(stop_time, scheduled)
+        elif update is not None:
+            predicted = trip_stops.propagated_arrival(update, stop_id, now)
+            propagated = predicted is not None
+        else:
+            predicted = blocks.chained_arrival(trip_id, stop_id, live.updates, trip_stops, now)
+            chained = predicted is not None
+        if predicted is not None:
+            status = "normal"
+
+        expected = predicted if predicted is not None else scheduled
+        if expected is None or not now <= expected < now + horizon:
+            continue
+        trip = trips.get(trip_id, {})
+        departures.append(models.Departure(
+            route_id=trip.get("route_id") or (update.trip.route_id if update is not None else ""),
+            trip_id=trip_id,
+            headsign=trip.get("headsign", ""),
+            arrival_time="Annulé" if status == "cancelled" else int((expected - now) // 60),
+            service_status=status,
+            propagated=propagated,
+            chained=chained,
+            wheelchair_accessible=trip.get("wheelchair_accessible") == "1",
+            predicted_arrival=int(round(predicted)) if predicted is not None else None,
+            scheduled_arrival=int(round(scheduled)) if scheduled is not None else None,
+        ))
+    departures.sort(key=lambda d: d.predicted_arrival or d.scheduled_arrival)
+    return departures[:limit]
+
+
+def for_point(gtfs, lat, lon, radius, limit=5, per_stop=3, horizon=60 * 60, now=None):
+    """[models.NearbyStop] of up to `limit` stops within `radius` metres, closest first."""
+    now = replay.current_time() if now is None else now
+    stops = gtfs.stops
+    nearby = []
+    for distance, stop_id in gtfs.stop_grid.nearby(lat, lon, radius, limit):
+        name, stop_lat, stop_lon = stops[stop_id]
+        nearby.append(models.NearbyStop(
+            stop_id=stop_id,
+            stop_name=name,
+            lat=stop_lat,
+            lon=stop_lon,
+            distance=int(round(distance)),
+            departures=for_stop(gtfs, stop_id, limit=per_stop, horizon=horizon, now=now) if per_stop else [],
+        ))
+    return nearby
@@ -0,0 +1,108 @@
+"""
+Vehicle blocks: the trips one bus runs in a row, from trips.txt block_id.
+
+    blocks = get_dataset().blocks
+    blocks.next_trip(trip_id)           # trip the same vehicle runs after this one, or None
+    blocks.chained_arrival(trip_id, stop_id, live_updates, trip_stops)
+
+STM publishes no trip update for a trip until its vehicle has started it,
+so early-morning and terminus departures only have their schedule. When
+the vehicle's previous trip in the block is live, its predicted arrival at
+its last stop says when the bus can start the next one: the next trip
+leaves at its scheduled time, or as soon as the bus is in if that is
+later (layover absorbs part of the delay), and the remaining delay carries
+over its stops. Up to MAX_CHAIN trips are chained ahead of a live one.
+
+Trips are grouped by (service_id, block_id) and ordered by their first
+scheduled arrival; next / previous are plain dicts, so each step is O(1).
+"""
+import sys
+
+from . import gtfs_source
+from .trip_stops import service_day
+
+MAX_CHAIN = 3     # trips predicted ahead of the vehicle's live trip
+
+
+class BlockIndex:
+    def __init__(self):
+        self._next = {}           # trip_id -> next trip_id in its block
+        self._previous = {}       # trip_id -> previous trip_id in its block
+
+    @classmethod
+    def from_source(cls, source, trip_stops, table="trips.txt"):
+        """source: a GtfsSource, a GTFS directory or zip, or the path of trips.txt."""
+        source, table = gtfs_source.table_source(source, table)
+        self = cls()
+        blocks = {}
+        for trip_id, block_id, service_id in source.rows(table, ("trip_id", "block_id", "service_id")):
+            if not block_id:
+                continue
+            start = trip_stops.first_arrival(trip_id)
+            if start < 0:
+                continue
+            blocks.setdefault((service_id, block_id), []).append((start, trip_id))
+        for trips in blocks.values():
+            trips.sort()
+            for (_, previous), (_, following) in zip(trips, trips[1:]):
+                self._next[previous] = following
+                self._previous[following] = previous
+        return self
+
+    def __len__(self):
+        return len(self._next)
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sys.getsizeof(self._next) + sys.getsizeof(self._previous)
+
+    def next_trip(self, trip_id):
+        return self._next.get(trip_id)
+
+    def previous_trip(self, trip_id):
+        return self._previous.get(trip_id)
+
+    def following_trips(self, trip_id, limit=MAX_CHAIN):
+        """Up to `limit` trips the vehicle runs after trip_id, in order."""
+        trips = []
+        following = self._next.get(trip_id)
+        while following is not None and len(trips) < limit:
+            trips.append(following)
+            following = self._next.get(following)
+        return trips
+
+    def chained_arrival(self, trip_id, stop_id, live_updates, trip_stops, now=None, limit=MAX_CHAIN):
+        """
+        Predicted arrival (unix time) of a not yet started trip at stop_id, from
+        the closest earlier trip of its block in live_updates ({trip_id:
+        TripUpdate}), at most `limit` trips back. None when no such trip is
+        live or the schedule is incomplete.
+        """
+        chain = [trip_id]
+        previous = trip_id
+        live = None
+        for _ in range(limit):
+            previous = self._previous.get(previous)
+            if previous is None:
+                return None
+            live = live_updates.get(previous)
+            if live is not None:
+                break
+            chain.append(previous)
+        if live is None:
+            return None
+
+        end = trip_stops.end_arrival(live, now)
+        if end is None:
+            return None
+        day = service_day(live.trip.start_date, now)
+        for trip in reversed(chain):
+            first, last = trip_stops.first_arrival(trip), trip_stops.last_arrival(trip)
+            if first < 0 or last < 0:
+                return None
+            scheduled_start = day + first
+            delay = max(0.0, end - scheduled_start)
+            if trip == trip_id:
+                at_stop = trip_stops.arrival(trip, stop_id)
+                return day + at_stop + delay if at_stop >= 0 else None
+            end = day + last + delay
+        return None
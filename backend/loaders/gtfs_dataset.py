@@ -0,0 +1,389 @@
+"""
+Static GTFS tables of one directory (or zip), each loaded on first access.
+
+    gtfs = get_dataset()                # GTFS_STM_DIR
+    gtfs.trips["12345"]                 # loads and indexes trips.txt (and routes.txt) now
+    gtfs.preload(["stop_times"], background=True)
+    gtfs.stats()                        # rows, estimated bytes and load time per table
+    gtfs.apply_changeset(changeset)     # after a new GTFS version was uploaded
+
+Each table is read the first time it is asked for and kept for the life of
+the dataset, so the process starts serving right away and only pays, in
+time and memory, for the tables it actually uses. Loading is thread safe:
+concurrent first accesses to a table wait for one load instead of each
+reading the file; different tables load independently. A table whose file
+is missing loads as an empty index of its type (and is reported by missing()).
+
+When the files are replaced by a new version, apply_changeset() brings the
+loaded tables up to date from the upload's changeset (gtfs_diff.py): a
+table with few changed keys is patched by reading only the rows of those
+keys, one with many is dropped and reloads on its next access. Patches are
+built on a copy and swapped in, so readers never see a half-updated index.
+
+Indexes:
+    routes          {route_id: route_short_name}
+    trips           {trip_id: {"route_id": short name, "wheelchair_accessible": "0"/"1",
+                               "service_id", "headsign", "shape_id"}}
+    stop_times      {(trip_id, stop_id): "HH:MM:SS"}
+    stops           {stop_id: (stop_name, lat, lon)}
+    calendar        {service_id: calendar.txt row}
+    calendar_dates  {service_id: [calendar_dates.txt rows]}
+    shapes          ShapeIndex: points, distances and simplified polylines (shapes.py)
+    trip_stops      TripStops: each trip's stops in order, packed in arrays (trip_stops.py)
+    blocks          BlockIndex: next / previous trip of the same vehicle (blocks.py)
+    stop_departures StopDepartures: scheduled calls of each stop by time (trip_stops.py)
+    stop_grid       StopGrid: stops bucketed in a metric grid for radius queries (stop_grid.py)
+"""
+import sys
+import time
+import logging
+import threading
+
+from backend.config import GTFS_STM_DIR, GTFS_DIFF_MAX_SHARE
+from backend import metrics
+from . import gtfs_source
+from .gtfs_diff import KEYS, changed_keys
+from .trip_stops import TripStops, StopDepartures
+from .blocks import BlockIndex
+from .stop_grid import StopGrid
+from .shapes import ShapeIndex
+
+logger = logging.getLogger('BdeB-GTFS')
+
+SIZE_SAMPLE = 200      # entries per container measured when estimating a table's size
+
+
+# ─── Table builders ───────────────────────────────────────────
+# Each takes (dataset, source) and returns the table's index. The stm
+# loaders are imported on use: stm itself reads the calendar from here.
+def _build_routes(dataset, source):
+    from .stm import load_stm_routes
+    return load_stm_routes(source)
+
+
+def _build_trips(dataset, source):
+    from .stm import load_stm_gtfs_trips
+    return load_stm_gtfs_trips(source, dataset.routes)
+
+
+def _build_stop_times(dataset, source):
+    from .stm import load_stm_stop_times
+    return load_stm_stop_times(source)
+
+
+def _build_stops(dataset, source):
+    stops = {}
+    for stop_id, name, lat, lon in source.rows("stops.txt", ("stop_id", "stop_name", "stop_lat", "stop_lon")):
+        try:
+            stops[stop_id] = (name or "", float(lat), float(lon))
+        except (TypeError, ValueError):
+            stops[stop_id] = (name or "", None, None)
+    return stops
+
+
+def _build_calendar(dataset, source):
+    return {row["service_id"]: row for row in source.dict_rows("calendar.txt")}
+
+
+def _build_calendar_dates(dataset, source):
+    calendar_dates = {}
+    for row in source.dict_rows("calendar_dates.txt"):
+        calendar_dates.setdefault(row["service_id"], []).append(row)
+    return calendar_dates
+
+
+def _build_shapes(dataset, source):
+    return ShapeIndex.from_source(source)
+
+
+def _build_trip_stops(dataset, source):
+    return TripStops.from_source(source)
+
+
+def _build_blocks(dataset, source):
+    return BlockIndex.from_source(source, dataset.trip_stops)
+
+
+def _build_stop_departures(dataset, source):
+    return StopDepartures.from_trip_stops(dataset.trip_stops)
+
+
+def _build_stop_grid(dataset, source):
+    return StopGrid.from_stops(dataset.stops)
+
+
+TABLES = {
+    # name: (file, builder)
+    "routes": ("routes.txt", _build_routes),
+    "trips": ("trips.txt", _build_trips),
+    "stop_times": ("stop_times.txt", _build_stop_times),
+    "stops": ("stops.txt", _build_stops),
+    "calendar": ("calendar.txt", _build_calendar),
+    "calendar_dates": ("calendar_dates.txt", _build_calendar_dates),
+    "shapes": ("shapes.txt", _build_shapes),
+    "trip_stops": ("stop_times.txt", _build_trip_stops),
+    "blocks": ("trips.txt", _build_blocks),
+    "stop_departures": ("stop_times.txt", _build_stop_departures),
+    "stop_grid": ("stops.txt", _build_stop_grid),
+}
+
+# Empty value of the tables that are not dicts, for a missing file
+EMPTY_TABLES = {
+    "shapes": ShapeIndex,
+    "trip_stops": TripStops,
+    "blocks": BlockIndex,
+    "stop_departures": StopDepartures,
+    "stop_grid": StopGrid,
+}
+
+# Tables built from another one besides their own file
+DEPENDS_ON = {
+    "trips": "routes",          # trips carry the routes' short names
+    "blocks": "trip_stops",     # trips are ordered by their first scheduled stop
+    "stop_departures": "trip_stops",
+    "stop_grid": "stops",
+}
+
+
+class _KeyFilter(gtfs_source.GtfsSource):
+    """A source whose `table` only yields the rows whose `column` is in `keys`."""
+
+    def __init__(self, source, table, column, keys):
+        self._source = source
+        self.table = table
+        self.column = column
+        self.keys = keys
+
+    def has(self, table):
+        return self._source.has(table)
+
+    def open(self, table):
+        return self._source.open(table)
+
+    def size(self, table):
+        return self._source.size(table)
+
+    def fingerprint(self, table):
+        return self._source.fingerprint(table)
+
+    def rows(self, table, columns):
+        if table != self.table:
+            yield from self._source.rows(table, columns)
+            return
+        keys = self.keys
+        for row in self._source.rows(table, tuple(columns) + (self.column,)):
+            if row[-1] in keys:
+                yield row[:-1]
+
+    def dict_rows(self, table):
+        for row in self._source.dict_rows(table):
+            if table != self.table or row.get(self.column) in self.keys:
+                yield row
+
+
+# ─── Memory accounting ────────────────────────────────────────
+def _size_of(obj, depth=0):
+    """
+    Estimated deep size of an index in bytes. Large containers are measured
+    on their first SIZE_SAMPLE entries and extrapolated, so this stays cheap
+    on a multi-million-row stop_times.
+    """
+    size = sys.getsizeof(obj)
+    if depth > 3:
+        return size
+    if isinstance(obj, dict):
+        if not obj:
+            return size
+        sample = 0
+        for i, (key, value) in enumerate(obj.items()):
+            if i == SIZE_SAMPLE:
+                break
+            sample += _size_of(key, depth + 1) + _size_of(value, depth + 1)
+        return size + sample * len(obj) // min(len(obj), SIZE_SAMPLE)
+    if isinstance(obj, (list, tuple)):
+        if not obj:
+            return size
+        sample = sum(_size_of(item, depth + 1) for item in obj[:SIZE_SAMPLE])
+        return size + sample * len(obj) // min(len(obj), SIZE_SAMPLE)
+    return size
+
+
+# ─── Dataset ──────────────────────────────────────────────────
+class GtfsDataset:
+    def __init__(self, path=GTFS_STM_DIR):
+        self.path = path
+        self._source = None
+        self._source_lock = threading.Lock()
+        self._tables = {}
+        self._stats = {}
+        self._locks = {name: threading.Lock() for name in TABLES}
+
+    @property
+    def source(self):
+        if self._source is None:
+            with self._source_lock:
+                if self._source is None:
+                    self._source = gtfs_source.open_source(self.path)
+        return self._source
+
+    def table(self, name):
+        """Index of a table, loading it on first access."""
+        try:
+            return self._tables[name]
+        except KeyError:
+            pass
+        with self._locks[name]:
+            if name not in self._tables:
+                self._tables[name] = self._load(name)
+            return self._tables[name]
+
+    def _load(self, name):
+        filename, build = TABLES[name]
+        source = self.source
+        if not source.has(filename):
+            logger.warning(f"[GTFS] {filename} not found in {self.path}")
+            self._stats[name] = {"file": filename, "rows": 0, "bytes": 0, "load_s": 0.0, "missing": True}
+            return EMPTY_TABLES.get(name, dict)()
+        started = time.perf_counter()
+        fingerprint = source.fingerprint(filename)
+        with metrics.span(f"gtfs_load_{name}"):
+            index = build(self, source)
+        elapsed = time.perf_counter() - started
+        self._record(name, index, elapsed, fingerprint)
+        logger.info(f"[GTFS] Loaded {name}: {len(index)} entries in {elapsed:.2f}s")
+        return index
+
+    def _record(self, name, index, elapsed, fingerprint):
+        self._stats[name] = {
+            "file": TABLES[name][0],
+            "rows": len(index),
+            "bytes": _size_of(index),
+            "load_s": round(elapsed, 3),
+            "missing": False,
+            "fingerprint": fingerprint,
+        }
+
+    routes = property(lambda self: self.table("routes"))
+    trips = property(lambda self: self.table("trips"))
+    stop_times = property(lambda self: self.table("stop_times"))
+    stops = property(lambda self: self.table("stops"))
+    calendar = property(lambda self: self.table("calendar"))
+    calendar_dates = property(lambda self: self.table("calendar_dates"))
+    shapes = property(lambda self: self.table("shapes"))
+    trip_stops = property(lambda self: self.table("trip_stops"))
+    blocks = property(lambda self: self.table("blocks"))
+    stop_departures = property(lambda self: self.table("stop_departures"))
+    stop_grid = property(lambda self: self.table("stop_grid"))
+
+    def is_loaded(self, name):
+        return name in self._tables
+
+    def missing(self, names=TABLES):
+        """Files of the given tables that are not in the directory / zip."""
+        return self.source.missing([TABLES[name][0] for name in names])
+
+    def preload(self, names, background=False):
+        """Load tables now, or in a daemon thread (returned) with background=True."""
+        names = [name for name in names if name in TABLES]
+
+        def load_all():
+            for name in names:
+                try:
+                    self.table(name)
+                except Exception as e:
+                    logger.error(f"[GTFS] Preloading {name} failed: {e}")
+
+        if not background:
+            load_all()
+            return None
+        thread = threading.Thread(target=load_all, name="gtfs-preload", daemon=True)
+        thread.start()
+        return thread
+
+    # ─── New versions ─────────────────────────────────────────
+    def apply_changeset(self, changeset, max_share=GTFS_DIFF_MAX_SHARE):
+        """
+        Update the loaded tables to the files now on disk. `changeset` is the
+        diff from the loaded version to them (None: nothing is known, every
+        loaded table is dropped). A table is patched when its changeset entry
+        starts from the loaded fingerprint, ends at the current one and
+        touches at most `max_share` of its keys; otherwise it is dropped and
+        reloads on next access. Returns {table: "unchanged" / "patched" / "dropped"}.
+        """
+        with self._source_lock:
+            self._source = source = gtfs_source.open_source(self.path)
+        entries = (changeset or {}).get("tables", {})
+        report = {}
+        for name, (filename, _) in TABLES.items():
+            with self._locks[name]:
+                if name not in self._tables:
+                    continue
+                entry = entries.get(filename)
+                current = source.fingerprint(filename) if source.has(filename) else None
+                loaded = self._stats.get(name, {}).get("fingerprint")
+                touched = entry and len(entry["added"]) + len(entry["removed"]) + len(entry["changed"])
+                if entry is None or entry["old"] != loaded or entry["new"] != current:
+                    action = "dropped"
+                elif report.get(DEPENDS_ON.get(name)) not in (None, "unchanged"):
+                    action = "dropped"      # built from a table that changed
+                elif not touched:
+                    action = "unchanged"
+                elif current is None or touched > max_share * max(1, entry["rows_old"] or 0):
+                    action = "dropped"
+                elif not isinstance(self._tables[name], dict):
+                    action = "dropped"      # packed tables (trip_stops) are rebuilt
+                else:
+                    action = "patched"
+
+                if action == "dropped":
+                    del self._tables[name]
+                    self._stats.pop(name, None)
+                elif action == "patched":
+                    started = time.perf_counter()
+                    with metrics.span(f"gtfs_patch_{name}"):
+                        index = self._patched(name, entry, source)
+                    self._tables[name] = index
+                    self._record(name, index, time.perf_counter() - started, current)
+                report[name] = action
+        logger.info(f"[GTFS] New version applied: {report}")
+        return report
+
+    def _patched(self, name, entry, source):
+        """Copy of a loaded index with the rows of the entry's keys replaced by the new ones."""
+        filename, build = TABLES[name]
+        stale = set(entry["removed"]) | set(entry["changed"])
+        old = self._tables[name]
+        if name == "stop_times":
+            # keyed by (trip_id, stop_id); the changeset is per trip
+            index = {key: value for key, value in old.items() if key[0] not in stale}
+        else:
+            index = dict(old)
+            for key in stale:
+                index.pop(key, None)
+        index.update(build(self, _KeyFilter(source, filename, KEYS[filename], changed_keys(entry))))
+        return index
+
+    def stats(self):
+        """{table: {"file", "rows", "bytes", "load_s", "missing", "fingerprint"}} of loaded tables, plus "total_bytes"."""
+        tables = {name: dict(self._stats[name]) for name in TABLES if name in self._stats}
+        return {
+            "path": str(self.path),
+            "tables": tables,
+            "not_loaded": [name for name in TABLES if name not in self._tables],
+            "total_bytes": sum(t["bytes"] for t in tables.values()),
+        }
+
+
+# ─── Module default (GTFS_STM_DIR) ────────────────────────────
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_dataset():
+    """Process-wide dataset over GTFS_STM_DIR, shared by the API and the stm loaders."""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = GtfsDataset(GTFS_STM_DIR)
+    return _default
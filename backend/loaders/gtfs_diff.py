@@ -0,0 +1,143 @@
+"""
+Row-level diff between two versions of a GTFS feed.
+
+    changeset = diff_sources(DirectorySource(stm_dir), ZipSource(new_zip))
+    save_changeset(stm_dir, changeset)      # picked up by GtfsDataset.apply_changeset()
+    describe(changeset)                     # {"trips": {"added": 12, ...}, ...}
+
+A table whose fingerprint (CRC32 and size of its content) did not change is
+not read at all. Otherwise both versions are hashed row by row and the
+rows grouped by the table's key (KEYS): one digest per trip, stop, route,
+service... including every stop_times row of a trip under that trip's key.
+Keys only in the new version are "added", only in the old one "removed",
+and present in both with a different digest "changed". Column order does
+not matter; a column added or dropped changes every row.
+
+The changeset is a plain dict (saved as <stm_dir>/.gtfs_changeset.json):
+
+    {"created": unix time,
+     "tables": {"trips.txt": {"old": fingerprint, "new": fingerprint,
+                              "rows_old": keys, "rows_new": keys,
+                              "added": [...], "removed": [...], "changed": [...]}}}
+"""
+import os
+import csv
+import json
+import time
+import hashlib
+
+CHANGESET_FILE = ".gtfs_changeset.json"
+
+# Table -> column its rows are grouped by
+KEYS = {
+    "routes.txt": "route_id",
+    "trips.txt": "trip_id",
+    "stop_times.txt": "trip_id",
+    "stops.txt": "stop_id",
+    "calendar.txt": "service_id",
+    "calendar_dates.txt": "service_id",
+    "shapes.txt": "shape_id",
+}
+
+
+def row_digests(source, table, key_column):
+    """{key: 8-byte digest of every row with that key, in file order}."""
+    hashers = {}
+    with source.open(table) as f:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader, [])]
+        if key_column not in header:
+            raise ValueError(f"{table} has no {key_column} column")
+        key_index = header.index(key_column)
+        # Hash columns by name so a reordered header is not a change
+        order = sorted(range(len(header)), key=header.__getitem__)
+        prefix = "\x1e".join(header[i] for i in order).encode("utf-8")
+        for row in reader:
+            if key_index >= len(row):
+                continue
+            key = row[key_index]
+            hasher = hashers.get(key)
+            if hasher is None:
+                hasher = hashers[key] = hashlib.blake2b(prefix, digest_size=8)
+            hasher.update("\x1f".join(row[i] if i < len(row) else "" for i in order).encode("utf-8"))
+            hasher.update(b"\x1e")
+    return {key: hasher.digest() for key, hasher in hashers.items()}
+
+
+def diff_table(old_source, new_source, table, key_column=None):
+    key_column = key_column or KEYS[table]
+    entry = {
+        "old": old_source.fingerprint(table) if old_source.has(table) else None,
+        "new": new_source.fingerprint(table) if new_source.has(table) else None,
+        "added": [], "removed": [], "changed": [],
+    }
+    if entry["old"] == entry["new"]:
+        entry["rows_old"] = entry["rows_new"] = None   # not read
+        return entry
+
+    old = row_digests(old_source, table, key_column) if entry["old"] else {}
+    new = row_digests(new_source, table, key_column) if entry["new"] else {}
+    entry["rows_old"], entry["rows_new"] = len(old), len(new)
+    for key, digest in new.items():
+        previous = old.get(key)
+        if previous is None:
+            entry["added"].append(key)
+        elif previous != digest:
+            entry["changed"].append(key)
+    entry["removed"] = [key for key in old if key not in new]
+    return entry
+
+
+def diff_sources(old_source, new_source, tables=KEYS):
+    """Changeset between two GtfsSources over the given tables."""
+    return {
+        "created": time.time(),
+        "tables": {
+            table: diff_table(old_source, new_source, table)
+            for table in tables
+            if old_source.has(table) or new_source.has(table)
+        },
+    }
+
+
+def changed_keys(entry):
+    """Keys whose rows must be reloaded from the new version (added or changed)."""
+    return set(entry["added"]) | set(entry["changed"])
+
+
+def describe(changeset):
+    """
+    Counts per entity: {"trips": {"added", "removed", "changed"}, "stops": ...}.
+    A trip whose stop times changed counts as a changed trip.
+    """
+    tables = changeset["tables"]
+    counts = {}
+    for table, entry in tables.items():
+        if table == "stop_times.txt":
+            continue
+        counts[table[:-len(".txt")]] = {
+            "added": len(entry["added"]),
+            "removed": len(entry["removed"]),
+            "changed": len(entry["changed"]),
+        }
+    if "stop_times.txt" in tables and "trips" in counts:
+        trips = tables.get("trips.txt", {"added": [], "removed": [], "changed": []})
+        counted = set(trips["added"]) | set(trips["removed"]) | set(trips["changed"])
+        counts["trips"]["changed"] += len(changed_keys(tables["stop_times.txt"]) - counted)
+    return counts
+
+
+def save_changeset(stm_dir, changeset):
+    path = os.path.join(stm_dir, CHANGESET_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(changeset, f)
+    os.replace(tmp_path, path)
+
+
+def load_changeset(stm_dir):
+    try:
+        with open(os.path.join(stm_dir, CHANGESET_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
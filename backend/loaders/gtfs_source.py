@@ -0,0 +1,172 @@
+"""
+GTFS table sources: a directory of extracted .txt files or a GTFS zip.
+
+    source = open_source(path)          # directory, or a .zip file
+    for trip_id, stop_id, arrival in source.rows("stop_times.txt",
+                                                 ("trip_id", "stop_id", "arrival_time")):
+        ...
+
+Members of a zip are streamed through the csv module without being
+extracted, and only the requested columns are picked out of each row. A
+directory may also hold the uploaded archive as GTFS_ZIP ("gtfs.zip"); a
+table is then read from its extracted file when there is one and from the
+archive otherwise.
+"""
+import io
+import os
+import csv
+import zlib
+import zipfile
+from operator import itemgetter
+
+GTFS_ZIP = "gtfs.zip"
+
+# path -> (size, mtime_ns, fingerprint) of the extracted files already read,
+# so each table that loads from the same file does not CRC it again
+_file_fingerprints = {}
+
+
+class GtfsSource:
+    def has(self, table):
+        raise NotImplementedError
+
+    def open(self, table):
+        """Text stream of a table (BOM stripped, newline='' for csv)."""
+        raise NotImplementedError
+
+    def size(self, table):
+        """Uncompressed size of a table in bytes."""
+        raise NotImplementedError
+
+    def fingerprint(self, table):
+        """
+        "<crc32>-<size>" of a table's uncompressed bytes: equal for the same
+        content whether it is an extracted file or a zip member.
+        """
+        raise NotImplementedError
+
+    def missing(self, tables):
+        return [table for table in tables if not self.has(table)]
+
+    def rows(self, table, columns):
+        """
+        Tuples of the given columns, in that order. A column the table does
+        not have is None in every row.
+        """
+        with self.open(table) as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            position = {name.strip(): i for i, name in enumerate(header)}
+            indexes = [position.get(column) for column in columns]
+            if None not in indexes and len(indexes) > 1:
+                pick = itemgetter(*indexes)
+                for row in reader:
+                    try:
+                        yield pick(row)
+                    except IndexError:  # short row: missing trailing fields
+                        yield tuple(row[i] if i < len(row) else None for i in indexes)
+            else:
+                for row in reader:
+                    yield tuple(
+                        row[i] if i is not None and i < len(row) else None for i in indexes)
+
+    def dict_rows(self, table):
+        """csv.DictReader rows of a table (every column)."""
+        with self.open(table) as f:
+            yield from csv.DictReader(f)
+
+
+class ZipSource(GtfsSource):
+    def __init__(self, path):
+        self.path = str(path)
+        with zipfile.ZipFile(self.path) as archive:
+            # Tables are matched by base name: archives often wrap them in a folder
+            self._members = {
+                os.path.basename(info.filename): info
+                for info in archive.infolist()
+                if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+            }
+
+    def tables(self):
+        return [name for name in self._members if name.endswith(".txt")]
+
+    def has(self, table):
+        return table in self._members
+
+    def open(self, table):
+        if table not in self._members:
+            raise FileNotFoundError(f"{table} not in {self.path}")
+        # The member keeps the archive file open until it is closed itself
+        with zipfile.ZipFile(self.path) as archive:
+            member = archive.open(self._members[table])
+        return io.TextIOWrapper(member, encoding="utf-8-sig", newline="")
+
+    def size(self, table):
+        return self._members[table].file_size
+
+    def fingerprint(self, table):
+        info = self._members[table]      # the archive already stores the CRC
+        return f"{info.CRC:08x}-{info.file_size}"
+
+
+class DirectorySource(GtfsSource):
+    def __init__(self, root):
+        self.root = str(root)
+        zip_path = os.path.join(self.root, GTFS_ZIP)
+        self.archive = ZipSource(zip_path) if os.path.isfile(zip_path) else None
+
+    def _path(self, table):
+        return os.path.join(self.root, table)
+
+    def has(self, table):
+        return os.path.isfile(self._path(table)) or (self.archive is not None and self.archive.has(table))
+
+    def open(self, table):
+        if os.path.isfile(self._path(table)) or self.archive is None:
+            return open(self._path(table), mode="r", encoding="utf-8-sig", newline="")
+        return self.archive.open(table)
+
+    def size(self, table):
+        if os.path.isfile(self._path(table)) or self.archive is None:
+            return os.path.getsize(self._path(table))
+        return self.archive.size(table)
+
+    def fingerprint(self, table):
+        if os.path.isfile(self._path(table)) or self.archive is None:
+            path = os.path.abspath(self._path(table))
+            stat = os.stat(path)
+            cached = _file_fingerprints.get(path)
+            if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+                return cached[2]
+            crc = 0
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    crc = zlib.crc32(chunk, crc)
+            fingerprint = f"{crc:08x}-{stat.st_size}"
+            _file_fingerprints[path] = (stat.st_size, stat.st_mtime_ns, fingerprint)
+            return fingerprint
+        return self.archive.fingerprint(table)
+
+
+def open_source(path):
+    """DirectorySource or ZipSource for a path."""
+    if isinstance(path, GtfsSource):
+        return path
+    if os.path.isfile(path) and zipfile.is_zipfile(path):
+        return ZipSource(path)
+    return DirectorySource(path)
+
+
+def table_source(path, default_table):
+    """
+    (source, table) for a loader argument: a source, a directory, a zip, or
+    the path of one extracted table file.
+    """
+    if isinstance(path, GtfsSource):
+        return path, default_table
+    path = str(path)
+    if path.lower().endswith(".txt"):
+        return DirectorySource(os.path.dirname(path) or "."), os.path.basename(path)
+    return open_source(path), default_table
@@ -0,0 +1,235 @@
+"""
+Conditional GTFS download from object storage.
+
+    storage = SupabaseStorage(client, "gtfs-files", "stm")   # or LocalDirStorage(path)
+    sync_gtfs(storage, stm_dir)
+
+The latest remote version of each GTFS file (newest created_at among the
+objects whose name ends with the file name) is compared with a local
+manifest (<stm_dir>/.gtfs_manifest.json) that records the remote object,
+its etag and the size / mtime of the local copy. Only files whose remote
+etag changed, or whose local copy is missing or was modified, are
+downloaded, in parallel. Each download streams into a temporary file in
+the same directory, is checked against the remote size and MD5 etag when
+the storage provides them, and is renamed over the old file only once
+complete, so a failed or interrupted sync never leaves a truncated file.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+logger = logging.getLogger('BdeB-GTFS')
+
+GTFS_FILES = ["routes.txt", "trips.txt", "stop_times.txt", "calendar.txt", "calendar_dates.txt",
+              "stops.txt", "shapes.txt"]
+MANIFEST_FILE = ".gtfs_manifest.json"
+CHUNK_SIZE = 1 << 20
+SIGNED_URL_TTL = 300      # seconds
+
+
+class SyncError(Exception):
+    pass
+
+
+class RemoteFile:
+    __slots__ = ("name", "etag", "size", "created_at")
+
+    def __init__(self, name, etag=None, size=None, created_at=""):
+        self.name = name
+        self.etag = etag
+        self.size = size
+        self.created_at = created_at or ""
+
+
+def _clean_etag(etag):
+    return etag.strip('"') if etag else None
+
+
+def _is_md5(etag):
+    return bool(etag) and len(etag) == 32 and all(c in "0123456789abcdef" for c in etag.lower())
+
+
+# ─── Storage adapters ─────────────────────────────────────────
+class SupabaseStorage:
+    """Objects under `prefix` in a Supabase storage bucket."""
+
+    def __init__(self, client, bucket, prefix):
+        self.bucket = client.storage.from_(bucket)
+        self.prefix = prefix
+
+    def list(self):
+        files = []
+        for obj in self.bucket.list(self.prefix) or []:
+            metadata = obj.get("metadata") or {}
+            files.append(RemoteFile(
+                obj["name"],
+                etag=_clean_etag(metadata.get("eTag")),
+                size=metadata.get("size"),
+                created_at=obj.get("created_at") or obj.get("updated_at"),
+            ))
+        return files
+
+    def stream(self, name):
+        """Iterator of byte chunks of an object."""
+        path = f"{self.prefix}/{name}"
+        signed = self.bucket.create_signed_url(path, SIGNED_URL_TTL) or {}
+        url = signed.get("signedURL") or signed.get("signedUrl")
+        if not url:
+            # No signed URL support: fall back to a buffered download
+            yield self.bucket.download(path)
+            return
+        with requests.get(url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            yield from response.iter_content(CHUNK_SIZE)
+
+
+class LocalDirStorage:
+    """A directory standing in for the bucket (development, load tests, CI)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def list(self):
+        files = []
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            if not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            files.append(RemoteFile(
+                name,
+                etag=_file_digest(path, hashlib.md5),
+                size=stat.st_size,
+                created_at=time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(stat.st_mtime)),
+            ))
+        return files
+
+    def stream(self, name):
+        with open(os.path.join(self.root, name), "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+
+# ─── Manifest ─────────────────────────────────────────────────
+def _file_digest(path, algorithm):
+    digest = algorithm()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(stm_dir):
+    try:
+        with open(os.path.join(stm_dir, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(stm_dir, manifest):
+    path = os.path.join(stm_dir, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _local_matches(stm_dir, filename, entry):
+    """True if the local file is still the one the manifest entry describes."""
+    try:
+        stat = os.stat(os.path.join(stm_dir, filename))
+    except OSError:
+        return False
+    return stat.st_size == entry.get("local_size") and stat.st_mtime_ns == entry.get("local_mtime_ns")
+
+
+def _latest(remote_files, filename):
+    matching = [f for f in remote_files if f.name.endswith(filename)]
+    if not matching:
+        return None
+    return max(matching, key=lambda f: f.created_at)
+
+
+# ─── Sync ─────────────────────────────────────────────────────
+def _download(storage, remote, stm_dir, filename):
+    """Stream one object to <filename>.part, verify it and rename it into place."""
+    final_path = os.path.join(stm_dir, filename)
+    tmp_path = final_path + ".part"
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in storage.stream(remote.name):
+                f.write(chunk)
+                md5.update(chunk)
+                sha256.update(chunk)
+                size += len(chunk)
+        if remote.size is not None and size != remote.size:
+            raise SyncError(f"{filename}: got {size} bytes, expected {remote.size}")
+        if _is_md5(remote.etag) and md5.hexdigest() != remote.etag.lower():
+            raise SyncError(f"{filename}: checksum mismatch")
+        os.replace(tmp_path, final_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    stat = os.stat(final_path)
+    return {
+        "remote": remote.name,
+        "etag": remote.etag,
+        "sha256": sha256.hexdigest(),
+        "local_size": stat.st_size,
+        "local_mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def sync_gtfs(storage, stm_dir, files=GTFS_FILES, workers=4):
+    """
+    Bring stm_dir up to date with the storage. Returns
+    {"downloaded": [...], "unchanged": [...], "missing": [...], "failed": {file: error}}.
+    """
+    os.makedirs(stm_dir, exist_ok=True)
+    remote_files = storage.list()
+    manifest = load_manifest(stm_dir)
+    report = {"downloaded": [], "unchanged": [], "missing": [], "failed": {}}
+
+    todo = []
+    for filename in files:
+        remote = _latest(remote_files, filename)
+        if remote is None:
+            report["missing"].append(filename)
+            continue
+        entry = manifest.get(filename) or {}
+        same_object = entry.get("remote") == remote.name and entry.get("etag") == remote.etag
+        if same_object and remote.etag and _local_matches(stm_dir, filename, entry):
+            report["unchanged"].append(filename)
+        else:
+            todo.append((filename, remote))
+
+    if todo:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(todo)))) as pool:
+            futures = {
+                filename: pool.submit(_download, storage, remote, stm_dir, filename)
+                for filename, remote in todo
+            }
+            for filename, future in futures.items():
+                try:
+                    manifest[filename] = future.result()
+                    report["downloaded"].append(filename)
+                except Exception as e:
+                    logger.warning(f"[GTFS] Download of {filename} failed: {e}")
+                    report["failed"][filename] = str(e)
+        _write_manifest(stm_dir, manifest)
+    return report
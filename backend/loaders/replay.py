@@ -0,0 +1,180 @@
+"""
+Replay data source.
+
+Serves recorded GTFS-RT protobufs, STM alert JSON and WeatherAPI JSON on a
+simulated clock so the whole /api/data pipeline can run offline. Enabled
+with FEED_SOURCE=replay and REPLAY_DIR pointing at either:
+
+  * a fixture directory:
+        trip_updates/<unix_ts>.pb
+        vehicle_positions/<unix_ts>.pb
+        alerts/<unix_ts>.json        (raw etatservice response)
+        weather/<unix_ts>.json       (raw current.json response, optional)
+  * a feed archive written by managers.archive_manager (protobufs only,
+    alert/weather fixtures may be dropped next to it in the same layout).
+
+At each fetch, the most recent recording at or before the simulated time is
+served. REPLAY_SPEED scales wall time (1 = real time, 60 = one hour per
+minute); REPLAY_SPEED=0 is step mode, where every trip-updates fetch moves
+to the next recording, which makes runs fully deterministic.
+"""
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+
+from backend.config import FEED_SOURCE, REPLAY_DIR, REPLAY_SPEED, REPLAY_START
+from backend.managers.archive_manager import FeedArchive
+
+logger = logging.getLogger('BdeB-GTFS')
+
+PB_FEEDS = ("trip_updates", "vehicle_positions")
+JSON_FEEDS = ("alerts", "weather")
+
+
+def _timestamp_from_name(filename):
+    stem = filename.split(".", 1)[0]
+    try:
+        return int(stem)
+    except ValueError:
+        return None
+
+
+def _scan_fixture_dir(feed_dir, extension):
+    """Return sorted (ts, path) pairs for '<ts><extension>' files in feed_dir."""
+    entries = []
+    if not os.path.isdir(feed_dir):
+        return entries
+    for name in os.listdir(feed_dir):
+        if not name.endswith(extension):
+            continue
+        ts = _timestamp_from_name(name)
+        if ts is None:
+            logger.warning(f"[REPLAY] Ignoring {name}: file name is not a unix timestamp")
+            continue
+        entries.append((ts, os.path.join(feed_dir, name)))
+    entries.sort()
+    return entries
+
+
+class ReplayClock:
+    """Simulated clock: start_ts + (wall elapsed * speed)."""
+
+    def __init__(self, start_ts, speed):
+        self.start_ts = start_ts
+        self.speed = speed
+        self._wall_start = time.time()
+        self._step_ts = start_ts
+
+    def now(self):
+        if self.speed <= 0:
+            return self._step_ts
+        return self.start_ts + (time.time() - self._wall_start) * self.speed
+
+    def step_to(self, ts):
+        self._step_ts = ts
+
+
+class ReplaySource:
+    def __init__(self, root, speed=REPLAY_SPEED, start_ts=None):
+        self.root = root
+        self._lock = threading.Lock()
+        self._timelines = {}  # feed -> (timestamps, loaders)
+        self._step_index = -1
+
+        archive = FeedArchive(root)
+        for feed in PB_FEEDS:
+            fixtures = _scan_fixture_dir(os.path.join(root, feed), ".pb")
+            if fixtures:
+                self._set_timeline(feed, [(ts, self._file_loader(path)) for ts, path in fixtures])
+            else:
+                entries = archive.index(feed)
+                self._set_timeline(feed, [
+                    (ts, self._archive_loader(seg, offset, length))
+                    for ts, seg, offset, length in entries
+                ])
+        for feed in JSON_FEEDS:
+            fixtures = _scan_fixture_dir(os.path.join(root, feed), ".json")
+            self._set_timeline(feed, [(ts, self._json_loader(path)) for ts, path in fixtures])
+
+        if start_ts is None:
+            first = [ts[0] for ts, _ in self._timelines.values() if ts]
+            start_ts = min(first) if first else time.time()
+        self.clock = ReplayClock(start_ts, speed)
+
+        counts = ", ".join(f"{feed}={len(ts)}" for feed, (ts, _) in self._timelines.items())
+        print(f"[REPLAY] Serving recorded feeds from {root} (speed={speed}, {counts})")
+
+    def _set_timeline(self, feed, entries):
+        self._timelines[feed] = ([ts for ts, _ in entries], [loader for _, loader in entries])
+
+    @staticmethod
+    def _file_loader(path):
+        def load():
+            with open(path, "rb") as f:
+                return f.read()
+        return load
+
+    @staticmethod
+    def _json_loader(path):
+        def load():
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return load
+
+    @staticmethod
+    def _archive_loader(seg_path, offset, length):
+        return lambda: FeedArchive.read_payload(seg_path, offset, length)
+
+    def now(self):
+        return self.clock.now()
+
+    def _at(self, feed, ts):
+        timestamps, loaders = self._timelines.get(feed, ([], []))
+        if not timestamps:
+            return None
+        pos = bisect.bisect_right(timestamps, ts) - 1
+        return loaders[max(pos, 0)]()
+
+    def feed_bytes(self, feed):
+        """Raw protobuf for 'trip_updates' or 'vehicle_positions' at the simulated time."""
+        if feed == "trip_updates" and self.clock.speed <= 0:
+            with self._lock:
+                timestamps, _ = self._timelines[feed]
+                if timestamps:
+                    self._step_index = min(self._step_index + 1, len(timestamps) - 1)
+                    self.clock.step_to(timestamps[self._step_index])
+        return self._at(feed, self.now())
+
+    def json_document(self, feed):
+        """Parsed 'alerts' or 'weather' JSON at the simulated time, or None."""
+        return self._at(feed, self.now())
+
+
+_source = None
+_source_lock = threading.Lock()
+
+
+def is_enabled():
+    return FEED_SOURCE == "replay"
+
+
+def get_source():
+    global _source
+    if _source is None:
+        with _source_lock:
+            if _source is None:
+                if not REPLAY_DIR:
+                    raise ValueError("FEED_SOURCE=replay requires REPLAY_DIR")
+                start = float(REPLAY_START) if REPLAY_START else None
+                _source = ReplaySource(REPLAY_DIR, REPLAY_SPEED, start)
+    return _source
+
+
+def current_time():
+    """Unix time as seen by the pipeline: simulated in replay mode, wall clock otherwise."""
+    if is_enabled():
+        return get_source().now()
+    return time.time()
@@ -0,0 +1,208 @@
+"""
+Route shapes packed into flat arrays, with cumulative distances and
+simplified polylines.
+
+    shapes = get_dataset().shapes
+    shapes.simplified("61_0")                     # [(lat, lon), ...] for the map
+    shapes.project("61_0", lat, lon, near=1200)   # (metres along the shape, metres off it)
+
+Every shapes.txt point is one slot of three parallel arrays, grouped by
+shape in shape_pt_sequence order: latitude, longitude and the distance in
+metres from the shape's first point. A shape is a [start, end) slice of
+the arrays. Distances are measured on an equirectangular projection scaled
+at each segment's latitude (within centimetres of great-circle distances
+for segments of a city bus route); shape_dist_traveled is not used, as its
+unit varies between feeds.
+
+The simplified polyline of each shape (Douglas-Peucker, SIMPLIFY_TOLERANCE
+metres) is computed at load time and kept as the slots it retains, so the
+map polyline costs one index array per shape.
+
+project() finds the closest point of a shape to a position. Given `near`,
+the distance along the shape of the previous projection of the same
+vehicle, it only looks at the segments within PROJECT_WINDOW metres of it
+(and falls back to the whole shape when nothing there is within
+MAX_OFFSET), which bounds the cost per vehicle and keeps a vehicle on the
+right leg of a shape that passes the same place twice.
+"""
+import sys
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+
+from . import gtfs_source
+
+EARTH_RADIUS = 6371008.8     # metres (mean)
+SIMPLIFY_TOLERANCE = 5.0     # metres
+PROJECT_WINDOW = 1500.0      # metres each way of the previous position
+MAX_OFFSET = 150.0           # metres; farther from the window's segments, search the whole shape
+
+_K = math.radians(1) * EARTH_RADIUS    # metres per degree of latitude
+
+
+def _simplify(xs, ys, tolerance):
+    """Indexes (ascending) of the points Douglas-Peucker keeps in a polyline."""
+    n = len(xs)
+    if n <= 2:
+        return list(range(n))
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    tolerance2 = tolerance * tolerance
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xs[first], ys[first]
+        dx, dy = xs[last] - ax, ys[last] - ay
+        length2 = dx * dx + dy * dy
+        worst, worst_d2 = -1, tolerance2
+        for i in range(first + 1, last):
+            px, py = xs[i] - ax, ys[i] - ay
+            dot = px * dx + py * dy
+            if dot <= 0 or length2 == 0:
+                d2 = px * px + py * py
+            elif dot >= length2:
+                d2 = (px - dx) * (px - dx) + (py - dy) * (py - dy)
+            else:
+                cross = px * dy - py * dx     # distance to the segment's line
+                d2 = cross * cross / length2
+            if d2 > worst_d2:
+                worst, worst_d2 = i, d2
+        if worst > 0:
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return [i for i in range(n) if keep[i]]
+
+
+class ShapeIndex:
+    def __init__(self):
+        self._lats = array("d")
+        self._lons = array("d")
+        self._dist = array("d")       # metres from the shape's first point
+        self._offsets = {}            # shape_id -> (start, end)
+        self._simplified = {}         # shape_id -> array of kept slots
+        self._stop_distances = {}     # (shape_id, stop_id) -> metres along the shape
+
+    @classmethod
+    def from_source(cls, source, table="shapes.txt", tolerance=SIMPLIFY_TOLERANCE):
+        """source: a GtfsSource, a GTFS directory or zip, or the path of shapes.txt."""
+        source, table = gtfs_source.table_source(source, table)
+        self = cls()
+        points = {}
+        columns = ("shape_id", "shape_pt_sequence", "shape_pt_lat", "shape_pt_lon")
+        for shape_id, seq, lat, lon in source.rows(table, columns):
+            try:
+                points.setdefault(shape_id, []).append((int(seq), float(lat), float(lon)))
+            except (TypeError, ValueError):
+                continue
+
+        lats, lons, dist = self._lats, self._lons, self._dist
+        for shape_id, pts in points.items():
+            pts.sort()
+            start = len(lats)
+            total, prev_lat, prev_lon = 0.0, None, None
+            for _, lat, lon in pts:
+                if prev_lat is not None:
+                    total += _distance(prev_lat, prev_lon, lat, lon)
+                lats.append(lat)
+                lons.append(lon)
+                dist.append(total)
+                prev_lat, prev_lon = lat, lon
+            self._offsets[shape_id] = (start, len(lats))
+
+            k_lon = _K * math.cos(math.radians(pts[0][1]))
+            kept = _simplify([lon * k_lon for _, _, lon in pts], [lat * _K for _, lat, _ in pts], tolerance)
+            self._simplified[shape_id] = array("I", [start + i for i in kept])
+        return self
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __contains__(self, shape_id):
+        return shape_id in self._offsets
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self)
+                + sum(sys.getsizeof(a) for a in (self._lats, self._lons, self._dist))
+                + sys.getsizeof(self._offsets) + len(self._offsets) * sys.getsizeof((0, 0))
+                + sys.getsizeof(self._simplified)
+                + sum(sys.getsizeof(a) for a in self._simplified.values()))
+
+    # ─── Geometry ──────────────────────────────────────────────
+    def points(self, shape_id):
+        """[(lat, lon)] of every point of a shape."""
+        span = self._offsets.get(shape_id)
+        if span is None:
+            return []
+        return list(zip(self._lats[span[0]:span[1]], self._lons[span[0]:span[1]]))
+
+    def simplified(self, shape_id):
+        """[(lat, lon)] of the shape's simplified polyline."""
+        lats, lons = self._lats, self._lons
+        return [(lats[i], lons[i]) for i in self._simplified.get(shape_id, ())]
+
+    def length(self, shape_id):
+        """Length of a shape in metres, None if unknown."""
+        span = self._offsets.get(shape_id)
+        if span is None or span[1] == span[0]:
+            return None
+        return self._dist[span[1] - 1]
+
+    # ─── Projection ────────────────────────────────────────────
+    def project(self, shape_id, lat, lon, near=None):
+        """
+        (metres along the shape, metres off it) of the closest point of the
+        shape to (lat, lon), or None for an unknown shape.
+        """
+        span = self._offsets.get(shape_id)
+        if span is None or span[1] == span[0]:
+            return None
+        start, end = span
+        if near is not None:
+            lo = max(start, bisect_left(self._dist, near - PROJECT_WINDOW, start, end) - 1)
+            hi = min(end, bisect_right(self._dist, near + PROJECT_WINDOW, start, end) + 1)
+            found = self._closest(lo, hi, lat, lon)
+            if found[1] <= MAX_OFFSET:
+                return found
+        return self._closest(start, end, lat, lon)
+
+    def _closest(self, start, end, lat, lon):
+        lats, lons, dist = self._lats, self._lons, self._dist
+        k_lon = _K * math.cos(math.radians(lat))
+        if end - start == 1:
+            return dist[start], math.hypot((lons[start] - lon) * k_lon, (lats[start] - lat) * _K)
+        best_d2, best_along = None, 0.0
+        # Segment ends relative to the position, in metres
+        bx, by = (lons[start] - lon) * k_lon, (lats[start] - lat) * _K
+        for i in range(start + 1, end):
+            ax, ay = bx, by
+            bx, by = (lons[i] - lon) * k_lon, (lats[i] - lat) * _K
+            dx, dy = bx - ax, by - ay
+            length2 = dx * dx + dy * dy
+            t = 0.0
+            if length2 > 0:
+                t = max(0.0, min(1.0, -(ax * dx + ay * dy) / length2))
+            px, py = ax + t * dx, ay + t * dy
+            d2 = px * px + py * py
+            if best_d2 is None or d2 < best_d2:
+                best_d2 = d2
+                best_along = dist[i - 1] + t * (dist[i] - dist[i - 1])
+        return best_along, math.sqrt(best_d2)
+
+    def stop_distance(self, shape_id, stop_id, lat, lon):
+        """
+        Metres along the shape of a stop at (lat, lon), cached per (shape,
+        stop); None when the stop is more than MAX_OFFSET off the shape.
+        """
+        key = (shape_id, stop_id)
+        if key not in self._stop_distances:
+            found = self.project(shape_id, lat, lon)
+            self._stop_distances[key] = found[0] if found and found[1] <= MAX_OFFSET else None
+        return self._stop_distances[key]
+
+
+def _distance(lat1, lon1, lat2, lon2):
+    """Metres between two nearby points (equirectangular at their mean latitude)."""
+    x = (lon2 - lon1) * _K * math.cos(math.radians((lat1 + lat2) / 2))
+    y = (lat2 - lat1) * _K
+    return math.hypot(x, y)
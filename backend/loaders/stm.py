@@ -1,9 +1,7 @@
 import requests
 import os
-import csv
-import time
 from datetime import datetime, timedelta
-from google.transit import gtfs_realtime_pb2
+import msgspec
 from backend.config import (
     STM_API_KEY,
     STM_REALTIME_ENDPOINT,
@@ -12,12 +10,24 @@ from backend.config import (
     BUS_ROUTES,
     BUS_STOP_IDS,
     BUS_ROUTE_COMBOS,
-    BUS_DISPLAY_INFO
+    BUS_DISPLAY_INFO,
+    STM_FEED_CACHE_TTL,
+    REPLAY_SPEED,
+    GTFS_RT_DECODER,
+    UPSTREAM_TIMEOUT,
 )
 from backend.utils import load_csv_dict  
-# Cache for calendar data
-_calendar_data = None
-_calendar_dates_data = None
+from backend.managers.archive_manager import archive_feed
+from backend.loaders import replay
+from backend.parsers import gtfs_rt_fast
+from backend.loaders import gtfs_source
+from backend.loaders import gtfs_dataset
+from backend.loaders.blocks import MAX_CHAIN
+from backend import metrics
+from backend import models
+from backend import analytics
+from backend import prediction_tracker
+from backend.cache import CoalescingCache, CacheBackoff
 
 IS_DEV_MODE = os.environ.get('ENVIRONMENT') == 'development'
 
@@ -26,39 +36,30 @@ IS_DEV_MODE = os.environ.get('ENVIRONMENT') == 'development'
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
 def load_calendar_data():
-    global _calendar_data
-    if _calendar_data is None:
-        cal_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "STM", "calendar.txt")
-        _calendar_data = {}
-        try:
-            with open(cal_path, mode="r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    service_id = row["service_id"]
-                    _calendar_data[service_id] = row
-        except Exception as e:
-            print("Error loading calendar.txt:", e)
-    return _calendar_data
+    """calendar.txt rows by service_id, loaded once from the shared GTFS dataset."""
+    try:
+        return gtfs_dataset.get_dataset().calendar
+    except Exception as e:
+        print("Error loading calendar.txt:", e)
+        return {}
 
 def load_calendar_dates_data():
-    global _calendar_dates_data
-    if _calendar_dates_data is None:
-        cal_dates_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "STM", "calendar_dates.txt")
-        _calendar_dates_data = {}
-        try:
-            with open(cal_dates_path, mode="r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    service_id = row["service_id"]
-                    if service_id not in _calendar_dates_data:
-                        _calendar_dates_data[service_id] = []
-                    _calendar_dates_data[service_id].append(row)
-        except Exception as e:
-            print("Error loading calendar_dates.txt:", e)
-    return _calendar_dates_data
+    """calendar_dates.txt rows grouped by service_id, from the shared GTFS dataset."""
+    try:
+        return gtfs_dataset.get_dataset().calendar_dates
+    except Exception as e:
+        print("Error loading calendar_dates.txt:", e)
+        return {}
+
+def _now():
+    """Current local datetime, following the simulated clock in replay mode."""
+    return datetime.fromtimestamp(replay.current_time())
 
 def serviceRunsToday(service_id):
-    today = datetime.now().date()
+    return service_runs_on(service_id, _now().date())
+
+def service_runs_on(service_id, today):
+    """True if the service runs on the given date (calendar.txt + calendar_dates.txt)."""
     run_today = False
 
     cal_data = load_calendar_data()
@@ -96,208 +97,251 @@ def serviceRunsToday(service_id):
                     run_today = True
     return run_today
 
-def fetch_stm_realtime_data():
-    # if IS_DEV_MODE:
-    #     from backend.mock_stm_data import get_mock_trip_entities
-    #     return get_mock_trip_entities()
+class UpstreamError(Exception):
+    """Upstream answered, but not with something worth caching."""
+
+
+def _feed_cache_ttl():
+    # In replay step mode every fetch advances the simulated clock, so a
+    # cached feed would hide the next recording.
+    if replay.is_enabled() and REPLAY_SPEED <= 0:
+        return 0
+    return STM_FEED_CACHE_TTL
+
+
+# Single-flight caches: concurrent requests share one upstream fetch
+_feed_cache = CoalescingCache("stm_feeds", ttl=_feed_cache_ttl())
+_feed_timestamps = {}   # feed name -> header timestamp of the last parsed feed
+_feed_contents = {}     # feed name -> raw bytes of the last parsed feed
+
+
+def feed_timestamp(feed_name):
+    """Header timestamp (unix) of the last parsed feed, or None."""
+    return _feed_timestamps.get(feed_name)
+
+
+def feed_content(feed_name):
+    """
+    Raw bytes of the last parsed feed, or None. The fetchers only decode our
+    routes' entities in "fast" mode; network-wide views decode these instead.
+    """
+    return _feed_contents.get(feed_name)
+
+
+def _download_feed(feed_name, endpoint, upstream, success_message):
+    if replay.is_enabled():
+        return _parse_replayed_feed(feed_name)
     headers = {
         "accept": "application/x-protobuf",
         "apiKey": STM_API_KEY,
     }
-    response = requests.get(STM_REALTIME_ENDPOINT, headers=headers)
-    if response.status_code == 200:
-        print("API Fetch Success")
-        feed = gtfs_realtime_pb2.FeedMessage()
-        feed.ParseFromString(response.content)
-        return feed.entity
-    else:
+    try:
+        with metrics.span(f"{upstream}_fetch"):
+            response = requests.get(endpoint, headers=headers, timeout=UPSTREAM_TIMEOUT)
+    except requests.exceptions.RequestException:
+        metrics.inc("upstream_errors_total", upstream=upstream)
+        raise
+    if response.status_code != 200:
+        metrics.inc("upstream_errors_total", upstream=upstream)
         print(f"API Error: {response.status_code} - {response.text}")
+        raise UpstreamError(f"{upstream}: HTTP {response.status_code}")
+    print(success_message)
+    return _parse_feed(feed_name, upstream, response.content)
+
+
+# GTFS route_ids whose short name is in BUS_ROUTES (filled by load_stm_routes)
+_watched_gtfs_route_ids = set()
+
+# Routes whose trips the vehicles of our trips run just before them in
+# their block (interlining), and the blocks index they were computed from
+_interlined_route_ids = frozenset()
+_interlined_blocks = None
+
+
+def _interlined_routes():
+    """
+    Route ids (short and GTFS) of the trips up to MAX_CHAIN before one of
+    ours in its block, so their live delay can be chained. Computed once per
+    GTFS version, and only once the blocks are loaded: the parse path never
+    loads stop_times itself.
+    """
+    global _interlined_route_ids, _interlined_blocks
+    dataset = gtfs_dataset.get_dataset()
+    if not dataset.is_loaded("blocks"):
+        return _interlined_route_ids
+    blocks = dataset.blocks
+    if blocks is not _interlined_blocks:
+        trips = dataset.trips
+        short_names = set()
+        for trip_id, trip in trips.items():
+            if trip["route_id"] not in BUS_ROUTES:
+                continue
+            previous = trip_id
+            for _ in range(MAX_CHAIN):
+                previous = blocks.previous_trip(previous)
+                if previous is None:
+                    break
+                short_names.add(trips.get(previous, {}).get("route_id"))
+        short_names.difference_update(BUS_ROUTES)
+        short_names.discard(None)
+        real_ids = {real_id for real_id, short_name in dataset.routes.items() if short_name in short_names}
+        _interlined_route_ids = frozenset(short_names | real_ids)
+        _interlined_blocks = blocks
+    return _interlined_route_ids
+
+
+def _decode_feed(content, upstream):
+    """
+    (FeedHeader, entities); in "fast" mode only entities of our routes, and
+    of the routes interlined with them, are decoded.
+    """
+    route_ids = None
+    if GTFS_RT_DECODER == "fast":
+        route_ids = set(BUS_ROUTES) | _watched_gtfs_route_ids | _interlined_routes()
+    with metrics.span(f"{upstream}_parse"):
+        return gtfs_rt_fast.parse_feed(content, route_ids)
+
+
+def _parse_feed(feed_name, upstream, content):
+    """Parse a downloaded feed and archive it; shared with the async fetcher (backend/asgi.py)."""
+    header, entities = _decode_feed(content, upstream)
+    _feed_timestamps[feed_name] = header.timestamp or None
+    _feed_contents[feed_name] = content
+    archive_feed(feed_name, header.timestamp, content)
+    if feed_name == "trip_updates":
+        _observe_trip_updates(header.timestamp, entities)
+    return entities
+
+
+def _observe_trip_updates(feed_ts, entities):
+    """Per-feed-generation consumers of trip updates."""
+    analytics.observe_trip_updates(feed_ts, entities)
+    prediction_tracker.observe_feed(feed_ts, entities)
+
+
+def fetch_stm_realtime_data():
+    # if IS_DEV_MODE:
+    #     from backend.mock_stm_data import get_mock_trip_entities
+    #     return get_mock_trip_entities()
+    try:
+        return _feed_cache.get("trip_updates", lambda: _download_feed(
+            "trip_updates", STM_REALTIME_ENDPOINT, "stm_trip_updates", "API Fetch Success"))
+    except (UpstreamError, CacheBackoff):
         return []
-    
+
 def fetch_stm_vehicle_positions():
     # if IS_DEV_MODE:
     #     from backend.mock_stm_data import get_mock_vehicle_positions
     #     return get_mock_vehicle_positions()
-    headers = {
-        "accept": "application/x-protobuf",
-        "apiKey": STM_API_KEY,
-    }
-    response = requests.get(STM_VEHICLE_POSITIONS_ENDPOINT, headers=headers)
-    if response.status_code == 200:
-        print("Vehicle Positions Fetch Success")
-        feed = gtfs_realtime_pb2.FeedMessage()
-        feed.ParseFromString(response.content)
-        return feed.entity
-    else:
-        print(f"API Error: {response.status_code} - {response.text}")
-        return []   
+    try:
+        return _feed_cache.get("vehicle_positions", lambda: _download_feed(
+            "vehicle_positions", STM_VEHICLE_POSITIONS_ENDPOINT, "stm_vehicle_positions",
+            "Vehicle Positions Fetch Success"))
+    except (UpstreamError, CacheBackoff):
+        return []
+
+def _parse_replayed_feed(feed_name):
+    content = replay.get_source().feed_bytes(feed_name)
+    if not content:
+        print(f"[REPLAY] No recorded {feed_name} feed available")
+        return []
+    header, entities = _decode_feed(content, f"stm_{feed_name}")
+    _feed_timestamps[feed_name] = header.timestamp or None
+    _feed_contents[feed_name] = content
+    if feed_name == "trip_updates":
+        _observe_trip_updates(header.timestamp, entities)
+    return entities
 
 
 # Cache for STM alerts to avoid rate limits
-_stm_alerts_cache = {
-    "timestamp": 0,
-    "data": None
-}
 STM_ALERTS_CACHE_TTL = 30  # Cache alerts for 30 seconds
+_alerts_cache = CoalescingCache("stm_alerts", ttl=STM_ALERTS_CACHE_TTL)
 
 def fetch_stm_alerts():
     # if IS_DEV_MODE:
     #     from backend.mock_stm_data import get_mock_alerts
     #     return get_mock_alerts()
-    
-    global _stm_alerts_cache
-
-    # Check if cache is still valid
-    current_time = time.time()
-    if current_time - _stm_alerts_cache["timestamp"] < STM_ALERTS_CACHE_TTL:
-        if _stm_alerts_cache["data"] is not None:
-            print(f"[CACHE] Using cached STM alerts (age: {int(current_time - _stm_alerts_cache['timestamp'])}s)")
-            return _stm_alerts_cache["data"]
-    
-    # Cache expired or empty, fetch fresh data
+    try:
+        # On failure the cache hands back the last good alerts if it has them
+        return _alerts_cache.get("alerts", _load_stm_alerts)
+    except Exception as e:
+        print(f"[ERROR] Error fetching alerts: {str(e)}")
+        return []
+
+def _load_stm_alerts():
     print("[API] Fetching fresh STM alerts from API...")
-    
+
     headers = {
         "accept": "application/json",
         "apiKey": STM_API_KEY,
     }
     try:
-        response = requests.get(STM_ALERTS_ENDPOINT, headers=headers)
-        if response.status_code == 200:
-            json_data = response.json()
-            
-            # Check if the data structure contains 'result' key (new JSON format)
-            if isinstance(json_data, dict) and "result" in json_data:
-                result = json_data["result"]
-                if isinstance(result, dict):
-                    # Extract metro line data if available
-                    metro_lines = []
-                    for key, value in result.items():
-                        if key.startswith("ligne") and isinstance(value, dict):
-                            # Process each metro line
-                            metro_lines.append(value)
-                    
-                    # Also check for alerts in result
-                    alerts = result.get("alerts", [])
-                    if alerts:
-                        # Normalize alert format
-                        normalized = _normalize_alerts(alerts)
-                        _stm_alerts_cache["data"] = normalized
-                        _stm_alerts_cache["timestamp"] = current_time
-                        return normalized
-                    elif metro_lines:
-                        # Convert metro line info to normalized alert format
-                        converted_alerts = []
-                        for line in metro_lines:
-                            etat_obj = line.get("etat", {})
-                            etat_status = etat_obj.get("etat", "NORMAL")
-                            
-                            # Only create alert if not normal
-                            if etat_status != "NORMAL":
-                                libelle = etat_obj.get("libelle", "Service perturbé")
-                                detail = etat_obj.get("detail", libelle)
-                                numero = line.get("numero", "")
-                                
-                                alert = {
-                                    "informed_entities": [{"route_short_name": numero}],
-                                    "header_texts": [{"language": "fr", "text": libelle}],
-                                    "description_texts": [{"language": "fr", "text": detail}]
-                                }
-                                converted_alerts.append(alert)
-                        _stm_alerts_cache["data"] = converted_alerts
-                        _stm_alerts_cache["timestamp"] = current_time
-                        return converted_alerts
-                    
-                    # No alerts found
-                    _stm_alerts_cache["data"] = []
-                    _stm_alerts_cache["timestamp"] = current_time
-                    return []
-                    
-            # Fallback to old format
-            elif isinstance(json_data, dict) and "alerts" in json_data:
-                normalized = _normalize_alerts(json_data["alerts"])
-                _stm_alerts_cache["data"] = normalized
-                _stm_alerts_cache["timestamp"] = current_time
-                return normalized
-            elif isinstance(json_data, list):
-                normalized = _normalize_alerts(json_data)
-                _stm_alerts_cache["data"] = normalized
-                _stm_alerts_cache["timestamp"] = current_time
-                return normalized
-            else:
-                print(f"Unexpected STM alerts response format: {type(json_data)}")
-                return _stm_alerts_cache["data"] or []
-        else:
-            print(f"[ERROR] STM API Error: {response.status_code} - {response.text}")
-            # Return cached data if available even if stale
-            return _stm_alerts_cache["data"] or []
-    except Exception as e:
-        print(f"[ERROR] Error fetching alerts: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        # Return cached data if available even if stale
-        return _stm_alerts_cache["data"] or []
-
-def _normalize_alerts(alerts):
-    """
-    Normalize alert format to ensure consistent field names.
-    Converts old format (informed_entity, header_text) to new format (informed_entities, header_texts).
-    """
-    normalized = []
-    for alert in alerts:
-        if not isinstance(alert, dict):
-            continue
-            
-        normalized_alert = {}
-        
-        # Normalize informed_entities (handle both singular and plural)
-        if "informed_entities" in alert:
-            normalized_alert["informed_entities"] = alert["informed_entities"]
-        elif "informed_entity" in alert:
-            normalized_alert["informed_entities"] = alert["informed_entity"]
+        if replay.is_enabled():
+            json_data = replay.get_source().json_document("alerts")
+            status_code = 200 if json_data is not None else 404
         else:
-            normalized_alert["informed_entities"] = []
-        
-        # Normalize header_texts
-        if "header_texts" in alert:
-            normalized_alert["header_texts"] = alert["header_texts"]
-        elif "header_text" in alert:
-            # Convert old format to new format
-            header_text = alert["header_text"]
-            if isinstance(header_text, dict) and "translation" in header_text:
-                normalized_alert["header_texts"] = [
-                    {"language": t.get("language", "fr"), "text": t.get("text", "")}
-                    for t in header_text["translation"]
-                ]
-            else:
-                normalized_alert["header_texts"] = []
-        else:
-            normalized_alert["header_texts"] = []
-        
-        # Normalize description_texts
-        if "description_texts" in alert:
-            normalized_alert["description_texts"] = alert["description_texts"]
-        elif "description_text" in alert:
-            # Convert old format to new format
-            description_text = alert["description_text"]
-            if isinstance(description_text, dict) and "translation" in description_text:
-                normalized_alert["description_texts"] = [
-                    {"language": t.get("language", "fr"), "text": t.get("text", "")}
-                    for t in description_text["translation"]
-                ]
-            else:
-                normalized_alert["description_texts"] = []
-        else:
-            normalized_alert["description_texts"] = []
-        
-        # Copy over other fields that might be useful
-        for key in ["active_periods", "cause", "effect"]:
-            if key in alert:
-                normalized_alert[key] = alert[key]
-        
-        normalized.append(normalized_alert)
-    
-    return normalized
+            with metrics.span("stm_alerts_fetch"):
+                response = requests.get(STM_ALERTS_ENDPOINT, headers=headers, timeout=UPSTREAM_TIMEOUT)
+                status_code = response.status_code
+                json_data = response.content if status_code == 200 else None
+        if status_code != 200:
+            print(f"[ERROR] STM API Error: {status_code}")
+            raise UpstreamError(f"stm_alerts: HTTP {status_code}")
+        return _parse_stm_alerts(json_data)
+    except Exception:
+        metrics.inc("upstream_errors_total", upstream="stm_alerts")
+        raise
+
+def _parse_stm_alerts(data):
+    """[StmAlert] from the alerts response body (bytes) or an already parsed document."""
+    try:
+        document = models.decode_stm_alerts(data)
+    except (msgspec.ValidationError, msgspec.DecodeError) as e:
+        print(f"Unexpected STM alerts response format: {e}")
+        raise UpstreamError(f"Unexpected STM alerts response format: {e}")
+
+    if isinstance(document, list):
+        return document
+    if document.result is None:
+        return document.alerts or []
+
+    # Newer format: {"result": {"alerts": [...], "ligne1": {...}, ...}}
+    result = document.result
+    try:
+        alerts = models.convert_alerts(result.get("alerts") or [])
+        if alerts:
+            return alerts
+        # Convert metro line info to alerts
+        converted_alerts = []
+        for key, value in result.items():
+            if not (key.startswith("ligne") and isinstance(value, dict)):
+                continue
+            line = models.convert(value, models.MetroLineDocument)
+            # Only create alert if not normal
+            if line.etat.etat != "NORMAL":
+                libelle = line.etat.libelle or "Service perturbé"
+                converted_alerts.append(models.StmAlert(
+                    informed_entities=[models.InformedEntity(route_short_name=str(line.numero))],
+                    header_texts=[models.Translation("fr", libelle)],
+                    description_texts=[models.Translation("fr", line.etat.detail or libelle)],
+                ))
+        return converted_alerts
+    except msgspec.ValidationError as e:
+        raise UpstreamError(f"Unexpected STM alerts result format: {e}")
+
+
+def _active_period(alert):
+    """(start, end) of the first active period of an alert, or (None, None)."""
+    period = alert.active_periods
+    if isinstance(period, list):
+        period = period[0] if period else None
+    if not isinstance(period, dict):
+        return None, None
+    return period.get("start"), period.get("end")
+
+
+def _first_text(translations):
+    return (translations[0].text or "") if translations else ""
 
 
 def fetch_stm_general_alerts():
@@ -312,42 +356,20 @@ def fetch_stm_general_alerts():
     
     general_alerts = []
     for alert in alerts_data:
-        if isinstance(alert, dict):
-            # Check if this is a general network alert (no specific routes)
-            informed_entity = alert.get("informed_entity", [])
-            
-            # If no informed_entity or it's empty, it's a general alert
-            if not informed_entity or len(informed_entity) == 0:
-                header_text = alert.get("header_text", {})
-                description_text = alert.get("description_text", {})
-                
-                header = ""
-                description = ""
-                
-                # Extract header text
-                if isinstance(header_text, dict):
-                    translations = header_text.get("translation", [])
-                    if translations:
-                        header = translations[0].get("text", "")
-                elif isinstance(header_text, str):
-                    header = header_text
-                
-                # Extract description text
-                if isinstance(description_text, dict):
-                    translations = description_text.get("translation", [])
-                    if translations:
-                        description = translations[0].get("text", "")
-                elif isinstance(description_text, str):
-                    description = description_text
-                
-                if header or description:
-                    general_alerts.append({
-                        "header": header,
-                        "description": description,
-                        "start_date": alert.get("active_period", [{}])[0].get("start") if alert.get("active_period") else None,
-                        "end_date": alert.get("active_period", [{}])[0].get("end") if alert.get("active_period") else None
-                    })
-    
+        # If no informed entity, it's a general alert
+        if not alert.informed_entities:
+            header = _first_text(alert.header_texts)
+            description = _first_text(alert.description_texts)
+
+            if header or description:
+                start, end = _active_period(alert)
+                general_alerts.append({
+                    "header": header,
+                    "description": description,
+                    "start_date": start,
+                    "end_date": end
+                })
+
     return general_alerts
 
 def fetch_stm_route_specific_alerts(route_ids):
@@ -362,47 +384,22 @@ def fetch_stm_route_specific_alerts(route_ids):
     route_alerts = {route_id: [] for route_id in route_ids}
     
     for alert in alerts_data:
-        if isinstance(alert, dict):
-            informed_entities = alert.get("informed_entity", [])
-            
-            for entity in informed_entities:
-                if isinstance(entity, dict):
-                    route_id = entity.get("route_id") or entity.get("route_short_name")
-                    
-                    if route_id in route_ids:
-                        header_text = alert.get("header_text", {})
-                        description_text = alert.get("description_text", {})
-                        
-                        header = ""
-                        description = ""
-                        
-                        # Extract header
-                        if isinstance(header_text, dict):
-                            translations = header_text.get("translation", [])
-                            if translations:
-                                header = translations[0].get("text", "")
-                        elif isinstance(header_text, str):
-                            header = header_text
-                        
-                        # Extract description
-                        if isinstance(description_text, dict):
-                            translations = description_text.get("translation", [])
-                            if translations:
-                                description = translations[0].get("text", "")
-                        elif isinstance(description_text, str):
-                            description = description_text
-                        
-                        alert_info = {
-                            "header": header,
-                            "description": description,
-                            "effect": alert.get("effect", "UNKNOWN_EFFECT"),
-                            "cause": alert.get("cause", "UNKNOWN_CAUSE"),
-                            "start_date": alert.get("active_period", [{}])[0].get("start") if alert.get("active_period") else None,
-                            "end_date": alert.get("active_period", [{}])[0].get("end") if alert.get("active_period") else None
-                        }
-                        
-                        route_alerts[route_id].append(alert_info)
-    
+        for entity in alert.informed_entities:
+            route_id = entity.route_id or entity.route_short_name
+
+            if route_id in route_ids:
+                start, end = _active_period(alert)
+                alert_info = {
+                    "header": _first_text(alert.header_texts),
+                    "description": _first_text(alert.description_texts),
+                    "effect": alert.effect or "UNKNOWN_EFFECT",
+                    "cause": alert.cause or "UNKNOWN_CAUSE",
+                    "start_date": start,
+                    "end_date": end
+                }
+
+                route_alerts[route_id].append(alert_info)
+
     return route_alerts
 
 def fetch_all_stm_alerts():
@@ -488,39 +485,43 @@ def get_default_metro_status():
         }
     ]
 
+@metrics.timed("load_stm_routes")
 def load_stm_routes(routes_file):
+    """routes_file: routes.txt, a GTFS directory or zip, or a GtfsSource."""
+    source, table = gtfs_source.table_source(routes_file, "routes.txt")
     routes_data = {}
-    with open(routes_file, mode="r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            real_id = row["route_id"]              
-            short_name = row["route_short_name"] 
-            routes_data[real_id] = short_name
+    for real_id, short_name in source.rows(table, ("route_id", "route_short_name")):
+        routes_data[real_id] = short_name
+        if short_name in BUS_ROUTES:
+            _watched_gtfs_route_ids.add(real_id)
     return routes_data
 
+@metrics.timed("load_stm_stop_times")
 def load_stm_stop_times(filepath):
-    stop_times = {}
-    with open(filepath, mode="r", encoding="utf-8-sig") as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            key = (row["trip_id"], row["stop_id"])
-            stop_times[key] = row["arrival_time"]
-    return stop_times
+    """filepath: stop_times.txt, a GTFS directory or zip, or a GtfsSource."""
+    source, table = gtfs_source.table_source(filepath, "stop_times.txt")
+    return {
+        (trip_id, stop_id): arrival_time
+        for trip_id, stop_id, arrival_time in source.rows(table, ("trip_id", "stop_id", "arrival_time"))
+    }
 
+@metrics.timed("load_stm_gtfs_trips")
 def load_stm_gtfs_trips(filepath, routes_map):
+    """filepath: trips.txt, a GTFS directory or zip, or a GtfsSource."""
+    source, table = gtfs_source.table_source(filepath, "trips.txt")
     trips_data = {}
-    with open(filepath, mode="r", encoding="utf-8-sig") as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            trip_id = row["trip_id"]
-            real_route_id = row["route_id"]  
-            # Convert real_route_id -> short_name
-            short_name = routes_map.get(real_route_id, real_route_id)
-            w_str = row.get("wheelchair_accessible", "0")
-            trips_data[trip_id] = {
-                "route_id": short_name, 
-                "wheelchair_accessible": w_str
-            }
+    shared = {}   # one str object per distinct service id / headsign
+    columns = ("trip_id", "route_id", "wheelchair_accessible", "service_id", "trip_headsign", "shape_id")
+    for trip_id, real_route_id, w_str, service_id, headsign, shape_id in source.rows(table, columns):
+        # Convert real_route_id -> short_name
+        short_name = routes_map.get(real_route_id, real_route_id)
+        trips_data[trip_id] = {
+            "route_id": short_name,
+            "wheelchair_accessible": "0" if w_str is None else w_str,
+            "service_id": shared.setdefault(service_id or "", service_id or ""),
+            "headsign": shared.setdefault(headsign or "", headsign or ""),
+            "shape_id": shared.setdefault(shape_id or "", shape_id or ""),
+        }
     return trips_data
 
 def stm_map_occupancy_status(status):
@@ -544,7 +545,35 @@ def validate_trip(trip_id, route_id, gtfs_trips):
     return trip_info["route_id"] == route_id
 
 
-def fetch_stm_positions_dict(desired_routes, stm_trips, routes_map=None):
+# trip_id -> metres along its shape at the last refresh (hint for the next projection)
+_shape_progress = {}
+
+
+def _vehicle_progress(trip_id, lat, lon, stm_trips, shapes, stops, watched_stops):
+    """
+    (shape_id, metres along the trip's shape, {watched stop_id: metres left})
+    of a vehicle position; Nones when the trip has no known shape.
+    """
+    shape_id = stm_trips.get(trip_id, {}).get("shape_id")
+    if not shape_id or lat is None or lon is None:
+        return None, None, {}
+    found = shapes.project(shape_id, lat, lon, near=_shape_progress.get(trip_id))
+    if found is None:
+        return None, None, {}
+    progress = found[0]
+    remaining = {}
+    for stop_id in watched_stops:
+        stop = stops.get(stop_id)
+        if stop is None or stop[1] is None:
+            continue
+        at_stop = shapes.stop_distance(shape_id, stop_id, stop[1], stop[2])
+        if at_stop is not None and at_stop >= progress:
+            remaining[stop_id] = int(round(at_stop - progress))
+    return shape_id, progress, remaining
+
+
+def fetch_stm_positions_dict(desired_routes, stm_trips, routes_map=None, shapes=None, stops=None,
+                             desired_combos=BUS_ROUTE_COMBOS):
     """
     Fetch vehicle positions and extract occupancy data
     
@@ -552,8 +581,17 @@ def fetch_stm_positions_dict(desired_routes, stm_trips, routes_map=None):
         desired_routes: List of short route names like ["36", "61"]
         stm_trips: Dictionary of trip data
         routes_map: Dictionary mapping GTFS route_id to short names (REQUIRED for occupancy)
+        shapes, stops: the dataset's ShapeIndex and stops; with them each
+            position gets its progress along the trip's shape (one bounded
+            projection per vehicle, see loaders/shapes.py) and the distance
+            left to the watched stops of its route
     """
+    global _shape_progress
     positions = {}
+    progress_by_trip = {}
+    watched_by_route = {}
+    for route_id, stop_id, _ in desired_combos:
+        watched_by_route.setdefault(route_id, []).append(stop_id)
     entities = fetch_stm_vehicle_positions()
     if not entities:
         print("[OCCUPANCY] No vehicle position entities returned from API")
@@ -561,68 +599,164 @@ def fetch_stm_positions_dict(desired_routes, stm_trips, routes_map=None):
     
     print(f"[OCCUPANCY] Processing {len(entities)} vehicle position entities...")
     
-    for entity in entities:
-        if entity.HasField("vehicle"):
-            vehicle = entity.vehicle
-            gtfs_route_id = vehicle.trip.route_id  # This is the internal GTFS ID
-            trip_id = vehicle.trip.trip_id
-            
-            # Convert GTFS route_id to short name
-            if routes_map:
-                short_route_id = routes_map.get(gtfs_route_id, gtfs_route_id)
-            else:
-                short_route_id = gtfs_route_id
-                print(f"[OCCUPANCY] WARNING: No routes_map provided, using raw route_id: {gtfs_route_id}")
-
-            # Only store if it's a route/trip we care about
-            if short_route_id in desired_routes:
-                # Validate the trip exists in our GTFS data
-                if not validate_trip(trip_id, short_route_id, stm_trips):
-                    continue
-                
-                bus_lat = bus_lon = None
-                if vehicle.HasField("position"):
-                    bus_lat = vehicle.position.latitude
-                    bus_lon = vehicle.position.longitude
-                
-                # Extract occupancy status
-                occupancy_raw = None
-                if vehicle.HasField("occupancy_status"):
-                    occupancy_raw = vehicle.occupancy_status
-                    print(f"[OCCUPANCY] Found occupancy for route {short_route_id}, trip {trip_id}: {occupancy_raw}")
-                
-                feed_stop_id = vehicle.stop_id if vehicle.HasField("stop_id") else None
-
-                # Extract current status (IN_TRANSIT_TO, STOPPED_AT, etc.)
-                current_status_str = None
-                if vehicle.HasField("current_status"):
-                    current_status_str = vehicle.current_status 
-
-                # Store using SHORT route name
-                positions[(short_route_id, trip_id)] = {
-                    "lat": bus_lat,
-                    "lon": bus_lon,
-                    "occupancy": occupancy_raw,  # Store raw occupancy value
-                    "stop_id": feed_stop_id,
-                    "current_status": current_status_str
-                }
-                print(f"[OCCUPANCY] Stored position for route {short_route_id}, trip {trip_id}")
-    
+    with metrics.span("stm_positions_process"):
+        for entity in entities:
+            if entity.HasField("vehicle"):
+                vehicle = entity.vehicle
+                gtfs_route_id = vehicle.trip.route_id  # This is the internal GTFS ID
+                trip_id = vehicle.trip.trip_id
+
+                # Convert GTFS route_id to short name
+                if routes_map:
+                    short_route_id = routes_map.get(gtfs_route_id, gtfs_route_id)
+                else:
+                    short_route_id = gtfs_route_id
+                    print(f"[OCCUPANCY] WARNING: No routes_map provided, using raw route_id: {gtfs_route_id}")
+
+                # Only store if it's a route/trip we care about
+                if short_route_id in desired_routes:
+                    # Validate the trip exists in our GTFS data
+                    if not validate_trip(trip_id, short_route_id, stm_trips):
+                        continue
+
+                    bus_lat = bus_lon = None
+                    if vehicle.HasField("position"):
+                        bus_lat = vehicle.position.latitude
+                        bus_lon = vehicle.position.longitude
+
+                    # Extract occupancy status
+                    occupancy_raw = None
+                    if vehicle.HasField("occupancy_status"):
+                        occupancy_raw = vehicle.occupancy_status
+                        print(f"[OCCUPANCY] Found occupancy for route {short_route_id}, trip {trip_id}: {occupancy_raw}")
+
+                    feed_stop_id = vehicle.stop_id if vehicle.HasField("stop_id") else None
+
+                    # Extract current status (IN_TRANSIT_TO, STOPPED_AT, etc.)
+                    current_status_str = None
+                    if vehicle.HasField("current_status"):
+                        current_status_str = vehicle.current_status 
+
+                    shape_id = progress = None
+                    remaining = {}
+                    if shapes is not None and stops is not None:
+                        shape_id, progress, remaining = _vehicle_progress(
+                            trip_id, bus_lat, bus_lon, stm_trips, shapes, stops,
+                            watched_by_route.get(short_route_id, ()))
+                        if progress is not None:
+                            progress_by_trip[trip_id] = progress
+
+                    # Store using SHORT route name
+                    positions[(short_route_id, trip_id)] = {
+                        "lat": bus_lat,
+                        "lon": bus_lon,
+                        "occupancy": occupancy_raw,  # Store raw occupancy value
+                        "stop_id": feed_stop_id,
+                        "current_status": current_status_str,
+                        "shape_id": shape_id,
+                        "progress": progress,
+                        "remaining": remaining,
+                    }
+                    print(f"[OCCUPANCY] Stored position for route {short_route_id}, trip {trip_id}")
+
+    if shapes is not None:
+        _shape_progress = progress_by_trip    # only the vehicles still reporting
     print(f"[OCCUPANCY] Total positions stored: {len(positions)}")
     return positions
 
+def _realtime_bus(route_id, trip_id, stop_id, arrival_unix, display_info,
+                  wheelchair_accessible, stm_stop_times, positions_dict, held_over=False,
+                  propagated=False, chained=False):
+    # Calculate minutes until arrival
+    now_ts = replay.current_time()
+    minutes_to_arrival = int((arrival_unix - now_ts) // 60)
+
+    # Check for delays
+    scheduled_arrival_str = stm_stop_times.get((trip_id, stop_id))
+    delay_text = None
+    scheduled_unix = None
+    if scheduled_arrival_str:
+        try:
+            h, m, s = map(int, scheduled_arrival_str.split(":"))
+            sched_dt = _now().replace(hour=h % 24, minute=m, second=s, microsecond=0)
+            if sched_dt < _now():
+                sched_dt += timedelta(days=1)
+            scheduled_unix = int(sched_dt.timestamp())
+
+            predicted_dt = datetime.fromtimestamp(arrival_unix)
+            if predicted_dt > sched_dt:
+                delay_text = f"En retard (planifié à {sched_dt.strftime('%I:%M %p')})"
+        except Exception:
+            pass
+
+    # Get occupancy from positions dict
+    pos_info = positions_dict.get((route_id, trip_id), {})
+    raw_occ = pos_info.get("occupancy")
+    occ_str = stm_map_occupancy_status(raw_occ) if raw_occ is not None else "Unknown"
+
+    # Determine if bus is at stop
+    at_stop_flag = minutes_to_arrival < 2
+
+    return models.Bus(
+        route_id=route_id,
+        trip_id=trip_id,
+        stop_id=stop_id,
+        arrival_time=minutes_to_arrival,
+        occupancy=occ_str,  # Use mapped occupancy string
+        direction=display_info["direction"],
+        location=display_info["location"],
+        delayed_text=delay_text,
+        at_stop=at_stop_flag,
+        wheelchair_accessible=wheelchair_accessible,
+        service_status="normal",
+        held_over=held_over,
+        propagated=propagated,
+        chained=chained,
+        # Absolute times (unix seconds) so clients can count down locally
+        predicted_arrival=int(round(arrival_unix)),
+        scheduled_arrival=scheduled_unix,
+        feed_timestamp=feed_timestamp("trip_updates"),
+        lat=pos_info.get("lat"),
+        lon=pos_info.get("lon"),
+        current_status=pos_info.get("current_status"),
+        shape_id=pos_info.get("shape_id"),
+        progress=int(round(pos_info["progress"])) if pos_info.get("progress") is not None else None,
+        distance_remaining=pos_info.get("remaining", {}).get(stop_id),
+    )
+
+def _keep_closest(closest_buses, final_key, bus_obj):
+    """Update if this is the closest bus"""
+    existing = closest_buses[final_key]
+    if existing is None or (
+        (not existing.cancelled and not bus_obj.cancelled) and
+        isinstance(existing.arrival_time, (int, float)) and
+        isinstance(bus_obj.arrival_time, (int, float)) and
+        bus_obj.arrival_time < existing.arrival_time
+    ) or (
+        existing.cancelled and not bus_obj.cancelled
+    ):
+        closest_buses[final_key] = bus_obj
+
 def process_stm_trip_updates(
     trip_entities,
     stm_trips,
     stm_stop_times,
     positions_dict,
     desired_combos=BUS_ROUTE_COMBOS,
-    combo_info=BUS_DISPLAY_INFO
+    combo_info=BUS_DISPLAY_INFO,
+    trip_stops=None,
+    blocks=None
 ):
     """
-    Process STM trip updates and merge with vehicle positions for occupancy data
+    Process STM trip updates and merge with vehicle positions for occupancy data.
+    With trip_stops (loaders/trip_stops.py), a watched stop that has no
+    stop_time_update of its own gets the delay reported upstream in the trip.
+    With blocks as well (loaders/blocks.py), trips whose vehicle is still on
+    an earlier trip of its block are predicted from that trip's delay
+    (in "fast" mode the feed keeps the routes interlined with ours for this).
     """
     closest_buses = { combo[2]: None for combo in desired_combos }
+    live_updates = {}
 
     # Process real-time updates
     for entity in trip_entities:
@@ -632,12 +766,14 @@ def process_stm_trip_updates(
         t_update = entity.trip_update
         route_id = t_update.trip.route_id
         trip_id  = t_update.trip.trip_id
+        live_updates[trip_id] = t_update
 
         if route_id not in BUS_ROUTES:
             continue
 
         w_str = stm_trips.get(trip_id, {}).get("wheelchair_accessible", "0")
         wheelchair_accessible = (w_str == "1")
+        predicted_stops = set()
 
         for stop_time in t_update.stop_time_update:
             stop_id = stop_time.stop_id
@@ -657,135 +793,135 @@ def process_stm_trip_updates(
 
             # Handle skipped/cancelled buses
             if is_skipped:
-                bus_obj = {
-                    "route_id": route_id,
-                    "trip_id": trip_id,
-                    "stop_id": stop_id,
-                    "arrival_time": "Annulé",
-                    "occupancy": "Unknown",
-                    "direction": combo_info[final_key]["direction"],
-                    "location": combo_info[final_key]["location"],
-                    "delayed_text": None,
-                    "early_text": None,
-                    "at_stop": False,
-                    "wheelchair_accessible": wheelchair_accessible,
-                    "cancelled": True,
-                    "service_status": "cancelled" 
-                }
-                
+                bus_obj = models.Bus(
+                    route_id=route_id,
+                    trip_id=trip_id,
+                    stop_id=stop_id,
+                    arrival_time="Annulé",
+                    occupancy="Unknown",
+                    direction=combo_info[final_key]["direction"],
+                    location=combo_info[final_key]["location"],
+                    wheelchair_accessible=wheelchair_accessible,
+                    cancelled=True,
+                    service_status="cancelled",
+                    feed_timestamp=feed_timestamp("trip_updates")
+                )
+
                 existing = closest_buses[final_key]
-                if existing is None or not existing.get("cancelled", False):
+                if existing is None or not existing.cancelled:
                     closest_buses[final_key] = bus_obj
+                predicted_stops.add(stop_id)
                 continue  
 
             arrival_unix = stop_time.arrival.time if stop_time.HasField("arrival") else None
             if not arrival_unix:
                 continue
-
-            # Calculate minutes until arrival
-            now_ts = time.time()
-            minutes_to_arrival = int((arrival_unix - now_ts) // 60)
-
-            # Check for delays
-            scheduled_arrival_str = stm_stop_times.get((trip_id, stop_id))
-            delay_text = None
-            if scheduled_arrival_str:
-                try:
-                    h, m, s = map(int, scheduled_arrival_str.split(":"))
-                    sched_dt = datetime.now().replace(hour=h % 24, minute=m, second=s, microsecond=0)
-                    if sched_dt < datetime.now():
-                        sched_dt += timedelta(days=1)
-
-                    predicted_dt = datetime.fromtimestamp(arrival_unix)
-                    if predicted_dt > sched_dt:
-                        delay_text = f"En retard (planifié à {sched_dt.strftime('%I:%M %p')})"
-                except Exception:
-                    pass
-
-            # Get occupancy from positions dict
-            pos_info = positions_dict.get((route_id, trip_id), {})
-            raw_occ = pos_info.get("occupancy")
-            occ_str = stm_map_occupancy_status(raw_occ) if raw_occ is not None else "Unknown"
-
-            # Determine if bus is at stop
-            at_stop_flag = minutes_to_arrival < 2
-
-            # Get additional position info
-            bus_lat = pos_info.get("lat")
-            bus_lon = pos_info.get("lon")
-            current_status = pos_info.get("current_status")
-
-            bus_obj = {
-                "route_id": route_id,
-                "trip_id": trip_id,
-                "stop_id": stop_id,
-                "arrival_time": minutes_to_arrival,
-                "occupancy": occ_str,  # Use mapped occupancy string
-                "direction": combo_info[final_key]["direction"],
-                "location": combo_info[final_key]["location"],
-                "delayed_text": delay_text,
-                "early_text": None,
-                "at_stop": at_stop_flag,
-                "wheelchair_accessible": wheelchair_accessible,
-                "cancelled": False,
-                "service_status": "normal",
-                "lat": bus_lat,
-                "lon": bus_lon,
-                "current_status": current_status
-            }
-
-            # Update if this is the closest bus
-            existing = closest_buses[final_key]
-            if existing is None or (
-                (not existing.get("cancelled", False) and not bus_obj["cancelled"]) and
-                isinstance(existing["arrival_time"], (int, float)) and
-                isinstance(minutes_to_arrival, (int, float)) and
-                minutes_to_arrival < existing["arrival_time"]
-            ) or (
-                existing.get("cancelled", False) and not bus_obj["cancelled"]
-            ):
-                closest_buses[final_key] = bus_obj
+            predicted_stops.add(stop_id)
+            arrival_unix = prediction_tracker.smoothed_arrival(trip_id, stop_id, arrival_unix)
+
+            bus_obj = _realtime_bus(
+                route_id, trip_id, stop_id, arrival_unix, combo_info[final_key],
+                wheelchair_accessible, stm_stop_times, positions_dict
+            )
+            _keep_closest(closest_buses, final_key, bus_obj)
+
+        # Watched stops of this route the update does not predict: propagate
+        # the last delay reported before them in the trip
+        if trip_stops is None or trip_id not in trip_stops:
+            continue
+        now_ts = replay.current_time()
+        for (gtfs_route, wanted_stop, final_key) in desired_combos:
+            if gtfs_route != route_id or wanted_stop in predicted_stops:
+                continue
+            arrival_unix = trip_stops.propagated_arrival(t_update, wanted_stop, now_ts)
+            if arrival_unix is None:
+                continue
+            arrival_unix = prediction_tracker.smoothed_arrival(trip_id, wanted_stop, arrival_unix, route_id)
+            if arrival_unix <= now_ts:
+                continue
+            bus_obj = _realtime_bus(
+                route_id, trip_id, wanted_stop, arrival_unix, combo_info[final_key],
+                wheelchair_accessible, stm_stop_times, positions_dict, propagated=True
+            )
+            _keep_closest(closest_buses, final_key, bus_obj)
+
+    # Trips not started yet: chain the live delay of the vehicle's current trip
+    if blocks is not None and trip_stops is not None:
+        now_ts = replay.current_time()
+        combo_routes = {combo[0] for combo in desired_combos}
+        for live_trip_id in list(live_updates):
+            for trip_id in blocks.following_trips(live_trip_id):
+                if trip_id in live_updates:
+                    break
+                trip_info = stm_trips.get(trip_id, {})
+                if trip_info.get("route_id") not in combo_routes:
+                    continue
+                for (gtfs_route, wanted_stop, final_key) in desired_combos:
+                    if gtfs_route != trip_info["route_id"]:
+                        continue
+                    arrival_unix = blocks.chained_arrival(trip_id, wanted_stop, live_updates, trip_stops, now_ts)
+                    if arrival_unix is None:
+                        continue
+                    arrival_unix = prediction_tracker.smoothed_arrival(trip_id, wanted_stop, arrival_unix, gtfs_route)
+                    if arrival_unix <= now_ts:
+                        continue
+                    bus_obj = _realtime_bus(
+                        gtfs_route, trip_id, wanted_stop, arrival_unix, combo_info[final_key],
+                        trip_info.get("wheelchair_accessible") == "1", stm_stop_times, positions_dict,
+                        chained=True
+                    )
+                    _keep_closest(closest_buses, final_key, bus_obj)
+
+    # Hold-over: trips that briefly dropped out of the feed keep their last prediction
+    now_ts = replay.current_time()
+    for (gtfs_route, wanted_stop, final_key) in desired_combos:
+        for trip_id, arrival_unix in prediction_tracker.held(gtfs_route, wanted_stop):
+            if arrival_unix <= now_ts:
+                continue
+            w_str = stm_trips.get(trip_id, {}).get("wheelchair_accessible", "0")
+            bus_obj = _realtime_bus(
+                gtfs_route, trip_id, wanted_stop, arrival_unix, combo_info[final_key],
+                w_str == "1", stm_stop_times, positions_dict, held_over=True
+            )
+            _keep_closest(closest_buses, final_key, bus_obj)
 
     # Add fallback buses for routes with no real-time data
-    now = datetime.now()
+    now = _now()
     for (gtfs_route, wanted_stop, final_key) in desired_combos:
         if closest_buses[final_key] is None:
-            nextScheduled = None
-            route_trip_ids = {
-                tid for tid, data in stm_trips.items() if data["route_id"] == gtfs_route
-            }
-            for (trip_id, stop_id), schedTimeStr in stm_stop_times.items():
-                if trip_id not in route_trip_ids or stop_id != wanted_stop:
-                    continue
-                try:
-                    parts = schedTimeStr.split(":")
-                    hours = int(parts[0]) % 24
-                    mins  = int(parts[1])
-                    secs  = int(parts[2]) if len(parts) > 2 else 0
-                    schedDt = datetime(now.year, now.month, now.day, hours, mins, secs)
-                    if schedDt <= now:
-                        schedDt += timedelta(days=1)
-                    if nextScheduled is None or schedDt < nextScheduled:
-                        nextScheduled = schedDt
-                except:
-                    continue
+            with metrics.span("stop_times_fallback_scan"):
+                nextScheduled = None
+                route_trip_ids = {
+                    tid for tid, data in stm_trips.items() if data["route_id"] == gtfs_route
+                }
+                for (trip_id, stop_id), schedTimeStr in stm_stop_times.items():
+                    if trip_id not in route_trip_ids or stop_id != wanted_stop:
+                        continue
+                    try:
+                        parts = schedTimeStr.split(":")
+                        hours = int(parts[0]) % 24
+                        mins  = int(parts[1])
+                        secs  = int(parts[2]) if len(parts) > 2 else 0
+                        schedDt = datetime(now.year, now.month, now.day, hours, mins, secs)
+                        if schedDt <= now:
+                            schedDt += timedelta(days=1)
+                        if nextScheduled is None or schedDt < nextScheduled:
+                            nextScheduled = schedDt
+                    except:
+                        continue
 
             arrival_str = nextScheduled.strftime("%I:%M %p") if nextScheduled else "Indisponible"
-            fallback = {
-                "route_id": gtfs_route,
-                "trip_id": "N/A",
-                "stop_id": wanted_stop,
-                "arrival_time": arrival_str,
-                "occupancy": "Unknown",
-                "direction": combo_info[final_key]["direction"],
-                "location": combo_info[final_key]["location"],
-                "delayed_text": None,
-                "early_text": None,
-                "at_stop": False,
-                "wheelchair_accessible": False,
-                "cancelled": False,
-                "service_status": "scheduled"
-            }
+            fallback = models.Bus(
+                route_id=gtfs_route,
+                trip_id="N/A",
+                stop_id=wanted_stop,
+                arrival_time=arrival_str,
+                occupancy="Unknown",
+                direction=combo_info[final_key]["direction"],
+                location=combo_info[final_key]["location"],
+                service_status="scheduled",
+                scheduled_arrival=int(nextScheduled.timestamp()) if nextScheduled else None
+            )
             closest_buses[final_key] = fallback
 
     # Return buses in predefined order
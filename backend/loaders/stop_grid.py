@@ -0,0 +1,91 @@
+"""
+Stops near a point, from a uniform grid over stops.txt.
+
+    grid = get_dataset().stop_grid
+    grid.nearby(45.4946, -73.5622, radius=400)     # [(metres, stop_id), ...] closest first
+
+Stops are projected once to metres (equirectangular, east-west scaled at
+the stops' mean latitude) and bucketed in CELL_SIZE square cells. A query
+only measures the stops of the cells its radius overlaps, so its cost
+depends on the local stop density, not on the ~9000 stops of the network.
+Distances rescale east-west offsets to the query's own latitude, which
+keeps them within a few centimetres of great-circle ones over a few km.
+"""
+import sys
+import math
+from array import array
+
+EARTH_RADIUS = 6371008.8     # metres (mean)
+CELL_SIZE = 250.0            # metres
+
+
+class StopGrid:
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.stop_ids = []            # stop index -> stop_id
+        self._xs = array("d")         # metres east of the origin
+        self._ys = array("d")         # metres north of the origin
+        self._cells = {}              # (cx, cy) -> array of stop indexes
+        self._lat0 = 0.0
+        self._k_lon = self._k_lat = math.radians(1) * EARTH_RADIUS
+
+    @classmethod
+    def from_stops(cls, stops, cell_size=CELL_SIZE):
+        """stops: {stop_id: (name, lat, lon)} (the dataset's stops); stops without coordinates are left out."""
+        self = cls(cell_size)
+        located = [(stop_id, lat, lon) for stop_id, (_, lat, lon) in stops.items()
+                   if lat is not None and lon is not None]
+        if located:
+            self._lat0 = sum(lat for _, lat, _ in located) / len(located)
+            self._k_lon = self._k_lat * math.cos(math.radians(self._lat0))
+        for stop_id, lat, lon in located:
+            x, y = self._project(lat, lon)
+            idx = len(self.stop_ids)
+            self.stop_ids.append(stop_id)
+            self._xs.append(x)
+            self._ys.append(y)
+            cell = (int(x // cell_size), int(y // cell_size))
+            bucket = self._cells.get(cell)
+            if bucket is None:
+                bucket = self._cells[cell] = array("I")
+            bucket.append(idx)
+        return self
+
+    def _project(self, lat, lon):
+        return lon * self._k_lon, (lat - self._lat0) * self._k_lat
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + sys.getsizeof(self._xs) + sys.getsizeof(self._ys)
+                + sys.getsizeof(self.stop_ids) + sys.getsizeof(self._cells)
+                + sum(sys.getsizeof(bucket) for bucket in self._cells.values()))
+
+    def nearby(self, lat, lon, radius, limit=None):
+        """[(distance in metres, stop_id)] of the stops within radius, closest first."""
+        x, y = self._project(lat, lon)
+        size = self.cell_size
+        # metres per projected east-west metre at this latitude
+        fx = math.cos(math.radians(lat)) * self._k_lat / self._k_lon
+        x_radius = radius / fx
+        x0, x1 = int((x - x_radius) // size), int((x + x_radius) // size)
+        y0, y1 = int((y - radius) // size), int((y + radius) // size)
+        xs, ys, cells = self._xs, self._ys, self._cells
+        limit2 = radius * radius
+        found = []
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                bucket = cells.get((cx, cy))
+                if bucket is None:
+                    continue
+                for idx in bucket:
+                    dx, dy = (xs[idx] - x) * fx, ys[idx] - y
+                    d2 = dx * dx + dy * dy
+                    if d2 <= limit2:
+                        found.append((d2, idx))
+        found.sort()
+        if limit is not None:
+            found = found[:limit]
+        stop_ids = self.stop_ids
+        return [(math.sqrt(d2), stop_ids[idx]) for d2, idx in found]
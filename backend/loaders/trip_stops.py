@@ -0,0 +1,325 @@
+"""
+Ordered stop sequence of every trip, packed into flat arrays.
+
+    trip_stops = get_dataset().trip_stops
+    trip_stops.stops(trip_id)                             # ["51234", "51235", ...]
+    trip_stops.propagated_arrival(trip_update, "51234")   # unix time, or None
+
+Every stop_times row is one slot of three parallel arrays, sorted by trip
+then stop_sequence: the stop (index into stop_ids), its stop_sequence and
+its scheduled arrival in seconds after the service day's midnight (-1 when
+the row has no time). A trip is a [start, end) slice of the arrays, so
+finding a stop of a trip is a scan or a bisect over a few dozen machine
+integers instead of dict lookups keyed by (trip_id, stop_id) strings.
+
+propagated_arrival() follows the GTFS-Realtime rule for a stop that has no
+StopTimeUpdate of its own: it takes the delay of the closest update before
+it in the trip. SKIPPED updates are passed over, and a NO_DATA update stops
+propagation (no prediction for the stops after it until the next update).
+"""
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime
+
+from . import gtfs_source
+
+SKIPPED = 1
+NO_DATA = 2
+
+# StopDepartures sort keys: 18 bits of arrival seconds (up to 72:00:00), 22 of trip index
+_TRIP_BITS = 22
+_STOP_SHIFT = _TRIP_BITS + 18
+_TIME_MASK = (1 << 18) - 1
+_TRIP_MASK = (1 << _TRIP_BITS) - 1
+SORT_CHUNK = 1 << 20     # stop_times slots sorted at once when building StopDepartures
+
+
+def _seconds(value):
+    """GTFS "H:MM:SS" / "HH:MM:SS" (may exceed 24:00:00) as seconds, -1 if blank."""
+    value = value.strip() if value else ""
+    if not value:
+        return -1
+    try:
+        return int(value[:-6]) * 3600 + int(value[-5:-3]) * 60 + int(value[-2:])
+    except ValueError:
+        return -1
+
+
+class TripStops:
+    def __init__(self):
+        self.stop_ids = []            # stop index -> stop_id
+        self._stop_index = {}         # stop_id -> stop index
+        self._stops = array("I")
+        self._sequences = array("I")
+        self._arrivals = array("i")
+        self._offsets = {}            # trip_id -> (start, end)
+
+    @classmethod
+    def from_source(cls, source, table="stop_times.txt"):
+        """source: a GtfsSource, a GTFS directory or zip, or the path of stop_times.txt."""
+        source, table = gtfs_source.table_source(source, table)
+        self = cls()
+        stops, sequences, arrivals = self._stops, self._sequences, self._arrivals
+        stop_index, offsets = self._stop_index, self._offsets
+        extra = {}                    # trip_id -> more [start, end) runs (trip not contiguous in the file)
+        columns = ("trip_id", "stop_sequence", "stop_id", "arrival_time", "departure_time")
+
+        run_trip, run_start, last_seq, in_order = None, 0, -1, True
+
+        def close_run():
+            end = len(stops)
+            if not in_order:
+                self._sort_slice(run_start, end)
+            if run_trip in offsets:
+                extra.setdefault(run_trip, []).append((run_start, end))
+            elif run_trip is not None:
+                offsets[run_trip] = (run_start, end)
+
+        # Rows are appended straight to the arrays: stop_times is normally
+        # grouped by trip and ordered by stop_sequence, anything else is fixed up after
+        for trip_id, seq, stop_id, arrival, departure in source.rows(table, columns):
+            try:
+                seq = int(seq)
+            except (TypeError, ValueError):
+                continue
+            if trip_id != run_trip:
+                close_run()
+                run_trip, run_start, last_seq, in_order = trip_id, len(stops), -1, True
+            elif seq < last_seq:
+                in_order = False
+            last_seq = seq
+            idx = stop_index.get(stop_id)
+            if idx is None:
+                idx = stop_index[stop_id] = len(self.stop_ids)
+                self.stop_ids.append(stop_id)
+            stops.append(idx)
+            sequences.append(seq)
+            arrivals.append(_seconds(arrival or departure))
+        close_run()
+
+        # Rare: a trip split over several runs is copied whole to the end
+        for trip_id, runs in extra.items():
+            start = len(stops)
+            for a, b in [offsets[trip_id]] + runs:
+                stops.extend(stops[a:b])
+                sequences.extend(sequences[a:b])
+                arrivals.extend(arrivals[a:b])
+            self._sort_slice(start, len(stops))
+            offsets[trip_id] = (start, len(stops))
+        return self
+
+    def _sort_slice(self, start, end):
+        rows = sorted(zip(self._sequences[start:end], self._stops[start:end], self._arrivals[start:end]))
+        for i, (seq, idx, arrival) in enumerate(rows, start):
+            self._sequences[i] = seq
+            self._stops[i] = idx
+            self._arrivals[i] = arrival
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __contains__(self, trip_id):
+        return trip_id in self._offsets
+
+    def __sizeof__(self):
+        # arrays + offsets (with one (start, end) tuple per trip) + stop id list
+        return (object.__sizeof__(self)
+                + sum(sys.getsizeof(a) for a in (self._stops, self._sequences, self._arrivals))
+                + sys.getsizeof(self._offsets) + len(self._offsets) * sys.getsizeof((0, 0))
+                + sys.getsizeof(self.stop_ids) + sys.getsizeof(self._stop_index))
+
+    # ─── Lookups ───────────────────────────────────────────────
+    def stops(self, trip_id):
+        """stop_ids of a trip in stop_sequence order."""
+        span = self._offsets.get(trip_id)
+        if span is None:
+            return []
+        stop_ids = self.stop_ids
+        return [stop_ids[i] for i in self._stops[span[0]:span[1]]]
+
+    def schedule(self, trip_id):
+        """[(stop_id, stop_sequence, arrival seconds)] of a trip."""
+        span = self._offsets.get(trip_id)
+        if span is None:
+            return []
+        start, end = span
+        stop_ids = self.stop_ids
+        return [(stop_ids[i], seq, arr) for i, seq, arr in
+                zip(self._stops[start:end], self._sequences[start:end], self._arrivals[start:end])]
+
+    def _position(self, start, end, stop_id):
+        """First slot of stop_id in [start, end), or -1."""
+        idx = self._stop_index.get(stop_id)
+        if idx is None:
+            return -1
+        try:
+            return self._stops.index(idx, start, end)
+        except ValueError:
+            return -1
+
+    def _update_position(self, start, end, stop_time):
+        """Slot a StopTimeUpdate refers to: by stop_sequence when given, else by stop_id."""
+        if stop_time.HasField("stop_sequence"):
+            pos = bisect_left(self._sequences, stop_time.stop_sequence, start, end)
+            if pos < end and self._sequences[pos] == stop_time.stop_sequence:
+                return pos
+            return -1
+        if stop_time.stop_id:
+            return self._position(start, end, stop_time.stop_id)
+        return -1
+
+    def first_arrival(self, trip_id):
+        """Scheduled seconds at the trip's first stop, -1 if unknown."""
+        span = self._offsets.get(trip_id)
+        return self._arrivals[span[0]] if span and span[1] > span[0] else -1
+
+    def last_arrival(self, trip_id):
+        """Scheduled seconds at the trip's last stop, -1 if unknown."""
+        span = self._offsets.get(trip_id)
+        return self._arrivals[span[1] - 1] if span and span[1] > span[0] else -1
+
+    def arrival(self, trip_id, stop_id):
+        """Scheduled seconds of the trip at stop_id, -1 if it does not stop there."""
+        span = self._offsets.get(trip_id)
+        if span is None:
+            return -1
+        pos = self._position(span[0], span[1], stop_id)
+        return self._arrivals[pos] if pos >= 0 else -1
+
+    # ─── Delay propagation ─────────────────────────────────────
+    def propagated_arrival(self, trip_update, stop_id, now=None):
+        """
+        Predicted arrival (unix time) at stop_id from the closest StopTimeUpdate
+        before it in the trip, or None (unknown trip or stop, no usable update
+        upstream, NO_DATA, or no scheduled time at either end).
+        """
+        span = self._offsets.get(trip_update.trip.trip_id)
+        if span is None:
+            return None
+        target = self._position(span[0], span[1], stop_id)
+        return self._predicted(trip_update, span, target, now, upstream_only=True)
+
+    def end_arrival(self, trip_update, now=None):
+        """Predicted arrival (unix time) of a live trip at its last stop, or None."""
+        span = self._offsets.get(trip_update.trip.trip_id)
+        if span is None or span[1] == span[0]:
+            return None
+        return self._predicted(trip_update, span, span[1] - 1, now, upstream_only=False)
+
+    def _predicted(self, trip_update, span, target, now, upstream_only):
+        start, end = span
+        if target < 0 or self._arrivals[target] < 0:
+            return None
+
+        anchor = anchor_pos = None
+        for stop_time in trip_update.stop_time_update:
+            pos = self._update_position(start, end, stop_time)
+            if pos < 0:
+                continue
+            if pos > target or (pos == target and upstream_only):
+                break      # updates are in stop_sequence order
+            if stop_time.schedule_relationship == SKIPPED:
+                continue
+            anchor, anchor_pos = stop_time, pos
+        if anchor is None or anchor.schedule_relationship == NO_DATA:
+            return None
+
+        event = anchor.arrival if anchor.HasField("arrival") else (
+            anchor.departure if anchor.HasField("departure") else None)
+        if event is None:
+            return None
+        scheduled_anchor = self._arrivals[anchor_pos]
+        if event.time and scheduled_anchor >= 0:
+            # same delay downstream: the service day cancels out
+            return event.time + (self._arrivals[target] - scheduled_anchor)
+        if event.HasField("delay"):
+            return service_day(trip_update.trip.start_date, now) + self._arrivals[target] + event.delay
+        return None
+
+
+class StopDepartures:
+    """
+    The static timetable inverted: every scheduled call of every stop, sorted
+    by time, as a [start, end) slice per stop of two parallel arrays (arrival
+    seconds, trip index). Built from a TripStops by a counting sort, so the
+    stop_times file is not read again.
+
+        departures = get_dataset().stop_departures
+        for arrival_s, trip_id in departures.between("51234", 8 * 3600, 9 * 3600):
+            ...
+    """
+
+    def __init__(self):
+        self.trip_ids = []            # trip index -> trip_id
+        self._stop_index = {}         # stop_id -> stop index (shared with the TripStops)
+        self._starts = array("I")     # stop index -> first slot; one more entry for the end
+        self._arrivals = array("i")
+        self._trips = array("I")
+
+    @classmethod
+    def from_trip_stops(cls, trip_stops, chunk=SORT_CHUNK):
+        self = cls()
+        self._stop_index = trip_stops._stop_index
+        self.trip_ids = list(trip_stops._offsets)
+        stops, arrivals = trip_stops._stops, trip_stops._arrivals
+
+        # Slot -> trip index (slots a split trip was copied from keep -1)
+        trip_of = array("i", [-1]) * len(stops)
+        for k, (start, end) in enumerate(trip_stops._offsets.values()):
+            trip_of[start:end] = array("i", [k]) * (end - start)
+
+        # One int per call, (stop, arrival, trip) packed high to low bits, so a
+        # single C-level sort orders calls by stop then time. Stops are taken
+        # in ranges of about `chunk` slots to bound the temporary key list.
+        counts = Counter(stops)
+        n_stops = len(trip_stops.stop_ids)
+        lo = 0
+        while lo < n_stops:
+            hi, size = lo, 0
+            while hi < n_stops and (size == 0 or size + counts[hi] <= chunk):
+                size += counts[hi]
+                hi += 1
+            keys = [(stop << _STOP_SHIFT) | (arrival << _TRIP_BITS) | k
+                    for stop, arrival, k in zip(stops, arrivals, trip_of)
+                    if lo <= stop < hi and arrival >= 0 and k >= 0]
+            keys.sort()
+            base = len(self._arrivals)
+            self._starts.extend(base + bisect_left(keys, idx << _STOP_SHIFT) for idx in range(lo, hi))
+            self._arrivals.extend((key >> _TRIP_BITS) & _TIME_MASK for key in keys)
+            self._trips.extend(key & _TRIP_MASK for key in keys)
+            lo = hi
+        self._starts.append(len(self._arrivals))
+        return self
+
+    def __len__(self):
+        return len(self._arrivals)
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self)
+                + sum(sys.getsizeof(a) for a in (self._starts, self._arrivals, self._trips))
+                + sys.getsizeof(self.trip_ids))
+
+    def between(self, stop_id, lo, hi):
+        """(arrival seconds, trip_id) of the calls at stop_id with lo <= arrival < hi, by time."""
+        idx = self._stop_index.get(stop_id)
+        if idx is None or idx + 1 >= len(self._starts):
+            return
+        times, trips, trip_ids = self._arrivals, self._trips, self.trip_ids
+        end = self._starts[idx + 1]
+        pos = bisect_left(times, lo, self._starts[idx], end)
+        while pos < end and times[pos] < hi:
+            yield times[pos], trip_ids[trips[pos]]
+            pos += 1
+
+
+def service_day(start_date, now=None):
+    """Unix time of the service day's midnight (local), today's when start_date is blank."""
+    try:
+        if start_date:
+            return datetime.strptime(start_date, "%Y%m%d").timestamp()
+    except ValueError:
+        pass
+    today = datetime.fromtimestamp(now) if now is not None else datetime.now()
+    return today.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
@@ -1,10 +1,13 @@
 # app.py
-import os, sys, logging
+import os, sys, hmac, json, time, logging
 from flask_cors import CORS
-from flask import Flask, jsonify
+from flask import Flask, jsonify, Response, request
 
 # ────── PACKAGE IMPORTS ───────────────────────────────────────
-from .config            import BUS_ROUTES
+from .config            import (
+    BUS_ROUTES, ADMIN_TOKEN, API_SECTION_CACHE_TTL, REPLAY_SPEED,
+    SNAPSHOT_ROLE, SNAPSHOT_DIR, SNAPSHOT_INTERVAL, GTFS_STM_DIR, GTFS_PRELOAD,
+)
 from .utils             import is_service_unavailable
 
 from .loaders.stm       import (
@@ -12,13 +15,24 @@ from .loaders.stm       import (
     fetch_stm_realtime_data,
     fetch_stm_positions_dict,
     process_stm_trip_updates,
+    feed_timestamp,
 )
 
 from .alerts import process_stm_alerts
+from . import metrics
+from . import profiler
+from . import analytics
+from . import departures
+from . import models
+from .models import BannerAlert, MetroLine
+from .cache import CoalescingCache
+from .loaders import replay
 
 # New Imports
 from .loaders.gtfs_loader import download_gtfs_data, load_gtfs_data
-from .managers.weather_manager import get_weather
+from .loaders import gtfs_diff
+from .managers.weather_manager import get_weather, DEFAULT_WEATHER
+from .managers.snapshot_manager import SnapshotReader, SnapshotWriter
 
 # ────────────────────────────────────────────────────────────────
 
@@ -31,90 +45,51 @@ app = Flask(__name__)
 CORS(app)
 PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
 GTFS_BASE = os.path.join(PACKAGE_DIR, "GTFS")  # points to backend/GTFS
-STM_DIR = os.path.join(GTFS_BASE, "stm")
+STM_DIR = GTFS_STM_DIR
 
 os.makedirs(STM_DIR, exist_ok=True)
 
-# ─── Download GTFS files from Supabase on startup (production only) ────────
-download_gtfs_data(STM_DIR)
+if SNAPSHOT_ROLE == "worker":
+    # Workers serve the fetcher's snapshot and never build sections themselves
+    gtfs = None
+    _snapshot = SnapshotReader(SNAPSHOT_DIR)
+else:
+    # ─── Download GTFS files from Supabase on startup (production only) ────────
+    download_gtfs_data(STM_DIR)
 
-# ─── check for required GTFS files ────────────────────────────
-routes_map, stm_trips, stm_stop_times = load_gtfs_data(STM_DIR)
+    # ─── check for required GTFS files; tables load on first use ──
+    gtfs = load_gtfs_data(STM_DIR, preload=GTFS_PRELOAD)
+    # Only once loaded: the feed-parse path must not load stop_times itself
+    analytics.set_schedule(lambda: gtfs.stop_times if gtfs.is_loaded("stop_times") else None)
+    _snapshot = None
 
 # ====================================================================
 # Metro Alerts Processing Functions
 # ====================================================================
+METRO_LINE_IDS = ["1", "2", "4", "5"]   # same order as get_default_metro_status()
+
 def process_metro_alerts():
     try:
         # Fetch all STM alerts
         alerts_data = fetch_stm_alerts()
         
         # Default status for all lines
-        metro_status = {
-            "1": {
-                "name": "Ligne 1",
-                "color": "Verte",
-                "status": "Service normal",
-                "statusColor": "text-green-400",
-                "icon": "green-line",
-                "is_normal": True,
-                "alert_description": None
-            },
-            "2": {
-                "name": "Ligne 2",
-                "color": "Orange",
-                "status": "Service normal",
-                "statusColor": "text-green-400",
-                "icon": "orange-line",
-                "is_normal": True,
-                "alert_description": None
-            },
-            "4": {
-                "name": "Ligne 4",
-                "color": "Jaune",
-                "status": "Service normal",
-                "statusColor": "text-green-400",
-                "icon": "yellow-line",
-                "is_normal": True,
-                "alert_description": None
-            },
-            "5": {
-                "name": "Ligne 5",
-                "color": "Bleue",
-                "status": "Service normal",
-                "statusColor": "text-green-400",
-                "icon": "blue-line",
-                "is_normal": True,
-                "alert_description": None
-            }
-        }
-        
+        metro_status = dict(zip(METRO_LINE_IDS, get_default_metro_status()))
+
         # Process alerts to check for metro disruptions
         if alerts_data:
             import re
             for alert in alerts_data:
                 try:
-                    informed_entities = alert.get("informed_entities", [])
-                    
-                    # Get French header and description for this alert
-                    header_texts = alert.get("header_texts", [])
-                    description_texts = alert.get("description_texts", [])
-                    
+                    informed_entities = alert.informed_entities
+
                     # Debug: Log what we're getting from the API
-                    logger.debug(f"Alert header_texts: {header_texts}")
-                    logger.debug(f"Alert description_texts: {description_texts}")
-                    
-                    header = ""
-                    description = ""
-                    for ht in header_texts:
-                        if ht.get("language") == "fr":
-                            header = ht.get("text", "")
-                            break
-                    
-                    for dt in description_texts:
-                        if dt.get("language") == "fr":
-                            description = dt.get("text", "")
-                            break
+                    logger.debug(f"Alert header_texts: {alert.header_texts}")
+                    logger.debug(f"Alert description_texts: {alert.description_texts}")
+
+                    # Get French header and description for this alert
+                    header = alert.header("fr")
+                    description = alert.description("fr")
                     
                     # Remove HTML tags from description
                     if description:
@@ -130,16 +105,16 @@ def process_metro_alerts():
                     
                     for entity in informed_entities:
                         # Check for agency-wide alert (like strikes)
-                        if entity.get("agency_id") == "STM":
+                        if entity.agency_id == "STM":
                             is_network_wide = True
                             logger.info(f"[ALERT] Detected network-wide STM alert: {header[:50]}...")
                         
                         # Check for specific metro line alerts using route_short_name
-                        route_short_name = entity.get("route_short_name", "")
-                        route_id = entity.get("route_id", "")
-                        
+                        route_short_name = entity.route_short_name
+                        route_id = entity.route_id
+
                         # Metro routes can be in either field
-                        metro_line = route_short_name if route_short_name in ["1", "2", "4", "5"] else (route_id if route_id in ["1", "2", "4", "5"] else None)
+                        metro_line = route_short_name if route_short_name in METRO_LINE_IDS else (route_id if route_id in METRO_LINE_IDS else None)
                         
                         if metro_line:
                             affected_metro_lines.append(metro_line)
@@ -168,19 +143,13 @@ def process_metro_alerts():
                         logger.warning(f"[WARNING] APPLYING NETWORK-WIDE ALERT TO ALL METRO LINES")
                         logger.info(f"   Alert text: '{alert_text}'")
                         for line_id in metro_status.keys():
-                            metro_status[line_id]["is_normal"] = False
-                            metro_status[line_id]["status"] = "Service perturbé"
-                            metro_status[line_id]["alert_description"] = alert_text
-                            metro_status[line_id]["statusColor"] = "text-red-400"
+                            _mark_disrupted(metro_status[line_id], alert_text)
                     elif affected_metro_lines:
                         # Apply alert to specific metro lines
                         logger.warning(f"[WARNING] APPLYING ALERT TO LINES: {', '.join(affected_metro_lines)}")
                         logger.info(f"   Alert text: '{alert_text}'")
                         for line_id in affected_metro_lines:
-                            metro_status[line_id]["is_normal"] = False
-                            metro_status[line_id]["status"] = "Service perturbé"
-                            metro_status[line_id]["alert_description"] = alert_text
-                            metro_status[line_id]["statusColor"] = "text-red-400"
+                            _mark_disrupted(metro_status[line_id], alert_text)
                         
                 except Exception as e:
                     logger.error(f"Error processing individual metro alert: {e}")
@@ -192,8 +161,8 @@ def process_metro_alerts():
         result = list(metro_status.values())
         logger.info(f"[STATUS] Final Metro Status:")
         for line in result:
-            status_text = "NORMAL" if line["is_normal"] else "DISRUPTED"
-            logger.info(f"  [{status_text}] {line['name']} ({line['color']}): {line['status']}")
+            status_text = "NORMAL" if line.is_normal else "DISRUPTED"
+            logger.info(f"  [{status_text}] {line.name} ({line.color}): {line.status}")
         
         return result
         
@@ -203,45 +172,19 @@ def process_metro_alerts():
         traceback.print_exc()
         return get_default_metro_status()
 
+def _mark_disrupted(line, alert_text):
+    line.is_normal = False
+    line.status = "Service perturbé"
+    line.alert_description = alert_text
+    line.statusColor = "text-red-400"
+
 def get_default_metro_status():
     """Return default metro status when API fails"""
     return [
-        {
-            "name": "Ligne 1",
-            "color": "Verte",
-            "status": "Service normal",
-            "statusColor": "text-green-400",
-            "icon": "green-line",
-            "is_normal": True,
-            "alert_description": None
-        },
-        {
-            "name": "Ligne 2",
-            "color": "Orange",
-            "status": "Service normal",
-            "statusColor": "text-green-400",
-            "icon": "orange-line",
-            "is_normal": True,
-            "alert_description": None
-        },
-        {
-            "name": "Ligne 4",
-            "color": "Jaune",
-            "status": "Service normal",
-            "statusColor": "text-green-400",
-            "icon": "yellow-line",
-            "is_normal": True,
-            "alert_description": None
-        },
-        {
-            "name": "Ligne 5",
-            "color": "Bleue",
-            "status": "Service normal",
-            "statusColor": "text-green-400",
-            "icon": "blue-line",
-            "is_normal": True,
-            "alert_description": None
-        }
+        MetroLine(name="Ligne 1", color="Verte", icon="green-line"),
+        MetroLine(name="Ligne 2", color="Orange", icon="orange-line"),
+        MetroLine(name="Ligne 4", color="Jaune", icon="yellow-line"),
+        MetroLine(name="Ligne 5", color="Bleue", icon="blue-line"),
     ]
 
 def merge_alerts_into_buses(buses, processed_alerts):
@@ -249,18 +192,95 @@ def merge_alerts_into_buses(buses, processed_alerts):
     Merge alert information into bus objects.
     """
     for bus in buses:
-        route_id = bus.get("route_id")
-        
         # Find matching alert
         for alert in processed_alerts:
-            if route_id in alert.get("routes", []):
-                if alert.get("effect") == "NO_SERVICE":
-                    bus["cancelled"] = True
-                    bus["delayed_text"] = None
+            if bus.route_id in alert.routes:
+                if alert.effect == "NO_SERVICE":
+                    bus.cancelled = True
+                    bus.delayed_text = None
                 break
     
     return buses
 
+# ====================== Metrics ======================
+@app.before_request
+def start_request_metrics():
+    metrics.begin_request()
+
+@app.after_request
+def add_server_timing(response):
+    spans = metrics.end_request()
+    if spans:
+        response.headers["Server-Timing"] = metrics.server_timing_header(spans)
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if not metrics.enabled():
+        return jsonify({"error": "metrics disabled, set METRICS_ENABLED=1"}), 404
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+# ====================== Admin: profiler ======================
+def _is_admin_request():
+    token = request.headers.get("X-Admin-Token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+@app.route('/api/admin/profile', methods=['POST'])
+def profile_app():
+    """
+    Sample every thread for ?seconds= (max 60) and return the hottest functions.
+    ?format=collapsed returns the collapsed-stack file for flamegraph tools.
+    """
+    if not _is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    try:
+        seconds = float(request.args.get("seconds", 10))
+        interval = float(request.args.get("interval_ms", profiler.DEFAULT_INTERVAL * 1000)) / 1000.0
+        top = int(request.args.get("top", 25))
+    except ValueError:
+        return jsonify({"error": "invalid parameters"}), 400
+    include_idle = request.args.get("idle") == "1"
+
+    logger.info(f"[PROFILE] Sampling all threads for {seconds}s")
+    try:
+        result = profiler.run_profile(seconds, interval, top, include_idle)
+    except profiler.ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+
+    if request.args.get("format") == "collapsed":
+        filename = f"etsflux-{time.strftime('%Y%m%d-%H%M%S')}.collapsed"
+        return Response(
+            result["collapsed"],
+            mimetype="text/plain",
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
+    return jsonify(result), 200
+
+@app.route('/api/admin/gtfs', methods=['GET'])
+def gtfs_stats():
+    """Loaded GTFS tables: rows, estimated memory and load time of each."""
+    if not _is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    if gtfs is None:
+        return jsonify({"error": "GTFS is not loaded in worker processes"}), 404
+    return jsonify(gtfs.stats()), 200
+
+@app.route('/api/admin/gtfs/reload', methods=['POST'])
+def gtfs_reload():
+    """
+    Pick up new GTFS files (called by the admin app after an upload). Tables
+    the upload's changeset touches lightly are patched in place, the others
+    reload on next use; the GTFS_PRELOAD ones are warmed again right away.
+    """
+    if not _is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    if gtfs is None:
+        return jsonify({"error": "GTFS is not loaded in worker processes"}), 404
+    started = time.monotonic()
+    report = gtfs.apply_changeset(gtfs_diff.load_changeset(STM_DIR))
+    gtfs.preload(GTFS_PRELOAD, background=True)
+    return jsonify({"tables": report, "seconds": round(time.monotonic() - started, 3)}), 200
+
 # ====================== API Routes ======================
 @app.route('/')
 def index():
@@ -268,145 +288,417 @@ def index():
         "status": "ok",
         "message": "ETS Flux API is running",
         "endpoints": {
-            "data": "/api/data"
+            "data": "/api/data",
+            "buses": "/api/buses",
+            "metro": "/api/metro",
+            "alerts": "/api/alerts",
+            "weather": "/api/weather",
+            "analytics": "/api/analytics",
+            "metrics": "/metrics"
         }
     })
 
-@app.route('/api/data', methods=['GET'])
-def get_data():
-    """
-    Main API endpoint that returns all transit data
-    """
-    try:
-        # Process metro alerts first
-        metro_lines = process_metro_alerts()
-        
-        # ========== STM ALERTS ==========
-        filtered_alerts = []
-        try:
-            processed_stm = process_stm_alerts()
-            logger.debug(f"Processed STM alerts: {processed_stm}")
-            
-            # Format alerts for frontend
-            for alert in processed_stm:
-                alert_obj = {
-                    "header": alert.get("header", "Alerte"),
-                    "description": alert.get("description", ""),
-                    "alert_type": alert.get("alert_type", "info"),
-                    "severity": alert.get("severity", "info")
-                }
-                
-                # Add route information if it exists
-                if alert.get("is_network_wide"):
-                    alert_obj["routes"] = "Réseau STM"
-                    alert_obj["stop"] = "Général"
-                elif alert.get("routes"):
-                    routes_str = ", ".join(alert["routes"])
-                    alert_obj["routes"] = routes_str
-                    alert_obj["stop"] = "Ligne spécifique"
-                else:
-                    alert_obj["routes"] = "N/A"
-                    alert_obj["stop"] = "N/A"
-                
-                filtered_alerts.append(alert_obj)
-            
-            # ===== ADD METRO ALERTS TO THE BANNER =====
-            logger.info("[METRO] Checking metro lines for alerts to add to banner...")
-            for metro_line in metro_lines:
-                if not metro_line.get("is_normal") and metro_line.get("alert_description"):
-                    metro_alert = {
-                        "header": f"Métro {metro_line['name']} - {metro_line['color']}",
-                        "description": metro_line["alert_description"],
-                        "routes": f"Métro {metro_line['color']}",
-                        "stop": "Métro",
-                        "alert_type": "metro",
-                        "severity": "warning"
-                    }
-                    filtered_alerts.append(metro_alert)
-                    logger.info(f"  [OK] Added metro alert to banner: {metro_alert['header']}")
-                
-        except Exception as e:
-            logger.error(f"ERROR processing STM alerts: {e}")
-            import traceback
-            traceback.print_exc()
+# ====================== API Sections ======================
+# Each section is built only when a client asks for it and cached on its
+# own, so a weather or alerts poll never downloads the protobuf feeds.
+# Concurrent requests for a stale section share one build (backend/cache.py).
+def _section_cache_ttl():
+    # In replay step mode every fetch advances the simulated clock
+    if replay.is_enabled() and REPLAY_SPEED <= 0:
+        return 0
+    return API_SECTION_CACHE_TTL
 
-        # ========== STM BUSES WITH OCCUPANCY ==========
-        buses = []
-        try:
+_sections = CoalescingCache("api_sections", ttl=_section_cache_ttl())
 
-            
-            stm_trip_entities = fetch_stm_realtime_data()
-            # FIX: Pass routes_map so vehicle positions can convert GTFS IDs to short names
-            positions_dict = fetch_stm_positions_dict(BUS_ROUTES, stm_trips, routes_map)
-            
-            # Debug: Log how many vehicle positions we got
-            logger.info(f"[OCCUPANCY] Fetched {len(positions_dict)} vehicle positions")
-            if len(positions_dict) > 0:
-                # Show first few for debugging
-                for i, ((route, trip), pos_data) in enumerate(list(positions_dict.items())[:3]):
-                    logger.info(f"  Position {i+1}: Route={route}, Trip={trip}, Occ={pos_data.get('occupancy')}")
-            else:
-                logger.warning("[OCCUPANCY] No vehicle positions found - occupancy will show as 'Unknown'")
-            
-            buses = process_stm_trip_updates(
-                stm_trip_entities,
-                stm_trips,
-                stm_stop_times,
-                positions_dict
+def _build_stm_alerts():
+    with metrics.span("stm_alerts"):
+        processed_stm = process_stm_alerts()
+    logger.debug(f"Processed STM alerts: {processed_stm}")
+    return processed_stm
+
+def _build_metro():
+    with metrics.span("metro_alerts"):
+        return process_metro_alerts()
+
+def _build_alerts():
+    filtered_alerts = []
+
+    # Format alerts for frontend
+    for alert in _section("stm_alerts"):
+        alert_obj = BannerAlert(
+            header=alert.header or "Alerte",
+            description=alert.description,
+            alert_type=alert.alert_type,
+            severity=alert.severity
+        )
+
+        # Add route information if it exists
+        if alert.is_network_wide:
+            alert_obj.routes = "Réseau STM"
+            alert_obj.stop = "Général"
+        elif alert.routes:
+            alert_obj.routes = ", ".join(alert.routes)
+            alert_obj.stop = "Ligne spécifique"
+
+        filtered_alerts.append(alert_obj)
+
+    # ===== ADD METRO ALERTS TO THE BANNER =====
+    logger.info("[METRO] Checking metro lines for alerts to add to banner...")
+    for metro_line in _section("metro"):
+        if not metro_line.is_normal and metro_line.alert_description:
+            metro_alert = BannerAlert(
+                header=f"Métro {metro_line.name} - {metro_line.color}",
+                description=metro_line.alert_description,
+                routes=f"Métro {metro_line.color}",
+                stop="Métro",
+                alert_type="metro",
+                severity="warning"
             )
+            filtered_alerts.append(metro_alert)
+            logger.info(f"  [OK] Added metro alert to banner: {metro_alert.header}")
+    return filtered_alerts
 
-            # Enhanced debug logging for occupancy
-            logger.info("----- DEBUG: Final Merged STM Buses with Occupancy -----")
-            status_map = {0: "INCOMING_AT", 1: "STOPPED_AT", 2: "IN_TRANSIT_TO"}
-            
-            for b in buses:
-                raw_stat = b.get("current_status")
-                if isinstance(raw_stat, int):
-                    stat_str = status_map.get(raw_stat, f"Unknown({raw_stat})")
-                else:
-                    stat_str = str(raw_stat)
-                
-                # Log occupancy information
-                occupancy = b.get("occupancy", "Unknown")
-                logger.info(
-                    f"Route={b['route_id']}, Trip={b['trip_id']}, "
-                    f"Stop={b['stop_id']}, ArrTime={b['arrival_time']}, "
-                    f"Occupancy={occupancy}, AtStop={b['at_stop']}, "
-                    f"Lat={b.get('lat')}, Lon={b.get('lon')}, Dist={b.get('distance_m')}m, "
-                    f"currentStatus={stat_str}"
-                )
-            logger.info("-----------------------------------------")
-
-            buses = merge_alerts_into_buses(buses, processed_stm if 'processed_stm' in locals() else [])
-        except Exception as e:
-            logger.error(f"ERROR processing buses: {e}")
-            import traceback
-            traceback.print_exc()
-
-        # ========== WEATHER ==========
-        weather = get_weather()
-
-        # Build response
-        response = {
-            "buses": buses,
-            "metro_lines": metro_lines,
-            "weather": weather,
-            "alerts": filtered_alerts,
-            "debug": {
-                "total_buses": len(buses),
-                "total_metro_lines": len(metro_lines),
-                "alerts_count": len(filtered_alerts)
-            }
-        }
+def _build_buses():
+    stm_trip_entities = fetch_stm_realtime_data()
+    # FIX: Pass routes_map so vehicle positions can convert GTFS IDs to short names
+    positions_dict = fetch_stm_positions_dict(BUS_ROUTES, gtfs.trips, gtfs.routes,
+                                              shapes=gtfs.shapes, stops=gtfs.stops)
 
-        return jsonify(response), 200
-        
+    # Debug: Log how many vehicle positions we got
+    logger.info(f"[OCCUPANCY] Fetched {len(positions_dict)} vehicle positions")
+    if len(positions_dict) > 0:
+        # Show first few for debugging
+        for i, ((route, trip), pos_data) in enumerate(list(positions_dict.items())[:3]):
+            logger.info(f"  Position {i+1}: Route={route}, Trip={trip}, Occ={pos_data.get('occupancy')}")
+    else:
+        logger.warning("[OCCUPANCY] No vehicle positions found - occupancy will show as 'Unknown'")
+
+    with metrics.span("process_stm_trip_updates"):
+        buses = process_stm_trip_updates(
+            stm_trip_entities,
+            gtfs.trips,
+            gtfs.stop_times,
+            positions_dict,
+            trip_stops=gtfs.trip_stops,
+            blocks=gtfs.blocks
+        )
+
+    # Enhanced debug logging for occupancy
+    logger.info("----- DEBUG: Final Merged STM Buses with Occupancy -----")
+    status_map = {0: "INCOMING_AT", 1: "STOPPED_AT", 2: "IN_TRANSIT_TO"}
+
+    for b in buses:
+        raw_stat = b.current_status
+        if isinstance(raw_stat, int):
+            stat_str = status_map.get(raw_stat, f"Unknown({raw_stat})")
+        else:
+            stat_str = str(raw_stat)
+
+        # Log occupancy information
+        logger.info(
+            f"Route={b.route_id}, Trip={b.trip_id}, "
+            f"Stop={b.stop_id}, ArrTime={b.arrival_time}, "
+            f"Occupancy={b.occupancy}, AtStop={b.at_stop}, "
+            f"Lat={b.lat}, Lon={b.lon}, "
+            f"currentStatus={stat_str}"
+        )
+    logger.info("-----------------------------------------")
+
+    return merge_alerts_into_buses(buses, _section("stm_alerts"))
+
+def _build_weather():
+    with metrics.span("weather"):
+        return get_weather()
+
+# section name -> (response key, builder, fallback when the build fails)
+SECTIONS = {
+    "buses":      ("buses",       _build_buses,      list),
+    "metro":      ("metro_lines", _build_metro,      get_default_metro_status),
+    "alerts":     ("alerts",      _build_alerts,     list),
+    "weather":    ("weather",     _build_weather,    lambda: DEFAULT_WEATHER),
+    "stm_alerts": (None,          _build_stm_alerts, list),
+}
+PUBLIC_SECTIONS = ["buses", "metro", "weather", "alerts"]
+
+def _section(name):
+    """Cached section value; on failure the last good value, else the fallback."""
+    _, builder, fallback = SECTIONS[name]
+    try:
+        return _sections.get(name, builder)
+    except Exception as e:
+        logger.error(f"ERROR building {name} section: {e}")
+        import traceback
+        traceback.print_exc()
+        return fallback()
+
+def parse_fields(raw):
+    """?fields=buses,weather -> section names; accepts response keys too (metro_lines)."""
+    if not raw:
+        return PUBLIC_SECTIONS
+    aliases = {SECTIONS[name][0]: name for name in PUBLIC_SECTIONS}
+    names = []
+    for field in raw.split(","):
+        field = field.strip()
+        name = field if field in PUBLIC_SECTIONS else aliases.get(field)
+        if name is None:
+            raise ValueError(f"unknown field '{field}'")
+        if name not in names:
+            names.append(name)
+    return names
+
+def _debug_counts(counts):
+    """/api/data "debug" block from {response key: item count}."""
+    debug = {}
+    if "buses" in counts:
+        debug["total_buses"] = counts["buses"]
+    if "metro_lines" in counts:
+        debug["total_metro_lines"] = counts["metro_lines"]
+    if "alerts" in counts:
+        debug["alerts_count"] = counts["alerts"]
+    return debug
+
+def section_payload(names, with_debug=False, stamped=True):
+    """Response dict for the given sections (also used by backend/asgi.py)."""
+    if _snapshot is not None:
+        response = {}
+        for name in names:
+            payload, _ = _snapshot.section(name)
+            if payload is None:
+                raise LookupError(f"section '{name}' not published yet")
+            response[SECTIONS[name][0]] = json.loads(payload)
+    else:
+        response = {SECTIONS[name][0]: _section(name) for name in names}
+    if with_debug:
+        response["debug"] = _debug_counts({
+            key: len(value) for key, value in response.items() if isinstance(value, list)
+        })
+    # Stamped per response, not per cached section: clients derive their clock
+    # offset from it to count down to the absolute arrival times locally
+    if stamped:
+        response["server_time"] = replay.current_time()
+    return response
+
+def _snapshot_response(names, endpoint):
+    """Worker mode: splice the published JSON bytes into the response without parsing them."""
+    current = _snapshot.current()
+    if current is None:
+        return jsonify({"error": "snapshot not published yet"}), 503
+    parts, counts = [], {}
+    for name in names:
+        key = SECTIONS[name][0]
+        payload, count = current.section(name)
+        if payload is None:
+            return jsonify({"error": f"section '{name}' not published yet"}), 503
+        parts.append(json.dumps(key).encode("utf-8") + b":" + payload)
+        if count is not None:
+            counts[key] = count
+    if endpoint == "/api/data":
+        parts.append(b'"debug":' + json.dumps(_debug_counts(counts)).encode("utf-8"))
+    parts.append(b'"server_time":' + json.dumps(replay.current_time()).encode("utf-8"))
+    response = Response(b"{" + b",".join(parts) + b"}", mimetype="application/json")
+    response.headers["X-Snapshot-Generation"] = str(current.generation)
+    response.headers["X-Snapshot-Age"] = f"{time.time() - current.published_at:.1f}"
+    return response, 200
+
+def _section_response(names, endpoint):
+    if _snapshot is not None:
+        return _snapshot_response(names, endpoint)
+    try:
+        response = section_payload(names, with_debug=endpoint == "/api/data")
+        with metrics.span("json_serialization"):
+            payload = Response(models.encode(models.ApiData(**response)), mimetype="application/json")
+        return payload, 200
     except Exception as e:
-        logger.error(f"Error in get_data: {e}")
+        metrics.inc("api_errors_total", endpoint=endpoint)
+        logger.error(f"Error in {endpoint}: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/analytics', methods=['GET'])
+def get_analytics():
+    """
+    Rolling delay and headway statistics per route (minutes), e.g. the
+    average delay of a line and how often its buses arrive bunched.
+    ?route=61 limits the response to one route.
+    """
+    route = request.args.get("route")
+    if _snapshot is None:
+        return jsonify(analytics.summary(route)), 200
+    payload, _ = _snapshot.section("analytics")
+    if payload is None:
+        return jsonify({"error": "snapshot not published yet"}), 503
+    data = json.loads(payload)
+    if route:
+        data["routes"] = {r: stats for r, stats in data["routes"].items() if r == route}
+    return jsonify(data), 200
+
+MAX_DEPARTURES = 50
+MAX_DEPARTURE_MINUTES = 24 * 60
+MAX_NEARBY_RADIUS = 2000      # metres
+MAX_NEARBY_STOPS = 20
+
+def _number_arg(name, default, low, high, kind=int):
+    """Query parameter within [low, high]; ValueError (message for a 400) otherwise."""
+    raw = request.args.get(name)
+    if raw is None:
+        if default is None:
+            raise ValueError(f"{name} is required")
+        return default
+    try:
+        value = kind(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be a number") from None
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return value
+
+def _refresh_trip_updates():
+    """Fetch the trip-updates feed the live departures index is built from."""
+    try:
+        fetch_stm_realtime_data()
+    except Exception as e:
+        logger.warning(f"[DEPARTURES] Trip updates unavailable, serving the timetable: {e}")
+
+@app.route('/api/stops/<stop_id>/departures', methods=['GET'])
+def get_stop_departures(stop_id):
+    """
+    Next departures at any STM stop, live predictions merged with the
+    timetable (backend/departures.py). ?limit=10&minutes=90
+    """
+    if gtfs is None:
+        return jsonify({"error": "departures are served by the fetcher process"}), 503
+    try:
+        limit = _number_arg("limit", 10, 1, MAX_DEPARTURES)
+        minutes = _number_arg("minutes", 90, 1, MAX_DEPARTURE_MINUTES)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    stop = gtfs.stops.get(stop_id)
+    if stop is None:
+        return jsonify({"error": f"unknown stop {stop_id}"}), 404
+    _refresh_trip_updates()
+    try:
+        with metrics.span("stop_departures"):
+            board = models.StopBoard(
+                stop_id=stop_id,
+                stop_name=stop[0],
+                departures=departures.for_stop(gtfs, stop_id, limit=limit, horizon=minutes * 60),
+                feed_timestamp=feed_timestamp("trip_updates"),
+                server_time=replay.current_time(),
+            )
+        return Response(models.encode(board), mimetype="application/json"), 200
+    except Exception as e:
+        metrics.inc("api_errors_total", endpoint="/api/stops/departures")
+        logger.error(f"Error in /api/stops/{stop_id}/departures: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/stops/nearby', methods=['GET'])
+def get_nearby_stops():
+    """
+    Stops within a radius of a point, closest first, each with its next
+    departures. ?lat=45.4946&lon=-73.5622&radius=400&limit=5&departures=3&minutes=60
+    """
+    if gtfs is None:
+        return jsonify({"error": "departures are served by the fetcher process"}), 503
+    try:
+        lat = _number_arg("lat", None, -90.0, 90.0, kind=float)
+        lon = _number_arg("lon", None, -180.0, 180.0, kind=float)
+        radius = _number_arg("radius", 400, 1, MAX_NEARBY_RADIUS)
+        limit = _number_arg("limit", 5, 1, MAX_NEARBY_STOPS)
+        per_stop = _number_arg("departures", 3, 0, MAX_DEPARTURES)
+        minutes = _number_arg("minutes", 60, 1, MAX_DEPARTURE_MINUTES)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    _refresh_trip_updates()
+    try:
+        with metrics.span("nearby_stops"):
+            result = models.NearbyStops(
+                lat=lat,
+                lon=lon,
+                radius=radius,
+                stops=departures.for_point(gtfs, lat, lon, radius, limit=limit,
+                                           per_stop=per_stop, horizon=minutes * 60),
+                feed_timestamp=feed_timestamp("trip_updates"),
+                server_time=replay.current_time(),
+            )
+        return Response(models.encode(result), mimetype="application/json"), 200
+    except Exception as e:
+        metrics.inc("api_errors_total", endpoint="/api/stops/nearby")
+        logger.error(f"Error in /api/stops/nearby: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/shapes/<shape_id>', methods=['GET'])
+def get_shape(shape_id):
+    """
+    Geometry of a route shape (Bus.shape_id), simplified for map display;
+    ?full=1 returns every shapes.txt point.
+    """
+    if gtfs is None:
+        return jsonify({"error": "shapes are served by the fetcher process"}), 503
+    shapes = gtfs.shapes
+    if shape_id not in shapes:
+        return jsonify({"error": f"unknown shape {shape_id}"}), 404
+    full = request.args.get("full") in ("1", "true")
+    shape = models.Shape(
+        shape_id=shape_id,
+        length=round(shapes.length(shape_id), 1),
+        simplified=not full,
+        points=shapes.points(shape_id) if full else shapes.simplified(shape_id),
+    )
+    return Response(models.encode(shape), mimetype="application/json"), 200
+
+# ====================== Snapshot publishing (fetcher role) ======================
+def publish_snapshot(writer):
+    sections = {}
+    for name in PUBLIC_SECTIONS:
+        value = _section(name)
+        count = len(value) if isinstance(value, list) else None
+        sections[name] = (models.encode(value), count)
+    sections["analytics"] = (models.encode(analytics.summary()), None)
+    return writer.publish(sections)
+
+def run_snapshot_publisher(interval=SNAPSHOT_INTERVAL):
+    """Fetcher process loop: rebuild every section and publish it for the workers."""
+    writer = SnapshotWriter(SNAPSHOT_DIR)
+    logger.info(f"[SNAPSHOT] Publishing to {SNAPSHOT_DIR} every {interval}s")
+    while True:
+        started = time.monotonic()
+        try:
+            generation = publish_snapshot(writer)
+            logger.info(f"[SNAPSHOT] Published generation {generation} "
+                        f"in {time.monotonic() - started:.2f}s")
+        except Exception as e:
+            logger.error(f"[SNAPSHOT] Publish failed: {e}")
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+@app.route('/api/data', methods=['GET'])
+def get_data():
+    """
+    Main API endpoint that returns all transit data.
+    ?fields=buses,metro,alerts,weather limits the response to those sections.
+    """
+    try:
+        names = parse_fields(request.args.get("fields"))
+    except ValueError as e:
+        return jsonify({"error": str(e), "fields": PUBLIC_SECTIONS}), 400
+    return _section_response(names, "/api/data")
+
+@app.route('/api/buses', methods=['GET'])
+def get_buses():
+    return _section_response(["buses"], "/api/buses")
+
+@app.route('/api/metro', methods=['GET'])
+def get_metro():
+    return _section_response(["metro"], "/api/metro")
+
+@app.route('/api/alerts', methods=['GET'])
+def get_alerts():
+    return _section_response(["alerts"], "/api/alerts")
+
+@app.route('/api/weather', methods=['GET'])
+def get_weather_section():
+    return _section_response(["weather"], "/api/weather")
+
 if __name__ == '__main__':
     from waitress import serve
     port = int(os.environ.get('PORT', 5000))
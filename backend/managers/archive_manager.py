@@ -0,0 +1,311 @@
+"""
+Realtime feed archive.
+
+Every trip-updates / vehicle-positions protobuf we download can be appended
+to an on-disk archive so that delays can be analyzed and incidents replayed
+later. Layout:
+
+    <FEED_ARCHIVE_DIR>/<feed>/<YYYYMMDD>/<HH>.seg.zst   compressed payloads
+    <FEED_ARCHIVE_DIR>/<feed>/<YYYYMMDD>/<HH>.idx       time index
+
+Segments are partitioned by the feed header timestamp (UTC hour). Each
+payload is compressed as its own zstd frame / gzip member, so a segment is
+still a valid compressed stream while the index gives random access to a
+single feed. An index entry is a fixed 20-byte record:
+(feed_timestamp u64, offset u64, compressed_length u32).
+
+Writes happen on a background thread; the request path only pays for a
+dedup check and a queue put.
+"""
+import os
+import gzip
+import time
+import queue
+import struct
+import logging
+import threading
+
+from backend.config import (
+    FEED_ARCHIVE_DIR,
+    FEED_ARCHIVE_CODEC,
+    FEED_ARCHIVE_MAX_AGE_DAYS,
+    FEED_ARCHIVE_MAX_BYTES,
+)
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+logger = logging.getLogger('BdeB-GTFS')
+
+FEEDS = ("trip_updates", "vehicle_positions")
+
+INDEX_ENTRY = struct.Struct("<QQI")
+SEGMENT_EXTENSIONS = {"zstd": ".seg.zst", "gzip": ".seg.gz"}
+
+QUEUE_MAX_SIZE = 64            # pending feeds before we start dropping
+RETENTION_CHECK_INTERVAL = 600 # seconds between retention sweeps
+
+
+def _codec_for_path(path):
+    return "zstd" if path.endswith(".zst") else "gzip"
+
+
+def _compress(codec, payload):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(payload)
+    return gzip.compress(payload, compresslevel=6)
+
+
+def _decompress(codec, blob):
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return gzip.decompress(blob)
+
+
+def _partition(feed_ts):
+    t = time.gmtime(feed_ts)
+    return time.strftime("%Y%m%d", t), time.strftime("%H", t)
+
+
+def _read_index(idx_path):
+    entries = []
+    try:
+        with open(idx_path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return entries
+    usable = len(data) - (len(data) % INDEX_ENTRY.size)
+    for pos in range(0, usable, INDEX_ENTRY.size):
+        entries.append(INDEX_ENTRY.unpack_from(data, pos))
+    return entries
+
+
+def _segment_pairs(feed_dir):
+    """Yield (day, hour, seg_path, idx_path) for a feed directory, oldest first."""
+    if not os.path.isdir(feed_dir):
+        return
+    for day in sorted(os.listdir(feed_dir)):
+        day_dir = os.path.join(feed_dir, day)
+        if not os.path.isdir(day_dir):
+            continue
+        for name in sorted(os.listdir(day_dir)):
+            if not name.endswith(".idx"):
+                continue
+            hour = name[:-4]
+            for ext in SEGMENT_EXTENSIONS.values():
+                seg_path = os.path.join(day_dir, hour + ext)
+                if os.path.exists(seg_path):
+                    yield day, hour, seg_path, os.path.join(day_dir, name)
+                    break
+
+
+class FeedArchive:
+    """Append-only, time-partitioned archive of raw GTFS-RT payloads."""
+
+    def __init__(self, root, codec=FEED_ARCHIVE_CODEC,
+                 max_age_days=FEED_ARCHIVE_MAX_AGE_DAYS,
+                 max_bytes=FEED_ARCHIVE_MAX_BYTES):
+        if codec == "zstd" and not ZSTD_AVAILABLE:
+            logger.warning("zstandard not installed, archiving feeds with gzip")
+            codec = "gzip"
+        self.root = root
+        self.codec = codec
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+
+        self._queue = queue.Queue(maxsize=QUEUE_MAX_SIZE)
+        self._last_ts = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_retention = 0
+        self.dropped = 0
+        self.written = 0
+
+    # ─── Request path ──────────────────────────────────────────
+    def submit(self, feed, feed_ts, payload):
+        """Queue a raw feed for archiving. Returns False when skipped."""
+        if not feed_ts or not payload:
+            return False
+        with self._lock:
+            if feed not in self._last_ts:
+                self._last_ts[feed] = self._latest_archived_ts(feed)
+            if feed_ts <= self._last_ts[feed]:
+                return False
+            self._last_ts[feed] = feed_ts
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((feed, int(feed_ts), bytes(payload)))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"[ARCHIVE] Queue full, dropped {feed} @ {feed_ts}")
+            return False
+        return True
+
+    # ─── Writer thread ─────────────────────────────────────────
+    def _ensure_writer(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._writer_loop, name="feed-archive", daemon=True)
+            self._thread.start()
+
+    def _writer_loop(self):
+        while True:
+            feed, feed_ts, payload = self._queue.get()
+            try:
+                self._append(feed, feed_ts, payload)
+                self.written += 1
+            except Exception as e:
+                logger.error(f"[ARCHIVE] Could not archive {feed} @ {feed_ts}: {e}")
+            finally:
+                self._queue.task_done()
+
+            if time.time() - self._last_retention > RETENTION_CHECK_INTERVAL:
+                self._last_retention = time.time()
+                try:
+                    self.enforce_retention()
+                except Exception as e:
+                    logger.error(f"[ARCHIVE] Retention sweep failed: {e}")
+
+    def _append(self, feed, feed_ts, payload):
+        day, hour = _partition(feed_ts)
+        day_dir = os.path.join(self.root, feed, day)
+        os.makedirs(day_dir, exist_ok=True)
+        seg_path = os.path.join(day_dir, hour + SEGMENT_EXTENSIONS[self.codec])
+        idx_path = os.path.join(day_dir, hour + ".idx")
+
+        blob = _compress(self.codec, payload)
+        with open(seg_path, "ab") as seg:
+            offset = seg.tell()
+            seg.write(blob)
+        # Index is written last so a reader never sees an entry pointing
+        # past the end of the segment.
+        with open(idx_path, "ab") as idx:
+            idx.write(INDEX_ENTRY.pack(feed_ts, offset, len(blob)))
+
+    def flush(self, timeout=None):
+        """Block until every queued feed has been written (used by scripts)."""
+        if timeout is None:
+            self._queue.join()
+            return
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+
+    # ─── Retention ─────────────────────────────────────────────
+    def enforce_retention(self):
+        """Delete segments older than max_age_days, then oldest-first until under max_bytes."""
+        cutoff_day = time.strftime("%Y%m%d", time.gmtime(time.time() - self.max_age_days * 86400))
+        segments = []
+        total = 0
+        for feed in FEEDS:
+            feed_segments = []
+            for day, hour, seg_path, idx_path in _segment_pairs(os.path.join(self.root, feed)):
+                if day < cutoff_day:
+                    self._remove_segment(seg_path, idx_path)
+                    continue
+                size = os.path.getsize(seg_path) + os.path.getsize(idx_path)
+                feed_segments.append((day, hour, size, seg_path, idx_path))
+            total += sum(s[2] for s in feed_segments)
+            # Never delete the newest segment of a feed, it may still be appended to.
+            segments.extend(feed_segments[:-1])
+
+        segments.sort()
+        while total > self.max_bytes and segments:
+            day, hour, size, seg_path, idx_path = segments.pop(0)
+            self._remove_segment(seg_path, idx_path)
+            total -= size
+
+        for feed in FEEDS:
+            feed_dir = os.path.join(self.root, feed)
+            if not os.path.isdir(feed_dir):
+                continue
+            for day in os.listdir(feed_dir):
+                day_dir = os.path.join(feed_dir, day)
+                if os.path.isdir(day_dir) and not os.listdir(day_dir):
+                    os.rmdir(day_dir)
+
+    @staticmethod
+    def _remove_segment(seg_path, idx_path):
+        for path in (idx_path, seg_path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"[ARCHIVE] Could not remove {path}: {e}")
+
+    # ─── Reading ───────────────────────────────────────────────
+    def _latest_archived_ts(self, feed):
+        """
+        Timestamp of a feed's newest archived entry, 0 if none. Partitions
+        are named after the feed time and entries are appended in order, so
+        only the newest non-empty index is read.
+        """
+        feed_dir = os.path.join(self.root, feed)
+        if not os.path.isdir(feed_dir):
+            return 0
+        for day in sorted(os.listdir(feed_dir), reverse=True):
+            day_dir = os.path.join(feed_dir, day)
+            if not os.path.isdir(day_dir):
+                continue
+            for name in sorted(os.listdir(day_dir), reverse=True):
+                if not name.endswith(".idx"):
+                    continue
+                entries = _read_index(os.path.join(day_dir, name))
+                if entries:
+                    return entries[-1][0]
+        return 0
+
+    def index(self, feed, start_ts=None, end_ts=None):
+        """List (feed_ts, seg_path, offset, length) entries in time order."""
+        result = []
+        start_day = _partition(start_ts)[0] if start_ts else None
+        end_day = _partition(end_ts)[0] if end_ts else None
+        for day, _, seg_path, idx_path in _segment_pairs(os.path.join(self.root, feed)):
+            if (start_day and day < start_day) or (end_day and day > end_day):
+                continue
+            for feed_ts, offset, length in _read_index(idx_path):
+                if start_ts and feed_ts < start_ts:
+                    continue
+                if end_ts and feed_ts > end_ts:
+                    continue
+                result.append((feed_ts, seg_path, offset, length))
+        result.sort(key=lambda e: e[0])
+        return result
+
+    @staticmethod
+    def read_payload(seg_path, offset, length):
+        with open(seg_path, "rb") as f:
+            f.seek(offset)
+            blob = f.read(length)
+        return _decompress(_codec_for_path(seg_path), blob)
+
+    def iter_feed(self, feed, start_ts=None, end_ts=None):
+        """Yield (feed_ts, raw protobuf bytes) for an archived feed."""
+        for feed_ts, seg_path, offset, length in self.index(feed, start_ts, end_ts):
+            yield feed_ts, self.read_payload(seg_path, offset, length)
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """Return the process-wide archive, or None when archiving is disabled."""
+    global _archive
+    if not FEED_ARCHIVE_DIR:
+        return None
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                _archive = FeedArchive(FEED_ARCHIVE_DIR)
+                print(f"[ARCHIVE] Archiving realtime feeds to {FEED_ARCHIVE_DIR} ({_archive.codec})")
+    return _archive
+
+
+def archive_feed(feed, feed_ts, payload):
+    """Hook used by the realtime fetchers; a no-op unless FEED_ARCHIVE_DIR is set."""
+    archive = get_archive()
+    if archive is None:
+        return False
+    return archive.submit(feed, feed_ts, payload)
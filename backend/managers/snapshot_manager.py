@@ -0,0 +1,176 @@
+"""
+Transit snapshot shared between processes through memory-mapped files.
+
+One fetcher process loads GTFS, polls STM and publishes the serialized API
+sections; any number of read-only worker processes map the published file
+and serve those bytes as is, so neither the GTFS dicts nor the upstream
+polling are multiplied by the number of workers. Layout:
+
+    <SNAPSHOT_DIR>/snapshot.ctl             current generation (u64)
+    <SNAPSHOT_DIR>/snapshot.<gen>.bin       one published snapshot
+
+A snapshot file is written in full under a temporary name and renamed
+before the generation counter is bumped, so a reader never sees a partial
+file. It starts with a fixed header (magic, table length) followed by a
+JSON table {section: [offset, length, count]} and the section payloads
+(offsets are relative to the end of the table).
+Readers check the 8-byte counter on each access and remap only when it
+changes; the pages of the file are shared through the OS page cache.
+"""
+import os
+import json
+import mmap
+import time
+import struct
+import logging
+import threading
+
+logger = logging.getLogger('BdeB-GTFS')
+
+MAGIC = b"ETSSNAP1"
+HEADER = struct.Struct("<8sI")   # magic, table length
+GENERATION = struct.Struct("<Q")
+KEEP_GENERATIONS = 3             # older files are removed once no longer current
+
+CONTROL_FILE = "snapshot.ctl"
+
+
+def _data_path(root, generation):
+    return os.path.join(root, f"snapshot.{generation}.bin")
+
+
+class SnapshotWriter:
+    """Publishes snapshots; only one writer (the fetcher process) per directory."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        ctl_path = os.path.join(root, CONTROL_FILE)
+        if not os.path.exists(ctl_path) or os.path.getsize(ctl_path) < GENERATION.size:
+            with open(ctl_path, "wb") as f:
+                f.write(GENERATION.pack(0))
+        self._ctl_file = open(ctl_path, "r+b")
+        self._ctl = mmap.mmap(self._ctl_file.fileno(), GENERATION.size)
+        self.generation = GENERATION.unpack_from(self._ctl, 0)[0]
+
+    def publish(self, sections):
+        """
+        sections: {name: (payload bytes, item count or None)}.
+        Returns the new generation.
+        """
+        table = {"_published_at": time.time()}
+        offset = 0
+        for name, (payload, count) in sections.items():
+            table[name] = [offset, len(payload), count]
+            offset += len(payload)
+        table_bytes = json.dumps(table).encode("utf-8")
+
+        generation = self.generation + 1
+        path = _data_path(self.root, generation)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(table_bytes)))
+            f.write(table_bytes)
+            for payload, _ in sections.values():
+                f.write(payload)
+        os.replace(tmp_path, path)
+
+        GENERATION.pack_into(self._ctl, 0, generation)
+        self.generation = generation
+        self._prune()
+        return generation
+
+    def _prune(self):
+        for name in os.listdir(self.root):
+            if not (name.startswith("snapshot.") and name.endswith(".bin")):
+                continue
+            try:
+                generation = int(name.split(".")[1])
+            except ValueError:
+                continue
+            if generation <= self.generation - KEEP_GENERATIONS:
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    pass  # still mapped by a reader on Windows; retried next publish
+
+    def close(self):
+        self._ctl.close()
+        self._ctl_file.close()
+
+
+class _Mapped:
+    __slots__ = ("generation", "map", "base", "table", "published_at")
+
+    def __init__(self, generation, mapped, base, table):
+        self.generation = generation
+        self.map = mapped
+        self.base = base
+        self.published_at = table.pop("_published_at", 0)
+        self.table = table
+
+    def section(self, name):
+        """(payload bytes, count), or (None, None) if the section was not published."""
+        if name not in self.table:
+            return None, None
+        offset, length, count = self.table[name]
+        start = self.base + offset
+        return self.map[start:start + length], count
+
+
+class SnapshotReader:
+    """Maps the current snapshot of a directory read-only; safe to share between threads."""
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._ctl = None
+        self._current = None
+
+    def _generation(self):
+        if self._ctl is None:
+            ctl_path = os.path.join(self.root, CONTROL_FILE)
+            try:
+                with open(ctl_path, "rb") as f:
+                    self._ctl = mmap.mmap(f.fileno(), GENERATION.size, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return 0
+        return GENERATION.unpack_from(self._ctl, 0)[0]
+
+    def _load(self, generation):
+        with open(_data_path(self.root, generation), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, table_len = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC:
+            raise ValueError(f"not a snapshot file (generation {generation})")
+        table = json.loads(mapped[HEADER.size:HEADER.size + table_len])
+        return _Mapped(generation, mapped, HEADER.size + table_len, table)
+
+    def current(self):
+        """Latest published snapshot, or None before the first publish."""
+        generation = self._generation()
+        current = self._current
+        if current is not None and current.generation == generation:
+            return current
+        if generation == 0:
+            return None
+        with self._lock:
+            if self._current is None or self._current.generation != generation:
+                try:
+                    # The previous map is not closed: threads may still be
+                    # slicing it; it is released with its last reference.
+                    self._current = self._load(generation)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"[SNAPSHOT] Cannot map generation {generation}: {e}")
+            return self._current
+
+    def section(self, name):
+        """(payload bytes, count) of a section in the latest snapshot, or (None, None)."""
+        current = self.current()
+        if current is None:
+            return None, None
+        return current.section(name)
+
+    def age(self):
+        current = self.current()
+        return None if current is None else time.time() - current.published_at
@@ -1,39 +1,83 @@
-import time
 import requests
 import logging
-from backend.config import WEATHER_API_KEY
+from backend.config import WEATHER_API_KEY, WEATHER_API_ENDPOINT
+from backend.loaders import replay
+from backend.cache import CoalescingCache
+from backend import metrics
+from backend.models import Weather
 
 logger = logging.getLogger('BdeB-GTFS')
 
-_weather_cache = {
-    "ts":   0,     # last fetch timestamp
-    "data": None,  # cached weather dict
-}
+CACHE_TTL = 5 * 60        # seconds (5 minutes)
+COLD_START_WAIT = 5       # seconds a request waits when nothing is cached yet
+BACKOFF_BASE = 30         # seconds before retrying after a failure, doubled each time
+BACKOFF_MAX = 30 * 60
 
-CACHE_TTL = 5 * 60  # seconds (5 minutes)
+# Holds (Weather, raw "current" block) under a single key; failures
+# keep the last good pair and retry with exponential backoff.
+_weather_cache = CoalescingCache("weather", ttl=CACHE_TTL,
+                                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX)
 
-def get_weather():
-    """Fetch weather from WeatherAPI at most once per CACHE_TTL."""
-    now = time.time()
-    # if cache is stale, refresh it
-    if now - _weather_cache["ts"] > CACHE_TTL:
+DEFAULT_WEATHER = Weather()
+
+
+def weather_url():
+    return (
+        f"{WEATHER_API_ENDPOINT}"
+        f"?key={WEATHER_API_KEY}"
+        "&q=Montreal,QC"
+        "&aqi=no"
+        "&lang=fr"
+    )
+
+
+def _fetch_current():
+    """Raw WeatherAPI current.json response."""
+    if replay.is_enabled():
+        resp = replay.get_source().json_document("weather")
+        if resp is None:
+            raise ValueError("no recorded weather")
+        return resp
+    with metrics.span("weather_fetch"):
+        response = requests.get(weather_url(), timeout=5)
+    response.raise_for_status()
+    return response.json()
+
+
+def parse_current(resp):
+    """(Weather, raw "current" block) cache entry from a current.json response."""
+    data = Weather(
+        icon="https:" + resp["current"]["condition"]["icon"],
+        text=resp["current"]["condition"]["text"],
+        temp=int(round(resp["current"]["temp_c"])),
+    )
+    return data, resp["current"]
+
+
+def _load():
+    try:
+        return parse_current(_fetch_current())
+    except Exception as e:
+        metrics.inc("upstream_errors_total", upstream="weather")
+        logger.warning(f"[WEATHER] Refresh failed ({e})")
+        raise
+
+
+def _cached():
+    """
+    Serve-stale-while-revalidate: an expired entry is returned as is while
+    one background refresh runs. Only a cold cache makes the caller wait.
+    """
+    if replay.is_enabled():
+        # keep replays deterministic: refresh inline
         try:
-            resp = requests.get(
-                f"http://api.weatherapi.com/v1/current.json"
-                f"?key={WEATHER_API_KEY}"
-                "&q=Montreal,QC"
-                "&aqi=no"
-                "&lang=fr",
-                timeout=5
-            ).json()
-            _weather_cache["data"] = {
-                "icon": "https:" + resp["current"]["condition"]["icon"],
-                "text":  resp["current"]["condition"]["text"],
-                "temp":  int(round(resp["current"]["temp_c"])),
-            }
+            return _weather_cache.get("current", _load)
         except Exception:
-            # leave last good data or None
-            pass
-        _weather_cache["ts"] = now
+            return None
+    return _weather_cache.get_stale_while_revalidate("current", _load, COLD_START_WAIT)
+
 
-    return _weather_cache["data"] or {"icon":"", "text":"", "temp":""}
+def get_weather():
+    """Cached weather for the display; refreshed in the background every CACHE_TTL."""
+    cached = _cached()
+    return cached[0] if cached else DEFAULT_WEATHER
@@ -0,0 +1,164 @@
+"""
+Lightweight stage timing and counters.
+
+    with metrics.span("stm_trip_updates_fetch"):
+        ...
+    metrics.inc("upstream_errors_total", upstream="stm_alerts")
+
+Spans are aggregated into Prometheus summaries (rendered by /metrics) and
+recorded per request for the Server-Timing header. Everything is a no-op
+unless METRICS_ENABLED=1, so the disabled cost is one attribute check.
+"""
+import time
+import threading
+import functools
+
+from backend.config import METRICS_ENABLED
+
+PREFIX = "etsflux"
+
+_lock = threading.Lock()
+_stage_totals = {}   # stage -> [sum_seconds, count, max_seconds]
+_counters = {}       # (name, ((label, value), ...)) -> value
+_request = threading.local()
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def enabled():
+    return METRICS_ENABLED
+
+
+def span(name):
+    """Context manager timing one stage."""
+    if not METRICS_ENABLED:
+        return _NOOP_SPAN
+    return _Span(name)
+
+
+def timed(name):
+    """Decorator form of span()."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not METRICS_ENABLED:
+                return fn(*args, **kwargs)
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record(name, seconds):
+    with _lock:
+        totals = _stage_totals.get(name)
+        if totals is None:
+            _stage_totals[name] = [seconds, 1, seconds]
+        else:
+            totals[0] += seconds
+            totals[1] += 1
+            if seconds > totals[2]:
+                totals[2] = seconds
+    spans = getattr(_request, "spans", None)
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+
+
+def inc(name, amount=1, **labels):
+    """Increment a counter, e.g. inc("cache_requests_total", cache="weather", result="hit")."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+# ─── Per-request spans (Server-Timing) ─────────────────────────
+def begin_request():
+    if METRICS_ENABLED:
+        _request.spans = {}
+
+
+def end_request():
+    """Return and clear the spans recorded on this thread for the current request."""
+    spans = getattr(_request, "spans", None)
+    _request.spans = None
+    return spans or {}
+
+
+def server_timing_header(spans):
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in spans.items())
+
+
+# ─── Prometheus text exposition ────────────────────────────────
+def _escape(value):
+    """Label value escaped for the text format (stage / endpoint names come from request paths)."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus():
+    with _lock:
+        stages = {k: list(v) for k, v in _stage_totals.items()}
+        counters = dict(_counters)
+
+    lines = [
+        f"# HELP {PREFIX}_stage_seconds Time spent per pipeline stage.",
+        f"# TYPE {PREFIX}_stage_seconds summary",
+    ]
+    for stage in sorted(stages):
+        total, count, _ = stages[stage]
+        labels = _labels([("stage", stage)])
+        lines.append(f"{PREFIX}_stage_seconds_sum{labels} {total:.6f}")
+        lines.append(f"{PREFIX}_stage_seconds_count{labels} {count}")
+    lines.append(f"# HELP {PREFIX}_stage_seconds_max Slowest observation per stage since start.")
+    lines.append(f"# TYPE {PREFIX}_stage_seconds_max gauge")
+    for stage in sorted(stages):
+        labels = _labels([("stage", stage)])
+        lines.append(f"{PREFIX}_stage_seconds_max{labels} {stages[stage][2]:.6f}")
+
+    by_name = {}
+    for (name, labels), value in counters.items():
+        by_name.setdefault(name, []).append((labels, value))
+    for name in sorted(by_name):
+        lines.append(f"# TYPE {PREFIX}_{name} counter")
+        for labels, value in sorted(by_name[name]):
+            lines.append(f"{PREFIX}_{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _stage_totals.clear()
+        _counters.clear()
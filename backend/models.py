@@ -0,0 +1,282 @@
+"""
+Typed payloads (msgspec).
+
+Output models are what the API sections are built from; encode() turns a
+section or the /api/data envelope straight into JSON bytes. Input models
+decode the STM etatservice alerts document (decode_stm_alerts), in both
+its current shape (informed_entities / header_texts / description_texts)
+and the older GTFS-RT JSON shape (informed_entity / header_text.translation),
+which is folded into the current field names on decode.
+"""
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import logging
+
+import msgspec
+
+logger = logging.getLogger('BdeB-GTFS')
+
+
+# ─── STM alerts document (input) ──────────────────────────────
+class Translation(msgspec.Struct):
+    language: Optional[str] = ""
+    text: Optional[str] = ""             # null in some alerts
+
+
+class TranslatedString(msgspec.Struct):
+    """Older GTFS-RT JSON shape: {"translation": [...]}."""
+    translation: List[Translation] = []
+
+
+class InformedEntity(msgspec.Struct):
+    agency_id: Optional[str] = None
+    route_id: Optional[str] = None
+    route_short_name: Optional[str] = None
+    stop_code: Optional[str] = None
+
+
+def _translations(value):
+    return value.translation if isinstance(value, TranslatedString) else []
+
+
+def _text(translations, language):
+    for translation in translations:
+        if translation.language == language:
+            return translation.text or ""
+    return ""
+
+
+class StmAlert(msgspec.Struct):
+    informed_entities: List[InformedEntity] = []
+    header_texts: List[Translation] = []
+    description_texts: List[Translation] = []
+    active_periods: Any = None
+    cause: Optional[str] = None
+    effect: Optional[str] = None
+    # Older field names, folded into the ones above
+    informed_entity: Optional[List[InformedEntity]] = None
+    header_text: Union[TranslatedString, str, None] = None
+    description_text: Union[TranslatedString, str, None] = None
+    active_period: Any = None
+
+    def __post_init__(self):
+        if self.informed_entity is not None:
+            if not self.informed_entities:
+                self.informed_entities = self.informed_entity
+            self.informed_entity = None
+        if self.header_text is not None:
+            if not self.header_texts:
+                self.header_texts = _translations(self.header_text)
+            self.header_text = None
+        if self.description_text is not None:
+            if not self.description_texts:
+                self.description_texts = _translations(self.description_text)
+            self.description_text = None
+        if self.active_period is not None:
+            if self.active_periods is None:
+                self.active_periods = self.active_period
+            self.active_period = None
+
+    def header(self, language="fr"):
+        return _text(self.header_texts, language)
+
+    def description(self, language="fr"):
+        return _text(self.description_texts, language)
+
+
+class StmAlertsDocument(msgspec.Struct):
+    alerts: Optional[List[StmAlert]] = None
+    # Newer etatservice shape: {"result": {"alerts": [...], "ligne1": {...}, ...}}
+    result: Optional[Dict[str, Any]] = None
+
+
+class MetroLineState(msgspec.Struct):
+    etat: str = "NORMAL"
+    libelle: Optional[str] = None
+    detail: Optional[str] = None
+
+
+class MetroLineDocument(msgspec.Struct):
+    numero: Union[str, int] = ""
+    etat: MetroLineState = msgspec.field(default_factory=MetroLineState)
+
+
+_alerts_type = Union[StmAlertsDocument, List[StmAlert]]
+_alerts_decoder = msgspec.json.Decoder(_alerts_type)
+
+
+def decode_stm_alerts(data):
+    """
+    StmAlertsDocument or [StmAlert] from the raw response bytes, or from an
+    already parsed JSON value (replay fixtures). When the typed decode fails,
+    the alerts are converted one at a time and those that do not validate
+    are left out, so one malformed alert does not cost the others. Raises
+    msgspec.ValidationError or msgspec.DecodeError on an unexpected document.
+    """
+    try:
+        if isinstance(data, (bytes, bytearray, memoryview, str)):
+            return _alerts_decoder.decode(data)
+        return msgspec.convert(data, _alerts_type)
+    except msgspec.ValidationError:
+        if isinstance(data, (bytes, bytearray, memoryview, str)):
+            data = msgspec.json.decode(data)
+        if isinstance(data, list):
+            return convert_alerts(data)
+        if isinstance(data, dict) and isinstance(data.get("alerts"), list):
+            return StmAlertsDocument(alerts=convert_alerts(data["alerts"]),
+                                     result=data.get("result") if isinstance(data.get("result"), dict) else None)
+        raise
+
+
+def convert_alerts(values):
+    """[StmAlert] of a list of parsed alerts, skipping the ones that do not validate."""
+    if not isinstance(values, list):
+        raise msgspec.ValidationError(f"Expected array of alerts, got {type(values).__name__}")
+    alerts = []
+    for value in values:
+        try:
+            alerts.append(msgspec.convert(value, StmAlert))
+        except msgspec.ValidationError as e:
+            logger.warning(f"[ALERTS] Skipping malformed STM alert: {e}")
+    return alerts
+
+
+def convert(value, model):
+    """Typed copy of a parsed JSON value (e.g. a "result" entry of the alerts document)."""
+    return msgspec.convert(value, model)
+
+
+# ─── API payloads (output) ────────────────────────────────────
+class Bus(msgspec.Struct):
+    route_id: str
+    trip_id: str
+    stop_id: str
+    arrival_time: Union[int, str]        # minutes, or a display string ("Annulé", "08:15 PM")
+    occupancy: str = "Unknown"
+    direction: str = ""
+    location: str = ""
+    delayed_text: Optional[str] = None
+    early_text: Optional[str] = None
+    at_stop: bool = False
+    wheelchair_accessible: bool = False
+    cancelled: bool = False
+    service_status: str = "normal"       # normal / cancelled / scheduled
+    held_over: bool = False
+    propagated: bool = False             # predicted from a delay reported upstream in the trip
+    chained: bool = False                # not started yet, predicted from the vehicle's previous trip
+    predicted_arrival: Optional[int] = None
+    scheduled_arrival: Optional[int] = None
+    feed_timestamp: Optional[int] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    current_status: Optional[int] = None
+    shape_id: Optional[str] = None       # /api/shapes/<shape_id> for the route's polyline
+    progress: Optional[int] = None       # metres along the shape
+    distance_remaining: Optional[int] = None   # metres along the shape to stop_id
+
+
+class Departure(msgspec.Struct):
+    """Next call of a trip at an arbitrary stop (/api/stops/<stop_id>/departures)."""
+    route_id: str
+    trip_id: str
+    headsign: str = ""
+    arrival_time: Union[int, str] = 0    # minutes, or "Annulé"
+    service_status: str = "scheduled"    # normal / cancelled / scheduled
+    propagated: bool = False
+    chained: bool = False
+    wheelchair_accessible: bool = False
+    predicted_arrival: Optional[int] = None
+    scheduled_arrival: Optional[int] = None
+
+
+class StopBoard(msgspec.Struct):
+    stop_id: str
+    stop_name: str = ""
+    departures: List[Departure] = []
+    feed_timestamp: Optional[int] = None
+    server_time: Optional[float] = None
+
+
+class NearbyStop(msgspec.Struct):
+    stop_id: str
+    stop_name: str
+    lat: float
+    lon: float
+    distance: int                        # metres from the queried point
+    departures: List[Departure] = []
+
+
+class NearbyStops(msgspec.Struct):
+    """/api/stops/nearby: stops within a radius, closest first."""
+    lat: float
+    lon: float
+    radius: int
+    stops: List[NearbyStop] = []
+    feed_timestamp: Optional[int] = None
+    server_time: Optional[float] = None
+
+
+class Shape(msgspec.Struct):
+    """/api/shapes/<shape_id>: a route's geometry as [[lat, lon], ...]."""
+    shape_id: str
+    length: float                        # metres
+    simplified: bool = True
+    points: List[Tuple[float, float]] = []
+
+
+class Alert(msgspec.Struct):
+    """STM alert relevant to our stops (process_stm_alerts)."""
+    header: str
+    description: str
+    routes: List[str] = []
+    stops: List[str] = []
+    is_network_wide: bool = False
+    alert_type: str = "info"
+    severity: str = "info"
+    effect: Optional[str] = None
+
+
+class BannerAlert(msgspec.Struct):
+    """Alert as shown in the display banner (/api/alerts)."""
+    header: str
+    description: str
+    routes: str = "N/A"
+    stop: str = "N/A"
+    alert_type: str = "info"
+    severity: str = "info"
+
+
+class MetroLine(msgspec.Struct):
+    name: str
+    color: str
+    status: str = "Service normal"
+    statusColor: str = "text-green-400"
+    icon: str = ""
+    is_normal: bool = True
+    alert_description: Optional[str] = None
+
+
+class Weather(msgspec.Struct):
+    icon: str = ""
+    text: str = ""
+    temp: Union[int, str] = ""
+
+
+class ApiData(msgspec.Struct, omit_defaults=True):
+    """/api/data envelope; sections that were not requested are left out."""
+    buses: Optional[List[Bus]] = None
+    metro_lines: Optional[List[MetroLine]] = None
+    alerts: Optional[List[BannerAlert]] = None
+    weather: Optional[Weather] = None
+    debug: Optional[Dict[str, Any]] = None
+    server_time: Optional[float] = None
+
+
+def encode(value):
+    """JSON bytes of a model, a list of models or plain JSON values."""
+    return msgspec.json.encode(value)
+
+
+def to_builtins(value):
+    """Plain dicts / lists of a model (for code that still wants dicts)."""
+    return msgspec.to_builtins(value)
@@ -0,0 +1,160 @@
+"""
+Fast GTFS-Realtime decoding.
+
+FeedMessage.ParseFromString materializes every entity of the network-wide
+STM feed, while we only look at a handful of routes. parse_feed() walks the
+protobuf wire format of the FeedMessage just far enough to split it into
+entity byte ranges, keeps the entities that can belong to one of the wanted
+routes, and decodes only those with FeedEntity.FromString (run by the upb /
+C++ backend when protobuf has one, see backend()).
+
+The route pre-filter works on the encoded bytes: route_id is field 5 of
+TripDescriptor, so an entity for route "61" always contains the bytes
+0x2A 0x02 "61". All occurrences are found with bytes.find (in C) and matched
+to entity ranges. This never drops a matching entity but can keep one that
+merely contains the same bytes elsewhere, so callers still check route_id
+on the decoded entities.
+"""
+from bisect import bisect_left
+
+from google.protobuf.internal import api_implementation
+from google.transit import gtfs_realtime_pb2
+
+HEADER_FIELD = 1          # FeedMessage.header
+ENTITY_FIELD = 2          # FeedMessage.entity
+ENTITY_TAG = 0x12         # field 2, length-delimited
+ROUTE_ID_TAG = b"\x2a"    # TripDescriptor.route_id: field 5, length-delimited
+
+WIRE_VARINT, WIRE_FIXED64, WIRE_LENGTH, WIRE_FIXED32 = 0, 1, 2, 5
+
+
+def backend():
+    """Name of the protobuf implementation in use: "upb", "cpp" or "python"."""
+    return api_implementation.Type()
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _encode_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def split_feed(content):
+    """
+    Wire-level split of a serialized FeedMessage.
+    Returns ((start, end) of the header or None, [(start, end) per entity]).
+    """
+    header = None
+    entities = []
+    append = entities.append
+    pos = 0
+    end = len(content)
+    while pos < end:
+        # Fast path: entity tag followed by a one or two byte length
+        if content[pos] == ENTITY_TAG:
+            length = content[pos + 1]
+            if length < 0x80:
+                pos += 2
+            else:
+                second = content[pos + 2]
+                if second < 0x80:
+                    length = (length & 0x7F) | (second << 7)
+                    pos += 3
+                else:
+                    length, pos = _read_varint(content, pos + 1)
+            append((pos, pos + length))
+            pos += length
+            continue
+        key, pos = _read_varint(content, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == WIRE_LENGTH:
+            length, pos = _read_varint(content, pos)
+            if field == ENTITY_FIELD:
+                entities.append((pos, pos + length))
+            elif field == HEADER_FIELD:
+                header = (pos, pos + length)
+            pos += length
+        elif wire_type == WIRE_VARINT:
+            _, pos = _read_varint(content, pos)
+        elif wire_type == WIRE_FIXED64:
+            pos += 8
+        elif wire_type == WIRE_FIXED32:
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type} at offset {pos}")
+    if pos != end:
+        raise ValueError("Truncated GTFS-RT feed")
+    return header, entities
+
+
+def route_id_patterns(route_ids):
+    """Encoded TripDescriptor.route_id fields for the given route ids."""
+    patterns = []
+    for route_id in route_ids:
+        raw = str(route_id).encode("utf-8")
+        patterns.append(ROUTE_ID_TAG + _encode_varint(len(raw)) + raw)
+    return patterns
+
+
+def _pattern_offsets(content, patterns):
+    offsets = []
+    for pattern in patterns:
+        pos = content.find(pattern)
+        while pos != -1:
+            offsets.append(pos)
+            pos = content.find(pattern, pos + 1)
+    offsets.sort()
+    return offsets
+
+
+def parse_feed(content, route_ids=None):
+    """
+    (FeedHeader, [FeedEntity]) of a serialized FeedMessage. With route_ids,
+    only entities that may belong to one of those routes are decoded.
+    """
+    if route_ids is None:
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(content)
+        return feed.header, list(feed.entity)
+
+    content = bytes(content)
+    header_range, entity_ranges = split_feed(content)
+    header = gtfs_realtime_pb2.FeedHeader()
+    if header_range:
+        header.ParseFromString(content[header_range[0]:header_range[1]])
+
+    offsets = _pattern_offsets(content, route_id_patterns(route_ids))
+    if not offsets:
+        return header, []
+
+    decode = gtfs_realtime_pb2.FeedEntity.FromString
+    entities = []
+    starts = [start for start, _ in entity_ranges]
+    seen = -1
+    for offset in offsets:
+        i = bisect_left(starts, offset + 1) - 1
+        if i <= seen or i < 0:
+            continue
+        start, stop = entity_ranges[i]
+        if offset < stop:
+            entities.append(decode(content[start:stop]))
+            seen = i
+    return header, entities
@@ -0,0 +1,177 @@
+"""
+Per-trip arrival prediction state.
+
+    prediction_tracker.observe_feed(feed_timestamp, entities)
+    arrival = prediction_tracker.smoothed_arrival(trip_id, stop_id, raw_arrival)
+    arrival = prediction_tracker.smoothed_arrival(trip_id, stop_id, derived_arrival, route_id)
+
+The STM feed recomputes every prediction from scratch, so a countdown
+computed straight from it jumps between polls, and a trip that misses one
+feed disappears from the board. The tracker keeps, for each trip at each
+watched stop (BUS_ROUTE_COMBOS), an exponentially smoothed arrival time:
+
+* it is updated once per feed generation (header timestamp), however many
+  boards or requests read it. Predictions the feed lists are folded in by
+  observe_feed(); derived ones (delay propagated along the trip or chained
+  from the block) by smoothed_arrival() given the route, into the same
+  state, so a stop does not jump when its source changes;
+* a jump larger than RESET_JUMP resets the smoothing (real reroute or a
+  fresh prediction rather than noise);
+* a trip missing from the latest feed is held over for PREDICTION_HOLDOVER
+  seconds with its last smoothed arrival, then expired; a trip still in
+  the feed that no longer lists the stop is never held over (it has passed
+  the stop, or only has derived predictions);
+* the number of tracked predictions is capped (least recently seen dropped).
+"""
+import threading
+from collections import OrderedDict
+
+from backend.config import BUS_ROUTE_COMBOS, PREDICTION_SMOOTHING, PREDICTION_HOLDOVER
+
+RESET_JUMP = 10 * 60     # seconds; bigger changes replace the smoothed value
+PASSED_GRACE = 60        # seconds after the smoothed arrival before a held trip expires
+MAX_TRACKED = 2048
+
+
+class _Prediction:
+    __slots__ = ("route_id", "smoothed", "previous", "raw", "last_seen", "listed")
+
+    def __init__(self, route_id, arrival, feed_ts, listed=True):
+        self.route_id = route_id
+        self.smoothed = float(arrival)
+        self.previous = self.smoothed    # smoothed value before feed_ts's sample
+        self.raw = arrival
+        self.last_seen = feed_ts
+        self.listed = listed             # the stop is in the trip's update of the latest feed
+
+    def fold(self, arrival, feed_ts, alpha):
+        """Set feed_ts's sample (the last one wins when a generation gives several)."""
+        if feed_ts != self.last_seen:
+            self.previous = self.smoothed
+            self.last_seen = feed_ts
+        if abs(arrival - self.previous) > RESET_JUMP:
+            self.smoothed = self.previous = float(arrival)
+        else:
+            self.smoothed = alpha * arrival + (1 - alpha) * self.previous
+        self.raw = arrival
+
+
+class PredictionTracker:
+    def __init__(self, alpha=PREDICTION_SMOOTHING, holdover=PREDICTION_HOLDOVER,
+                 watched=BUS_ROUTE_COMBOS, max_tracked=MAX_TRACKED):
+        self.alpha = alpha
+        self.holdover = holdover
+        self.max_tracked = max_tracked
+        self.watched_stops = {(route, stop) for route, stop, _ in watched}
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._states = OrderedDict()   # (trip_id, stop_id) -> _Prediction
+        self._current_trips = frozenset()   # trip_ids with a trip update in the latest feed
+
+    def observe_feed(self, feed_ts, entities):
+        """Fold one trip-updates feed into the state; older or repeated feeds are ignored."""
+        with self._lock:
+            if not feed_ts or feed_ts <= self.generation:
+                return False
+            self.generation = feed_ts
+            alpha = self.alpha
+            seen = set()
+            trips = set()
+
+            for entity in entities:
+                if not entity.HasField("trip_update"):
+                    continue
+                trip = entity.trip_update.trip
+                route_id, trip_id = trip.route_id, trip.trip_id
+                trips.add(trip_id)
+                for stop_time in entity.trip_update.stop_time_update:
+                    stop_id = stop_time.stop_id
+                    if (route_id, stop_id) not in self.watched_stops:
+                        continue
+                    key = (trip_id, stop_id)
+                    if stop_time.schedule_relationship == 1:  # SKIPPED
+                        self._states.pop(key, None)
+                        continue
+                    arrival = stop_time.arrival.time if stop_time.HasField("arrival") else None
+                    if not arrival:
+                        continue
+                    state = self._states.get(key)
+                    if state is None:
+                        self._states[key] = _Prediction(route_id, arrival, feed_ts)
+                    else:
+                        state.fold(arrival, feed_ts, alpha)
+                        state.listed = True
+                        self._states.move_to_end(key)
+                    seen.add(key)
+
+            # A trip still in the feed without the stop is not held over (it
+            # has passed the stop, or its arrival there is derived); its state
+            # stays for the derived predictions until it ages out
+            expired = []
+            for key, state in self._states.items():
+                if key in seen:
+                    continue
+                if feed_ts - state.last_seen > self.holdover or state.smoothed < feed_ts - PASSED_GRACE:
+                    expired.append(key)
+                elif key[0] in trips:
+                    state.listed = False
+            for key in expired:
+                del self._states[key]
+            while len(self._states) > self.max_tracked:
+                self._states.popitem(last=False)
+            self._current_trips = frozenset(trips)
+            return True
+
+    def smoothed_arrival(self, trip_id, stop_id, raw_arrival, route_id=None):
+        """
+        Smoothed arrival for a prediction of the latest feed; raw_arrival if not
+        tracked. With route_id, raw_arrival is a derived prediction (not in the
+        feed) and is folded in as the latest generation's sample.
+        """
+        key = (trip_id, stop_id)
+        with self._lock:
+            state = self._states.get(key)
+            if route_id is None:
+                if state is None or state.raw != raw_arrival:
+                    return raw_arrival
+                return state.smoothed
+            if state is None:
+                state = self._states[key] = _Prediction(route_id, raw_arrival, self.generation, listed=False)
+            elif state.raw != raw_arrival or state.last_seen != self.generation:
+                state.fold(raw_arrival, self.generation, self.alpha)
+                self._states.move_to_end(key)
+            while len(self._states) > self.max_tracked:
+                self._states.popitem(last=False)
+            return state.smoothed
+
+    def held(self, route_id, stop_id):
+        """[(trip_id, smoothed arrival)] of trips missing from the latest feed but still held over."""
+        with self._lock:
+            return [
+                (trip_id, state.smoothed)
+                for (trip_id, stop), state in self._states.items()
+                if stop == stop_id and state.route_id == route_id and state.listed
+                and trip_id not in self._current_trips
+            ]
+
+    def __len__(self):
+        return len(self._states)
+
+
+_tracker = PredictionTracker()
+
+
+def get_tracker():
+    return _tracker
+
+
+def observe_feed(feed_ts, entities):
+    return _tracker.observe_feed(feed_ts, entities)
+
+
+def smoothed_arrival(trip_id, stop_id, raw_arrival, route_id=None):
+    return _tracker.smoothed_arrival(trip_id, stop_id, raw_arrival, route_id)
+
+
+def held(route_id, stop_id):
+    return _tracker.held(route_id, stop_id)
@@ -0,0 +1,129 @@
+"""
+On-demand statistical profiler.
+
+Samples the stack of every thread (all Waitress workers included) with
+sys._current_frames() at a fixed interval for a bounded duration. Nothing
+is installed in the interpreter (no settrace / setprofile), so request
+threads run at full speed; the cost is one short walk of each stack per
+sample on the sampler thread.
+
+The result is a collapsed-stack file, one "thread;frame;frame;... count"
+line per distinct stack (the input format of flamegraph.pl / speedscope),
+plus a top-N summary of the hottest functions.
+"""
+import os
+import sys
+import time
+import threading
+
+MAX_DURATION = 60.0       # seconds
+MIN_INTERVAL = 0.001      # seconds
+DEFAULT_INTERVAL = 0.005
+MAX_STACK_DEPTH = 128
+
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is already running."""
+
+
+def _frame_label(code):
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _walk(frame):
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        stack.append(frame.f_code)
+        frame = frame.f_back
+    stack.reverse()  # root first
+    return stack
+
+
+def sample_threads(duration, interval=DEFAULT_INTERVAL):
+    """Sample all threads but the caller; returns ({(thread, code, ...): count}, n_samples, elapsed)."""
+    duration = min(max(duration, interval), MAX_DURATION)
+    interval = max(interval, MIN_INTERVAL)
+    own_id = threading.get_ident()
+    stacks = {}
+    samples = 0
+
+    started = time.perf_counter()
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            key = (names.get(thread_id, str(thread_id)),) + tuple(_walk(frame))
+            stacks[key] = stacks.get(key, 0) + 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples, time.perf_counter() - started
+
+
+def _is_idle(stack):
+    """Threads parked in a wait/select are not interesting for 'where does CPU go'."""
+    if len(stack) < 2:
+        return True
+    leaf = stack[-1]
+    return leaf.co_name in {"wait", "select", "poll", "accept", "_wait_for_tstate_lock", "sleep", "get"} \
+        and os.path.basename(leaf.co_filename) in {"threading.py", "selectors.py", "socket.py",
+                                                   "queue.py", "task.py", "channel.py", "wasyncore.py"}
+
+
+def collapse(stacks, include_idle=False):
+    lines = []
+    for key, count in sorted(stacks.items(), key=lambda kv: -kv[1]):
+        thread, frames = key[0], key[1:]
+        if not include_idle and _is_idle(key):
+            continue
+        path = ";".join([thread.replace(" ", "_")] + [_frame_label(code) for code in frames])
+        lines.append(f"{path} {count}")
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+def top_functions(stacks, n=25, include_idle=False):
+    """Hottest functions by self (leaf) and total (on-stack) samples."""
+    self_counts, total_counts = {}, {}
+    considered = 0
+    for key, count in stacks.items():
+        if not include_idle and _is_idle(key):
+            continue
+        frames = key[1:]
+        if not frames:
+            continue
+        considered += count
+        leaf = _frame_label(frames[-1])
+        self_counts[leaf] = self_counts.get(leaf, 0) + count
+        for label in {_frame_label(code) for code in frames}:
+            total_counts[label] = total_counts.get(label, 0) + count
+
+    ranked = sorted(total_counts, key=lambda f: (-self_counts.get(f, 0), -total_counts[f]))[:n]
+    return [{
+        "function": f,
+        "self_samples": self_counts.get(f, 0),
+        "self_pct": round(100.0 * self_counts.get(f, 0) / considered, 2) if considered else 0.0,
+        "total_samples": total_counts[f],
+        "total_pct": round(100.0 * total_counts[f] / considered, 2) if considered else 0.0,
+    } for f in ranked]
+
+
+def run_profile(duration=10.0, interval=DEFAULT_INTERVAL, top=25, include_idle=False):
+    """Run one profile; only one may run at a time (raises ProfilerBusy)."""
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        stacks, samples, elapsed = sample_threads(duration, interval)
+    finally:
+        _profile_lock.release()
+    return {
+        "duration_s": round(elapsed, 3),
+        "interval_ms": round(max(interval, MIN_INTERVAL) * 1000, 2),
+        "samples": samples,
+        "threads": len({key[0] for key in stacks}),
+        "collapsed": collapse(stacks, include_idle),
+        "top": top_functions(stacks, top, include_idle),
+    }
@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for GTFS loading, feed processing and the /api/data path.
+
+`run` generates a synthetic STM-scale GTFS feed and recorded realtime
+fixtures (or uses the ones given with --gtfs-dir / --fixtures), replays them
+through the backend with FEED_SOURCE=replay, and writes timings plus peak
+memory (tracemalloc) for each case as JSON. `compare` diffs two result
+files and exits non-zero when a case regressed beyond the threshold.
+
+Usage:
+    python -m backend.scripts.benchmark run --scale 0.05 --output base.json
+    python -m backend.scripts.benchmark run --scale 0.05 --output head.json
+    python -m backend.scripts.benchmark compare base.json head.json --threshold 0.10
+"""
+import io
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+import contextlib
+
+BENCHMARKS = []
+
+
+def benchmark(name, setup=None, items=None):
+    """
+    Register fn(ctx) as a benchmark case; setup(ctx) runs before every
+    repetition, untimed. items(ctx) is the number of items one run handles,
+    reported as items_per_s.
+    """
+    def register(fn):
+        BENCHMARKS.append((name, setup, items, fn))
+        return fn
+    return register
+
+
+def _measure(fn, ctx, setup, repeat, items=None):
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup(ctx)
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            fn(ctx)
+            times.append(time.perf_counter() - started)
+
+    # Peak memory is taken from a separate run so tracemalloc overhead
+    # does not inflate the timings.
+    if setup:
+        setup(ctx)
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = fn(ctx)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    result = {
+        "runs": repeat,
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "mean_s": statistics.fmean(times),
+        "peak_mem_kb": round(peak / 1024, 1),
+    }
+    if items is not None:
+        result["items"] = items(ctx)
+        result["items_per_s"] = round(result["items"] / result["median_s"], 1)
+    return result
+
+
+# ====================================================================
+# Environment preparation
+# ====================================================================
+def prepare_environment(args, workdir):
+    """Create fixtures and point the backend config at them. Must run before importing backend modules."""
+    gtfs_dir = args.gtfs_dir or os.path.join(workdir, "gtfs")
+    fixtures = args.fixtures or os.path.join(workdir, "realtime")
+
+    # backend.config reads these at import time, so set them first.
+    os.environ["FEED_SOURCE"] = "replay"
+    os.environ["REPLAY_DIR"] = fixtures
+    os.environ["REPLAY_SPEED"] = "0"
+    os.environ["GTFS_STM_DIR"] = gtfs_dir
+
+    from backend.scripts import synthetic
+    from backend.scripts import mock_upstream
+
+    counts = None
+    if not args.gtfs_dir:
+        print(f"Generating synthetic GTFS (scale={args.scale}) in {gtfs_dir}...")
+        counts = synthetic.write_gtfs(gtfs_dir, scale=args.scale, seed=args.seed)
+        print(f"  {counts}")
+    if not args.fixtures:
+        print(f"Generating realtime fixtures ({args.feed_trips} trips per feed) in {fixtures}...")
+        synthetic.write_realtime_fixtures(
+            fixtures, n_feeds=max(args.repeat + 2, 3), n_trips=args.feed_trips, seed=args.seed,
+            trip_ids_by_route=mock_upstream.load_trip_ids_by_route(gtfs_dir))
+    return gtfs_dir, fixtures, counts
+
+
+def build_context(gtfs_dir, feed_trips=1500, seed=0):
+    from backend.loaders import stm
+    from backend.scripts import synthetic
+    from backend.scripts import mock_upstream
+
+    ctx = {"gtfs_dir": gtfs_dir, "stm": stm}
+    ctx["routes_fp"] = os.path.join(gtfs_dir, "routes.txt")
+    ctx["trips_fp"] = os.path.join(gtfs_dir, "trips.txt")
+    ctx["stop_times_fp"] = os.path.join(gtfs_dir, "stop_times.txt")
+    ctx["routes_map"] = stm.load_stm_routes(ctx["routes_fp"])
+    ctx["stm_trips"] = stm.load_stm_gtfs_trips(ctx["trips_fp"], ctx["routes_map"])
+    ctx["stm_stop_times"] = stm.load_stm_stop_times(ctx["stop_times_fp"])
+    # Feed trips are GTFS trips, so the cases below validate and look them up
+    trip_ids_by_route = mock_upstream.load_trip_ids_by_route(gtfs_dir)
+    ctx["trip_updates_pb"] = synthetic.build_trip_updates(
+        n_trips=feed_trips, seed=seed, trip_ids_by_route=trip_ids_by_route)
+    ctx["vehicle_positions_pb"] = synthetic.build_vehicle_positions(
+        n_trips=feed_trips, seed=seed, trip_ids_by_route=trip_ids_by_route)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ctx["trip_entities"] = stm.fetch_stm_realtime_data()
+        ctx["positions"] = stm.fetch_stm_positions_dict(stm.BUS_ROUTES, ctx["stm_trips"], ctx["routes_map"])
+        buses = stm.process_stm_trip_updates(
+            ctx["trip_entities"], ctx["stm_trips"], ctx["stm_stop_times"], ctx["positions"])
+
+    # Otherwise the position, propagation, blocks and occupancy cases time no-ops
+    assert ctx["positions"], "no vehicle position matches the GTFS trips"
+    assert any(bus.trip_id != "N/A" for bus in buses), "no realtime bus on the watched stops"
+    return ctx
+
+
+def _expire_alerts_cache(ctx):
+    ctx["stm"]._alerts_cache.invalidate()
+
+
+# ====================================================================
+# Benchmark cases
+# ====================================================================
+@benchmark("load_stm_routes")
+def bench_load_routes(ctx):
+    return ctx["stm"].load_stm_routes(ctx["routes_fp"])
+
+
+@benchmark("load_stm_gtfs_trips")
+def bench_load_trips(ctx):
+    return ctx["stm"].load_stm_gtfs_trips(ctx["trips_fp"], ctx["routes_map"])
+
+
+@benchmark("load_stm_stop_times")
+def bench_load_stop_times(ctx):
+    return ctx["stm"].load_stm_stop_times(ctx["stop_times_fp"])
+
+
+def _gtfs_zip(ctx):
+    """The benchmark GTFS as a zip (deflated, tables in a folder like STM's), built once."""
+    if "gtfs_zip" not in ctx:
+        import atexit
+        import zipfile
+        fd, path = tempfile.mkstemp(prefix="etsflux-bench-", suffix=".zip")
+        os.close(fd)
+        atexit.register(os.remove, path)
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name in ("routes.txt", "trips.txt", "stop_times.txt"):
+                archive.write(os.path.join(ctx["gtfs_dir"], name), f"gtfs_stm/{name}")
+        ctx["gtfs_zip"] = path
+
+
+@benchmark("load_stm_stop_times_zip", setup=_gtfs_zip)
+def bench_load_stop_times_zip(ctx):
+    return ctx["stm"].load_stm_stop_times(ctx["gtfs_zip"])
+
+
+@benchmark("gtfs_dataset_first_trip_lookup")
+def bench_dataset_first_lookup(ctx):
+    # Cold dataset: only routes.txt and trips.txt are read, stop_times.txt is not
+    from backend.loaders.gtfs_dataset import GtfsDataset
+    dataset = GtfsDataset(ctx["gtfs_dir"])
+    return dataset.trips.get(next(iter(ctx["stm_trips"]), ""))
+
+
+@benchmark("fetch_stm_positions_dict")
+def bench_positions(ctx):
+    stm = ctx["stm"]
+    return stm.fetch_stm_positions_dict(stm.BUS_ROUTES, ctx["stm_trips"], ctx["routes_map"])
+
+
+def _shapes(ctx):
+    if "shapes" not in ctx:
+        from backend.loaders.shapes import ShapeIndex
+        from backend.loaders.gtfs_dataset import get_dataset
+        ctx["shapes"] = ShapeIndex.from_source(ctx["gtfs_dir"])
+        ctx["stops"] = get_dataset().stops
+
+
+@benchmark("build_shapes")
+def bench_build_shapes(ctx):
+    from backend.loaders.shapes import ShapeIndex
+    return ShapeIndex.from_source(ctx["gtfs_dir"])
+
+
+@benchmark("fetch_stm_positions_dict_shapes", setup=_shapes)
+def bench_positions_shapes(ctx):
+    stm = ctx["stm"]
+    return stm.fetch_stm_positions_dict(stm.BUS_ROUTES, ctx["stm_trips"], ctx["routes_map"],
+                                        shapes=ctx["shapes"], stops=ctx["stops"])
+
+
+@benchmark("process_stm_trip_updates")
+def bench_trip_updates(ctx):
+    return ctx["stm"].process_stm_trip_updates(
+        ctx["trip_entities"], ctx["stm_trips"], ctx["stm_stop_times"], ctx["positions"])
+
+
+def _trip_stops(ctx):
+    if "trip_stops" not in ctx:
+        from backend.loaders.trip_stops import TripStops
+        ctx["trip_stops"] = TripStops.from_source(ctx["stop_times_fp"])
+
+
+@benchmark("build_trip_stops")
+def bench_build_trip_stops(ctx):
+    from backend.loaders.trip_stops import TripStops
+    return TripStops.from_source(ctx["stop_times_fp"])
+
+
+@benchmark("process_stm_trip_updates_propagated", setup=_trip_stops)
+def bench_trip_updates_propagated(ctx):
+    return ctx["stm"].process_stm_trip_updates(
+        ctx["trip_entities"], ctx["stm_trips"], ctx["stm_stop_times"], ctx["positions"],
+        trip_stops=ctx["trip_stops"])
+
+
+def _blocks(ctx):
+    _trip_stops(ctx)
+    if "blocks" not in ctx:
+        from backend.loaders.blocks import BlockIndex
+        ctx["blocks"] = BlockIndex.from_source(ctx["trips_fp"], ctx["trip_stops"])
+
+
+@benchmark("process_stm_trip_updates_blocks", setup=_blocks)
+def bench_trip_updates_blocks(ctx):
+    return ctx["stm"].process_stm_trip_updates(
+        ctx["trip_entities"], ctx["stm_trips"], ctx["stm_stop_times"], ctx["positions"],
+        trip_stops=ctx["trip_stops"], blocks=ctx["blocks"])
+
+
+@benchmark("build_stop_departures", setup=_trip_stops)
+def bench_build_stop_departures(ctx):
+    from backend.loaders.trip_stops import StopDepartures
+    return StopDepartures.from_trip_stops(ctx["trip_stops"])
+
+
+def _departure_board(ctx):
+    from backend.loaders.gtfs_dataset import get_dataset
+    gtfs = ctx["gtfs"] = get_dataset()
+    # Busiest stop of the timetable, at the feed's time
+    sd = gtfs.stop_departures
+    ctx["board_stop"] = max(gtfs.trip_stops.stop_ids, key=lambda stop: len(list(sd.between(stop, 0, 1 << 18))))
+    ctx["board_now"] = ctx["stm"].feed_timestamp("trip_updates")
+
+
+@benchmark("stop_departures_board", setup=_departure_board)
+def bench_stop_departures_board(ctx):
+    from backend import departures
+    return departures.for_stop(ctx["gtfs"], ctx["board_stop"], limit=10, now=ctx["board_now"])
+
+
+def _nearby_points(ctx):
+    if "nearby_points" in ctx:
+        return
+    import random
+    from backend.loaders.gtfs_dataset import get_dataset
+    gtfs = ctx["gtfs"] = get_dataset()
+    gtfs.stop_grid
+    rng = random.Random(0)
+    stops = list(gtfs.stops.values())
+    # Points a short walk away from random stops
+    ctx["nearby_points"] = [(lat + rng.uniform(-0.002, 0.002), lon + rng.uniform(-0.003, 0.003))
+                            for _, lat, lon in rng.sample(stops, min(200, len(stops)))]
+
+
+@benchmark("stop_grid_nearby", setup=_nearby_points, items=lambda ctx: len(ctx["nearby_points"]))
+def bench_stop_grid_nearby(ctx):
+    grid = ctx["gtfs"].stop_grid
+    return [grid.nearby(lat, lon, 400, 5) for lat, lon in ctx["nearby_points"]]
+
+
+def _feed_entity_count(key):
+    def count(ctx):
+        from backend.parsers import gtfs_rt_fast
+        return len(gtfs_rt_fast.split_feed(ctx[key])[1])
+    return count
+
+
+# GTFS-RT decoding: whole feed vs. the wire-level route pre-filter.
+# items_per_s is feed entities handled per second.
+@benchmark("decode_trip_updates_full", items=_feed_entity_count("trip_updates_pb"))
+def bench_decode_trip_updates_full(ctx):
+    from backend.parsers import gtfs_rt_fast
+    return gtfs_rt_fast.parse_feed(ctx["trip_updates_pb"])
+
+
+@benchmark("decode_trip_updates_fast", items=_feed_entity_count("trip_updates_pb"))
+def bench_decode_trip_updates_fast(ctx):
+    from backend.parsers import gtfs_rt_fast
+    return gtfs_rt_fast.parse_feed(ctx["trip_updates_pb"], ctx["stm"].BUS_ROUTES)
+
+
+@benchmark("decode_vehicle_positions_full", items=_feed_entity_count("vehicle_positions_pb"))
+def bench_decode_positions_full(ctx):
+    from backend.parsers import gtfs_rt_fast
+    return gtfs_rt_fast.parse_feed(ctx["vehicle_positions_pb"])
+
+
+@benchmark("decode_vehicle_positions_fast", items=_feed_entity_count("vehicle_positions_pb"))
+def bench_decode_positions_fast(ctx):
+    from backend.parsers import gtfs_rt_fast
+    return gtfs_rt_fast.parse_feed(ctx["vehicle_positions_pb"], ctx["stm"].BUS_ROUTES)
+
+
+@benchmark("process_stm_alerts", setup=_expire_alerts_cache)
+def bench_stm_alerts(ctx):
+    from backend.alerts import process_stm_alerts
+    return process_stm_alerts()
+
+
+@benchmark("process_metro_alerts", setup=_expire_alerts_cache)
+def bench_metro_alerts(ctx):
+    from backend import main
+    return main.process_metro_alerts()
+
+
+# API payload encoding and STM alerts decoding: stdlib json on plain dicts
+# vs. msgspec on the typed models (backend/models.py).
+# items_per_s is buses + metro lines + alerts (encode) or alerts (decode).
+def _api_payload(ctx):
+    if "api_payload" not in ctx:
+        from backend import main, models
+        with contextlib.redirect_stdout(io.StringIO()):
+            payload = models.ApiData(**main.section_payload(main.PUBLIC_SECTIONS, with_debug=True))
+        ctx["api_payload"] = payload
+        ctx["api_payload_dicts"] = models.to_builtins(payload)
+
+
+def _api_payload_items(ctx):
+    payload = ctx["api_payload"]
+    return len(payload.buses) + len(payload.metro_lines) + len(payload.alerts)
+
+
+def _alerts_document(ctx):
+    if "alerts_json" not in ctx:
+        from backend.scripts import synthetic
+        ctx["alerts_json"] = json.dumps(synthetic.build_alerts(n_alerts=500, seed=0)).encode("utf-8")
+
+
+def _alerts_count(ctx):
+    return len(json.loads(ctx["alerts_json"])["alerts"])
+
+
+@benchmark("encode_api_data_json", setup=_api_payload, items=_api_payload_items)
+def bench_encode_json(ctx):
+    return json.dumps(ctx["api_payload_dicts"]).encode("utf-8")
+
+
+@benchmark("encode_api_data_msgspec", setup=_api_payload, items=_api_payload_items)
+def bench_encode_msgspec(ctx):
+    from backend import models
+    return models.encode(ctx["api_payload"])
+
+
+@benchmark("decode_stm_alerts_json", setup=_alerts_document, items=_alerts_count)
+def bench_decode_alerts_json(ctx):
+    return json.loads(ctx["alerts_json"])["alerts"]
+
+
+@benchmark("decode_stm_alerts_msgspec", setup=_alerts_document, items=_alerts_count)
+def bench_decode_alerts_msgspec(ctx):
+    return ctx["stm"]._parse_stm_alerts(ctx["alerts_json"])
+
+
+@benchmark("get_data", setup=_expire_alerts_cache)
+def bench_get_data(ctx):
+    from backend import main
+    client = ctx.setdefault("client", main.app.test_client())
+    resp = client.get("/api/data")
+    assert resp.status_code == 200, resp.status_code
+    return resp.data
+
+
+def run(args):
+    workdir_holder = None
+    if args.workdir:
+        workdir = args.workdir
+        os.makedirs(workdir, exist_ok=True)
+    else:
+        workdir_holder = tempfile.TemporaryDirectory(prefix="etsflux-bench-")
+        workdir = workdir_holder.name
+
+    try:
+        gtfs_dir, fixtures, counts = prepare_environment(args, workdir)
+        logging.getLogger('BdeB-GTFS').setLevel(logging.WARNING)
+        ctx = build_context(gtfs_dir, args.feed_trips, args.seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            from backend import main
+            if main.gtfs is not None:
+                # Tables load on first use: have them ready before timing the API
+                main.gtfs.preload(["routes", "trips", "stop_times", "trip_stops", "blocks", "stop_departures",
+                                   "stop_grid", "calendar", "calendar_dates"])
+
+        results = {}
+        for name, setup, items, fn in BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            results[name] = _measure(fn, ctx, setup, args.repeat, items)
+            r = results[name]
+            rate = f"   {r['items_per_s']:12,.0f} /s" if "items_per_s" in r else ""
+            print(f"{name:<30} median {r['median_s'] * 1000:9.2f} ms   "
+                  f"min {r['min_s'] * 1000:9.2f} ms   peak {r['peak_mem_kb']:10.1f} KB{rate}")
+    finally:
+        if workdir_holder:
+            workdir_holder.cleanup()
+
+    report = {
+        "meta": {
+            "timestamp": int(time.time()),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "scale": args.scale if not args.gtfs_dir else None,
+            "gtfs_dir": args.gtfs_dir,
+            "fixtures": args.fixtures,
+            "feed_trips": args.feed_trips,
+            "repeat": args.repeat,
+            "gtfs_rows": counts,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return report
+
+
+def compare(args):
+    with open(args.baseline, encoding="utf-8") as f:
+        base = json.load(f)["results"]
+    with open(args.current, encoding="utf-8") as f:
+        head = json.load(f)["results"]
+
+    regressions = []
+    print(f"{'case':<28} {'base ms':>10} {'head ms':>10} {'time':>8} {'base KB':>11} {'head KB':>11} {'mem':>8}")
+    for name in sorted(set(base) | set(head)):
+        if name not in base or name not in head:
+            print(f"{name:<28} only in {'baseline' if name in base else 'current'}")
+            continue
+        b, h = base[name], head[name]
+        time_ratio = h["median_s"] / b["median_s"] if b["median_s"] else 1.0
+        mem_ratio = h["peak_mem_kb"] / b["peak_mem_kb"] if b["peak_mem_kb"] else 1.0
+        flag = ""
+        if time_ratio > 1 + args.threshold or mem_ratio > 1 + args.threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<28} {b['median_s'] * 1000:10.2f} {h['median_s'] * 1000:10.2f} {time_ratio - 1:+8.1%} "
+              f"{b['peak_mem_kb']:11.1f} {h['peak_mem_kb']:11.1f} {mem_ratio - 1:+8.1%}{flag}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print("\nNo regressions.")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ETS Flux backend benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="run the benchmark suite")
+    p_run.add_argument("--scale", type=float, default=0.05, help="synthetic GTFS size, 1.0 = STM scale")
+    p_run.add_argument("--gtfs-dir", help="use an existing GTFS directory instead of synthetic data")
+    p_run.add_argument("--fixtures", help="replay directory or feed archive instead of synthetic feeds")
+    p_run.add_argument("--feed-trips", type=int, default=1500, help="trip updates per synthetic feed")
+    p_run.add_argument("--repeat", type=int, default=5)
+    p_run.add_argument("--seed", type=int, default=0)
+    p_run.add_argument("--only", nargs="*", help="run only these cases")
+    p_run.add_argument("--workdir", help="keep generated fixtures here instead of a temp dir")
+    p_run.add_argument("--output", "-o", help="write JSON results to this file")
+
+    p_cmp = sub.add_parser("compare", help="compare two result files")
+    p_cmp.add_argument("baseline")
+    p_cmp.add_argument("current")
+    p_cmp.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown / memory growth")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "run":
+        run(args)
+        return 0
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
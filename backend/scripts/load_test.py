@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Load generator for the transit API.
+
+Simulates N kiosks polling an endpoint and reports latency percentiles and
+throughput. With --interval 0 every kiosk polls in a closed loop (maximum
+throughput); otherwise each kiosk waits --interval seconds between polls,
+like the real display does.
+
+--compare runs the same load against a second URL afterwards, e.g. the
+Waitress server against the ASGI one (backend/asgi.py). --streams keeps N
+extra Server-Sent Events clients connected to /api/stream during the run.
+
+Usage:
+    python -m backend.scripts.load_test --url http://127.0.0.1:5000/api/data \\
+        --kiosks 50 --duration 60
+    python -m backend.scripts.load_test --url http://127.0.0.1:5000/api/data \\
+        --compare http://127.0.0.1:8000/api/data --kiosks 50 --duration 60
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_kiosk(url, deadline, interval, timeout, results, lock):
+    session = requests.Session()
+    latencies, errors = [], 0
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            resp = session.get(url, timeout=timeout)
+            resp.content  # make sure the body is fully read
+            if resp.status_code != 200:
+                errors += 1
+        except requests.exceptions.RequestException:
+            errors += 1
+        latencies.append(time.monotonic() - started)
+        if interval > 0:
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    with lock:
+        results["latencies"].extend(latencies)
+        results["errors"] += errors
+
+
+def run_stream_client(url, deadline, results, lock):
+    """Hold one /api/stream connection open until the deadline, counting events."""
+    events, errors = 0, 0
+    try:
+        with requests.get(url, stream=True, timeout=(10, max(1.0, deadline - time.monotonic()))) as resp:
+            if resp.status_code != 200:
+                errors += 1
+            else:
+                for line in resp.iter_lines():
+                    if line.startswith(b"event:"):
+                        events += 1
+                    if time.monotonic() >= deadline:
+                        break
+    except requests.exceptions.RequestException:
+        if time.monotonic() < deadline:
+            errors += 1
+    with lock:
+        results["stream_events"] += events
+        results["stream_errors"] += errors
+
+
+def stream_url(url):
+    """The /api/stream URL on the same server as url."""
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, "/api/stream", "", ""))
+
+
+def run_load(url, kiosks=10, duration=30, interval=0.0, timeout=30, warmup=1, streams=0):
+    """Run the load and return a summary dict (latencies in milliseconds)."""
+    for _ in range(warmup):
+        try:
+            requests.get(url, timeout=timeout)
+        except requests.exceptions.RequestException:
+            pass
+
+    results = {"latencies": [], "errors": 0, "stream_events": 0, "stream_errors": 0}
+    lock = threading.Lock()
+    started = time.monotonic()
+    deadline = started + duration
+    threads = [
+        threading.Thread(target=run_stream_client, args=(stream_url(url), deadline, results, lock), daemon=True)
+        for _ in range(streams)
+    ]
+    threads += [
+        threading.Thread(target=run_kiosk, args=(url, deadline, interval, timeout, results, lock), daemon=True)
+        for _ in range(kiosks)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+
+    latencies = sorted(l * 1000.0 for l in results["latencies"])
+    count = len(latencies)
+    return {
+        "url": url,
+        "kiosks": kiosks,
+        "duration_s": round(elapsed, 2),
+        "requests": count,
+        "errors": results["errors"],
+        "rps": round(count / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / count, 2) if count else None,
+        "p50_ms": round(percentile(latencies, 50), 2) if count else None,
+        "p95_ms": round(percentile(latencies, 95), 2) if count else None,
+        "p99_ms": round(percentile(latencies, 99), 2) if count else None,
+        "max_ms": round(latencies[-1], 2) if count else None,
+        "streams": streams,
+        "stream_events": results["stream_events"],
+        "stream_errors": results["stream_errors"],
+    }
+
+
+def print_summary(summary):
+    print(f"\n=== {summary['url']} ({summary['kiosks']} kiosks, {summary['duration_s']} s) ===")
+    print(f"requests: {summary['requests']}  errors: {summary['errors']}  rps: {summary['rps']}")
+    print(f"latency ms  mean={summary['mean_ms']}  p50={summary['p50_ms']}  "
+          f"p95={summary['p95_ms']}  p99={summary['p99_ms']}  max={summary['max_ms']}")
+    if summary["streams"]:
+        print(f"streams: {summary['streams']}  events: {summary['stream_events']}  "
+              f"errors: {summary['stream_errors']}")
+
+
+def print_comparison(base, other):
+    print(f"\n=== {base['url']} vs {other['url']} ===")
+    print(f"{'':<10} {'base':>10} {'other':>10} {'change':>9}")
+    for key in ("rps", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms", "errors"):
+        b, o = base[key], other[key]
+        change = f"{(o - b) / b:+9.1%}" if b and o is not None else f"{'n/a':>9}"
+        print(f"{key:<10} {b if b is not None else '-':>10} {o if o is not None else '-':>10} {change}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the transit API with N concurrent kiosks")
+    parser.add_argument("--url", default="http://127.0.0.1:5000/api/data")
+    parser.add_argument("--kiosks", type=int, default=10, help="concurrent polling clients")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--interval", type=float, default=0, help="seconds between polls per kiosk, 0 = closed loop")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--compare", metavar="URL", help="run the same load against this URL afterwards")
+    parser.add_argument("--streams", type=int, default=0, help="extra /api/stream clients held open during the run")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    summary = run_load(args.url, args.kiosks, args.duration, args.interval, args.timeout,
+                       streams=args.streams)
+    other = None
+    if args.compare:
+        other = run_load(args.compare, args.kiosks, args.duration, args.interval, args.timeout,
+                         streams=args.streams)
+    if args.json:
+        json.dump(summary if other is None else [summary, other], sys.stdout, indent=2)
+        print()
+    else:
+        print_summary(summary)
+        if other is not None:
+            print_summary(other)
+            print_comparison(summary, other)
+
+
+if __name__ == "__main__":
+    main()
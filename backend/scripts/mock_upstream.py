@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the STM and WeatherAPI endpoints, for load testing.
+
+Serves synthetic tripUpdates / vehiclePositions protobufs, etatservice
+alerts and WeatherAPI current.json with configurable latency, error rate,
+rate limiting and feed size. Point the backend at it with:
+
+    STM_REALTIME_ENDPOINT=http://127.0.0.1:8090/pub/od/gtfs-rt/ic/v2/tripUpdates
+    STM_VEHICLE_POSITIONS_ENDPOINT=http://127.0.0.1:8090/pub/od/gtfs-rt/ic/v2/vehiclePositions
+    STM_ALERTS_ENDPOINT=http://127.0.0.1:8090/pub/od/i3/v2/messages/etatservice
+    WEATHER_API_ENDPOINT=http://127.0.0.1:8090/v1/current.json
+
+(the exact lines are printed on startup).
+
+Usage:
+    python -m backend.scripts.mock_upstream --latency-ms 250 --jitter-ms 100 \\
+        --error-rate 0.02 --rate-limit 10 --trips 1500
+"""
+import os
+import sys
+import csv
+import time
+import random
+import argparse
+import threading
+
+from flask import Flask, Response, jsonify
+
+from backend.scripts import synthetic
+
+TRIP_UPDATES_PATH = "/pub/od/gtfs-rt/ic/v2/tripUpdates"
+VEHICLE_POSITIONS_PATH = "/pub/od/gtfs-rt/ic/v2/vehiclePositions"
+ALERTS_PATH = "/pub/od/i3/v2/messages/etatservice"
+WEATHER_PATH = "/v1/current.json"
+
+
+class TokenBucket:
+    """Requests-per-second limiter; rate <= 0 disables it."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class FeedGenerator:
+    """Regenerates the synthetic payloads every `refresh` seconds, like STM's 30 s cadence."""
+
+    def __init__(self, args, trip_ids_by_route):
+        self.args = args
+        self.trip_ids_by_route = trip_ids_by_route
+        self.refresh = args.feed_refresh
+        self.lock = threading.Lock()
+        self.generated_at = 0
+        self.generation = 0
+        self.payloads = {}
+
+    def get(self, name):
+        with self.lock:
+            if time.time() - self.generated_at >= self.refresh:
+                self._regenerate()
+            return self.payloads[name]
+
+    def _regenerate(self):
+        now = int(time.time())
+        self.generation += 1
+        seed = self.args.seed + self.generation
+        self.payloads = {
+            "trip_updates": synthetic.build_trip_updates(
+                self.args.trips, self.args.stops_per_trip, now, seed, self.trip_ids_by_route),
+            "vehicle_positions": synthetic.build_vehicle_positions(
+                self.args.trips, now, seed, self.trip_ids_by_route),
+            "alerts": synthetic.build_alerts(self.args.alerts, seed),
+            "weather": synthetic.build_weather(seed),
+        }
+        self.generated_at = now
+
+
+def load_trip_ids_by_route(gtfs_dir):
+    """Real trip ids per route short name, so vehicle positions validate against local GTFS."""
+    routes_fp = os.path.join(gtfs_dir, "routes.txt")
+    trips_fp = os.path.join(gtfs_dir, "trips.txt")
+    with open(routes_fp, encoding="utf-8-sig") as f:
+        short_names = {row["route_id"]: row["route_short_name"] for row in csv.DictReader(f)}
+    trip_ids = {}
+    with open(trips_fp, encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            route = short_names.get(row["route_id"], row["route_id"])
+            trip_ids.setdefault(route, []).append(row["trip_id"])
+    return trip_ids
+
+
+def create_app(args):
+    app = Flask(__name__)
+    trip_ids_by_route = load_trip_ids_by_route(args.gtfs_dir) if args.gtfs_dir else None
+    generator = FeedGenerator(args, trip_ids_by_route)
+    buckets = {}
+    rng = random.Random(args.seed)
+    rng_lock = threading.Lock()
+    stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+
+    def upstream(name):
+        """Apply rate limiting, latency and injected errors; returns an error response or None."""
+        stats["requests"] += 1
+        bucket = buckets.setdefault(name, TokenBucket(args.rate_limit))
+        if not bucket.allow():
+            stats["rate_limited"] += 1
+            return Response("Too Many Requests", status=429)
+        with rng_lock:
+            delay = max(0.0, rng.gauss(args.latency_ms, args.jitter_ms)) / 1000.0
+            fail = rng.random() < args.error_rate
+        time.sleep(delay)
+        if fail:
+            stats["errors"] += 1
+            return Response("Injected upstream error", status=503)
+        return None
+
+    @app.route(TRIP_UPDATES_PATH)
+    def trip_updates():
+        return upstream("trip_updates") or Response(
+            generator.get("trip_updates"), mimetype="application/x-protobuf")
+
+    @app.route(VEHICLE_POSITIONS_PATH)
+    def vehicle_positions():
+        return upstream("vehicle_positions") or Response(
+            generator.get("vehicle_positions"), mimetype="application/x-protobuf")
+
+    @app.route(ALERTS_PATH)
+    def alerts():
+        return upstream("alerts") or jsonify(generator.get("alerts"))
+
+    @app.route(WEATHER_PATH)
+    def weather():
+        return upstream("weather") or jsonify(generator.get("weather"))
+
+    @app.route("/_stats")
+    def mock_stats():
+        return jsonify({**stats, "generation": generator.generation})
+
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local STM/WeatherAPI stand-in for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=150, help="mean upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=50, help="latency standard deviation")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--rate-limit", type=float, default=0, help="requests/s per endpoint, 0 = unlimited")
+    parser.add_argument("--trips", type=int, default=1500, help="trip updates / vehicles per feed")
+    parser.add_argument("--stops-per-trip", type=int, default=30)
+    parser.add_argument("--alerts", type=int, default=40)
+    parser.add_argument("--feed-refresh", type=float, default=30, help="seconds between feed generations")
+    parser.add_argument("--gtfs-dir", help="use real trip ids from this GTFS directory")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    app = create_app(args)
+    base = f"http://{args.host}:{args.port}"
+    print("Mock upstream ready. Start the backend with:")
+    print(f"  STM_REALTIME_ENDPOINT={base}{TRIP_UPDATES_PATH}")
+    print(f"  STM_VEHICLE_POSITIONS_ENDPOINT={base}{VEHICLE_POSITIONS_PATH}")
+    print(f"  STM_ALERTS_ENDPOINT={base}{ALERTS_PATH}")
+    print(f"  WEATHER_API_ENDPOINT={base}{WEATHER_PATH}")
+    sys.stdout.flush()
+
+    from waitress import serve
+    serve(app, host=args.host, port=args.port, threads=args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Multi-process deployment: one fetcher, N read-only API workers.
+
+The fetcher process loads GTFS, polls STM / WeatherAPI and publishes the
+API sections to a memory-mapped snapshot (backend/managers/snapshot_manager.py)
+every SNAPSHOT_INTERVAL seconds. Worker processes skip GTFS loading and
+never call upstream; they serve the published bytes, so adding workers
+adds cores without adding memory for the GTFS dicts or upstream calls.
+
+On Linux all workers bind the same port with SO_REUSEPORT and the kernel
+spreads connections between them; elsewhere worker i listens on port + i.
+Dead processes are restarted.
+
+Usage:
+    python -m backend.scripts.serve_workers --workers 4 --port 5000
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+
+RESTART_DELAY = 2           # seconds before restarting a process that exited
+FIRST_SNAPSHOT_TIMEOUT = 120
+
+
+def _spawn(role, args, port=None):
+    env = dict(os.environ, SNAPSHOT_ROLE=role)
+    if args.snapshot_dir:
+        env["SNAPSHOT_DIR"] = args.snapshot_dir
+    cmd = [sys.executable, "-m", "backend.scripts.serve_workers", role]
+    if port is not None:
+        cmd += ["--port", str(port), "--threads", str(args.threads)]
+        if args.reuse_port:
+            cmd.append("--reuse-port")
+    return subprocess.Popen(cmd, env=env)
+
+
+def _wait_for_snapshot(snapshot_dir, fetcher):
+    from backend.managers.snapshot_manager import SnapshotReader
+
+    reader = SnapshotReader(snapshot_dir)
+    deadline = time.monotonic() + FIRST_SNAPSHOT_TIMEOUT
+    while reader.current() is None:
+        if fetcher.poll() is not None or time.monotonic() > deadline:
+            return False
+        time.sleep(0.5)
+    return True
+
+
+def launch(args):
+    if args.snapshot_dir is None:
+        from backend.config import SNAPSHOT_DIR
+        args.snapshot_dir = SNAPSHOT_DIR
+    args.reuse_port = hasattr(socket, "SO_REUSEPORT") and not args.no_reuse_port
+
+    fetcher = _spawn("fetcher", args)
+    print(f"[SERVE] Fetcher started (pid {fetcher.pid}), waiting for the first snapshot...")
+    if not _wait_for_snapshot(args.snapshot_dir, fetcher):
+        print("[SERVE] No snapshot published; workers will answer 503 until one is")
+
+    ports = [args.port if args.reuse_port else args.port + i for i in range(args.workers)]
+    workers = [_spawn("worker", args, port) for port in ports]
+    for port, proc in zip(ports, workers):
+        print(f"[SERVE] Worker pid {proc.pid} on http://0.0.0.0:{port}")
+
+    try:
+        while True:
+            time.sleep(1)
+            if fetcher.poll() is not None:
+                print(f"[SERVE] Fetcher exited ({fetcher.returncode}), restarting")
+                time.sleep(RESTART_DELAY)
+                fetcher = _spawn("fetcher", args)
+            for i, proc in enumerate(workers):
+                if proc.poll() is not None:
+                    print(f"[SERVE] Worker on port {ports[i]} exited ({proc.returncode}), restarting")
+                    time.sleep(RESTART_DELAY)
+                    workers[i] = _spawn("worker", args, ports[i])
+    except KeyboardInterrupt:
+        print("[SERVE] Stopping...")
+    finally:
+        for proc in [fetcher] + workers:
+            proc.terminate()
+        for proc in [fetcher] + workers:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return 0
+
+
+def run_fetcher(args):
+    from backend import main
+    main.run_snapshot_publisher()
+
+
+def run_worker(args):
+    from waitress import serve
+    from backend import main
+
+    if args.reuse_port:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(("0.0.0.0", args.port))
+        serve(main.app, sockets=[sock], threads=args.threads)
+    else:
+        serve(main.app, host="0.0.0.0", port=args.port, threads=args.threads)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a snapshot fetcher and N API worker processes")
+    sub = parser.add_subparsers(dest="command")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)))
+    parser.add_argument("--threads", type=int, default=8, help="Waitress threads per worker")
+    parser.add_argument("--snapshot-dir", help="defaults to SNAPSHOT_DIR")
+    parser.add_argument("--no-reuse-port", action="store_true", help="one port per worker even on Linux")
+
+    sub.add_parser("fetcher", help=argparse.SUPPRESS)
+    p_worker = sub.add_parser("worker", help=argparse.SUPPRESS)
+    p_worker.add_argument("--port", type=int, required=True)
+    p_worker.add_argument("--threads", type=int, default=8)
+    p_worker.add_argument("--reuse-port", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "fetcher":
+        return run_fetcher(args)
+    if args.command == "worker":
+        return run_worker(args)
+    return launch(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+"""
+Synthetic STM-like GTFS and realtime payloads.
+
+Used by the local upstream stand-in (mock_upstream.py) and by the
+benchmarks to produce a static GTFS feed, GTFS-RT feeds, etatservice alerts
+and WeatherAPI responses with a controllable size. Everything is seeded so
+that two runs with the same parameters produce the same data.
+"""
+import os
+import csv
+import json
+import random
+import time
+from datetime import date, timedelta
+
+from google.transit import gtfs_realtime_pb2
+
+from backend.config import BUS_ROUTE_COMBOS
+
+METRO_LINES = ["1", "2", "4", "5"]
+
+# Rough size of the real STM feed: ~220 bus routes, ~6M stop_times rows.
+STM_SCALE_ROUTES = 220
+STM_SCALE_TRIPS_PER_ROUTE = 800
+STM_SCALE_STOPS_PER_TRIP = 35
+
+SERVICE_IDS = ["WKD", "SAT", "SUN"]
+SHAPE_POINTS_PER_HOP = 12         # shape points between two consecutive stops
+
+
+def _filler_route(rng):
+    route = str(rng.randint(10, 999))
+    while route in {combo[0] for combo in BUS_ROUTE_COMBOS}:
+        route = str(rng.randint(10, 999))
+    return route
+
+
+def _plan_trips(n_trips, rng, trip_ids_by_route=None, watched_share=0.05):
+    """Return a list of (route_id, trip_id, watched_stop_or_None)."""
+    trips = []
+    watched = max(len(BUS_ROUTE_COMBOS), int(n_trips * watched_share))
+    for i in range(n_trips):
+        if i < watched:
+            route_id, stop_id, _ = BUS_ROUTE_COMBOS[i % len(BUS_ROUTE_COMBOS)]
+        else:
+            route_id, stop_id = _filler_route(rng), None
+        known = (trip_ids_by_route or {}).get(route_id)
+        trip_id = rng.choice(known) if known else f"{route_id}_{i:06d}"
+        trips.append((route_id, trip_id, stop_id))
+    return trips
+
+
+def build_trip_updates(n_trips=1500, stops_per_trip=30, now=None, seed=0, trip_ids_by_route=None):
+    """Serialized FeedMessage with n_trips trip updates, a share of them on our watched stops."""
+    rng = random.Random(seed)
+    now = int(now or time.time())
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.timestamp = now
+
+    for n, (route_id, trip_id, watched_stop) in enumerate(_plan_trips(n_trips, rng, trip_ids_by_route)):
+        entity = feed.entity.add()
+        entity.id = str(n)
+        tu = entity.trip_update
+        tu.trip.trip_id = trip_id
+        tu.trip.route_id = route_id
+        tu.trip.start_date = time.strftime("%Y%m%d", time.localtime(now))
+
+        first_arrival = now + rng.randint(-600, 1800)
+        watched_pos = rng.randrange(stops_per_trip) if watched_stop else -1
+        for seq in range(stops_per_trip):
+            stu = tu.stop_time_update.add()
+            stu.stop_sequence = seq + 1
+            stu.stop_id = watched_stop if seq == watched_pos else str(50000 + rng.randint(0, 9999))
+            arrival = first_arrival + seq * 90
+            stu.arrival.time = arrival
+            stu.arrival.delay = rng.randint(-60, 300)
+            stu.departure.time = arrival + 15
+            if rng.random() < 0.002:
+                stu.schedule_relationship = gtfs_realtime_pb2.TripUpdate.StopTimeUpdate.SKIPPED
+    return feed.SerializeToString()
+
+
+def build_vehicle_positions(n_trips=1500, now=None, seed=0, trip_ids_by_route=None):
+    """Serialized FeedMessage with one vehicle per planned trip (same plan as build_trip_updates)."""
+    rng = random.Random(seed)
+    now = int(now or time.time())
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.timestamp = now
+
+    for n, (route_id, trip_id, watched_stop) in enumerate(_plan_trips(n_trips, rng, trip_ids_by_route)):
+        entity = feed.entity.add()
+        entity.id = str(n)
+        vp = entity.vehicle
+        vp.trip.trip_id = trip_id
+        vp.trip.route_id = route_id
+        vp.vehicle.id = str(20000 + n)
+        vp.position.latitude = 45.45 + rng.random() * 0.15
+        vp.position.longitude = -73.70 + rng.random() * 0.20
+        vp.current_status = rng.choice([0, 1, 2])
+        vp.occupancy_status = rng.choice([1, 2, 3, 4])
+        vp.stop_id = watched_stop or str(50000 + rng.randint(0, 9999))
+        vp.timestamp = now - rng.randint(0, 30)
+    return feed.SerializeToString()
+
+
+def build_alerts(n_alerts=40, seed=0, disrupted_metro_lines=()):
+    """etatservice-shaped JSON document with n_alerts bus alerts and optional metro disruptions."""
+    rng = random.Random(seed)
+    alerts = []
+    watched_routes = sorted({combo[0] for combo in BUS_ROUTE_COMBOS})
+    for i in range(n_alerts):
+        route = rng.choice(watched_routes) if i % 5 == 0 else _filler_route(rng)
+        entities = [{"route_short_name": route}]
+        if i % 3 == 0:
+            entities.append({"route_short_name": route, "stop_code": str(50000 + rng.randint(0, 9999))})
+        alerts.append({
+            "active_periods": {"start": int(time.time()) - 3600, "end": None},
+            "cause": "OTHER_CAUSE",
+            "effect": "DETOUR" if i % 7 else "NO_SERVICE",
+            "informed_entities": entities,
+            "header_texts": [{"language": "fr", "text": f"Ligne {route} : déviation"}],
+            "description_texts": [{"language": "fr", "text": f"<p>Arrêt déplacé, travaux #{i}</p>"}],
+        })
+    for line in disrupted_metro_lines:
+        alerts.append({
+            "informed_entities": [{"route_short_name": line}],
+            "header_texts": [{"language": "fr", "text": f"Ligne {line} : interruption"}],
+            "description_texts": [{"language": "fr", "text": "Interruption de service entre deux stations."}],
+        })
+    return {"header": {"timestamp": int(time.time())}, "alerts": alerts}
+
+
+def build_weather(seed=0):
+    """WeatherAPI current.json-shaped document."""
+    rng = random.Random(seed)
+    return {
+        "location": {"name": "Montreal", "region": "Quebec"},
+        "current": {
+            "temp_c": round(rng.uniform(-25, 30), 1),
+            "condition": {
+                "text": "Partiellement nuageux",
+                "icon": "//cdn.weatherapi.com/weather/64x64/day/116.png",
+                "code": 1003,
+            },
+        },
+    }
+
+
+def _fmt_gtfs_time(seconds):
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def write_gtfs(out_dir, scale=1.0, seed=0, n_routes=STM_SCALE_ROUTES,
+               trips_per_route=None, stops_per_trip=STM_SCALE_STOPS_PER_TRIP):
+    """
+    Write an STM-shaped static GTFS feed (routes, trips, stop_times, stops,
+    shapes, calendar, calendar_dates) to out_dir. scale=1.0 approximates the real STM
+    feed size; the watched BUS_ROUTE_COMBOS always exist so the API has data.
+    Returns a dict of row counts.
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    if trips_per_route is None:
+        trips_per_route = max(2, int(STM_SCALE_TRIPS_PER_ROUTE * scale))
+
+    watched_routes = []
+    for route_id, _, _ in BUS_ROUTE_COMBOS:
+        if route_id not in watched_routes:
+            watched_routes.append(route_id)
+    routes = list(watched_routes)
+    while len(routes) < n_routes:
+        route = _filler_route(rng)
+        if route not in routes:
+            routes.append(route)
+
+    watched_stops = {combo[1] for combo in BUS_ROUTE_COMBOS}
+    pool = [str(50000 + i) for i in range(max(500, n_routes * 40)) if str(50000 + i) not in watched_stops]
+
+    # One stop pattern per (route, direction); watched stops sit on the
+    # direction of their combo (Est = 0, Ouest = 1).
+    patterns = {}
+    for route in routes:
+        for direction in (0, 1):
+            patterns[(route, direction)] = rng.sample(pool, stops_per_trip)
+    for i, (route_id, stop_id, _) in enumerate(BUS_ROUTE_COMBOS):
+        pattern = patterns[(route_id, i % 2)]
+        pattern[rng.randrange(1, stops_per_trip - 1)] = stop_id
+
+    with open(os.path.join(out_dir, "routes.txt"), "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["route_id", "agency_id", "route_short_name", "route_long_name", "route_type"])
+        for route in routes:
+            w.writerow([route, "STM", route, f"Ligne {route}", 3])
+
+    used_stops = sorted({stop for pattern in patterns.values() for stop in pattern})
+    coords = {}
+    with open(os.path.join(out_dir, "stops.txt"), "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["stop_id", "stop_code", "stop_name", "stop_lat", "stop_lon", "location_type"])
+        for stop in used_stops:
+            lat = 45.41 + rng.random() * 0.25
+            lon = -73.95 + rng.random() * 0.45
+            coords[stop] = (lat, lon)
+            w.writerow([stop, stop, f"Arrêt {stop}", f"{lat:.6f}", f"{lon:.6f}", 0])
+
+    # One shape per pattern through its stops, SHAPE_POINTS_PER_HOP points
+    # between two stops with a little jitter (own RNG: the other files do not change)
+    n_shape_points = 0
+    shape_rng = random.Random(seed + 1)
+    with open(os.path.join(out_dir, "shapes.txt"), "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["shape_id", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence"])
+        for (route, direction), pattern in patterns.items():
+            seq = 0
+            for a, b in zip(pattern, pattern[1:]):
+                (lat1, lon1), (lat2, lon2) = coords[a], coords[b]
+                for k in range(SHAPE_POINTS_PER_HOP):
+                    t = k / SHAPE_POINTS_PER_HOP
+                    jitter = 0 if k == 0 else 0.00005
+                    seq += 1
+                    w.writerow([f"{route}_{direction}",
+                                f"{lat1 + t * (lat2 - lat1) + shape_rng.uniform(-jitter, jitter):.6f}",
+                                f"{lon1 + t * (lon2 - lon1) + shape_rng.uniform(-jitter, jitter):.6f}", seq])
+            seq += 1
+            w.writerow([f"{route}_{direction}", f"{coords[pattern[-1]][0]:.6f}", f"{coords[pattern[-1]][1]:.6f}", seq])
+            n_shape_points += seq
+
+    today = date.today()
+    start, end = (today - timedelta(days=30)).strftime("%Y%m%d"), (today + timedelta(days=60)).strftime("%Y%m%d")
+    with open(os.path.join(out_dir, "calendar.txt"), "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["service_id", "monday", "tuesday", "wednesday", "thursday", "friday",
+                    "saturday", "sunday", "start_date", "end_date"])
+        w.writerow(["WKD", 1, 1, 1, 1, 1, 0, 0, start, end])
+        w.writerow(["SAT", 0, 0, 0, 0, 0, 1, 0, start, end])
+        w.writerow(["SUN", 0, 0, 0, 0, 0, 0, 1, start, end])
+    with open(os.path.join(out_dir, "calendar_dates.txt"), "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["service_id", "date", "exception_type"])
+        w.writerow(["WKD", (today + timedelta(days=14)).strftime("%Y%m%d"), 2])
+
+    n_trips = n_stop_times = 0
+    service_span = 20 * 3600  # 05:00 to 25:00
+    with open(os.path.join(out_dir, "trips.txt"), "w", newline="", encoding="utf-8") as tf, \
+         open(os.path.join(out_dir, "stop_times.txt"), "w", newline="", encoding="utf-8") as sf:
+        tw, sw = csv.writer(tf), csv.writer(sf)
+        tw.writerow(["route_id", "service_id", "trip_id", "trip_headsign", "direction_id",
+                     "shape_id", "wheelchair_accessible", "block_id"])
+        sw.writerow(["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence"])
+        for r, route in enumerate(routes):
+            for i in range(trips_per_route):
+                direction = i % 2
+                service_id = SERVICE_IDS[i % len(SERVICE_IDS)]
+                trip_id = str(200000000 + r * 100000 + i)
+                tw.writerow([route, service_id, trip_id, f"{route} {'Est' if direction == 0 else 'Ouest'}",
+                             direction, f"{route}_{direction}", rng.choice([0, 1, 1, 1]),
+                             f"{route}-{i // 6}"])
+                t = 5 * 3600 + (i * service_span) // trips_per_route + rng.randint(0, 120)
+                for seq, stop in enumerate(patterns[(route, direction)], start=1):
+                    sw.writerow([trip_id, _fmt_gtfs_time(t), _fmt_gtfs_time(t), stop, seq])
+                    t += rng.randint(45, 150)
+                n_trips += 1
+                n_stop_times += stops_per_trip
+
+    return {"routes": len(routes), "stops": len(used_stops), "trips": n_trips, "stop_times": n_stop_times,
+            "shape_points": n_shape_points}
+
+
+def write_realtime_fixtures(out_dir, n_feeds=3, n_trips=1500, stops_per_trip=30,
+                            start_ts=None, interval=30, seed=0, trip_ids_by_route=None):
+    """
+    Write a replay fixture directory (see loaders/replay.py) with n_feeds
+    generations of trip updates / vehicle positions plus alerts and weather.
+    """
+    start_ts = int(start_ts or time.time())
+    for sub in ("trip_updates", "vehicle_positions", "alerts", "weather"):
+        os.makedirs(os.path.join(out_dir, sub), exist_ok=True)
+    for n in range(n_feeds):
+        ts = start_ts + n * interval
+        with open(os.path.join(out_dir, "trip_updates", f"{ts}.pb"), "wb") as f:
+            f.write(build_trip_updates(n_trips, stops_per_trip, ts, seed + n, trip_ids_by_route))
+        with open(os.path.join(out_dir, "vehicle_positions", f"{ts}.pb"), "wb") as f:
+            f.write(build_vehicle_positions(n_trips, ts, seed + n, trip_ids_by_route))
+    with open(os.path.join(out_dir, "alerts", f"{start_ts}.json"), "w", encoding="utf-8") as f:
+        json.dump(build_alerts(seed=seed, disrupted_metro_lines=["2"]), f, ensure_ascii=False)
+    with open(os.path.join(out_dir, "weather", f"{start_ts}.json"), "w", encoding="utf-8") as f:
+        json.dump(build_weather(seed), f)